@@ -1,6 +1,6 @@
 __package__ = 'abx.archivebox'
 
-from typing import Iterable, List
+from typing import Iterable, List, Set, Tuple, NamedTuple, Optional
 from pydantic import Field
 
 import abx
@@ -8,6 +8,11 @@ from .base_hook import BaseHook, HookType
 
 
 
+class SearchHit(NamedTuple):
+    snapshot_id: str
+    snippet: Optional[str] = None       # excerpt of the matching text with the query terms highlighted, if the backend can provide one
+
+
 class BaseSearchBackend(BaseHook):
     hook_type: HookType = 'SEARCHBACKEND'
 
@@ -20,13 +25,36 @@ class BaseSearchBackend(BaseHook):
     def index(snapshot_id: str, texts: List[str]):
         return
 
+    def index_many(self, items: Iterable[Tuple[str, List[str]]]):
+        """index many (snapshot_id, texts) pairs at once, backends should override this to batch their writes"""
+        for snapshot_id, texts in items:
+            self.index(snapshot_id=snapshot_id, texts=texts)
+
     @staticmethod
     def flush(snapshot_ids: Iterable[str]):
         return
 
+    @staticmethod
+    def optimize():
+        """compact the index after a large number of writes (e.g. a full reindex), if the backend supports it"""
+        return
+
     @staticmethod
     def search(text: str) -> List[str]:
         raise NotImplementedError("search method must be implemented by subclass")
+
+    def search_ranked(self, text: str, limit: int, offset: int=0) -> List[SearchHit]:
+        """get one page of matches, best match first, backends should override this to rank and page natively"""
+        snapshot_ids = self.search(text)
+        return [SearchHit(snapshot_id=str(snapshot_id)) for snapshot_id in snapshot_ids[offset:offset + limit]]
+
+    def count(self, text: str) -> int:
+        """get the total number of matches for a query"""
+        return len(self.search(text))
+
+    def list_ids(self) -> Optional[Set[str]]:
+        """get the ids of every snapshot in the index, or None if the backend has no way to list them"""
+        return None
     
     @abx.hookimpl
     def get_SEARCHBACKENDS(self):
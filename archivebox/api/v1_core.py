@@ -17,6 +17,7 @@ from ninja.errors import HttpError
 from core.models import Snapshot, ArchiveResult, Tag
 from api.models import APIToken, OutboundWebhook
 from abid_utils.abid import ABID
+from archivebox.search import SearchResults
 
 from .auth import API_AUTH_METHODS
 
@@ -219,6 +220,8 @@ class SnapshotSchema(Schema):
     num_archiveresults: int
     archiveresults: List[MinimalArchiveResultSchema]
 
+    search_snippet: Optional[str]
+
     @staticmethod
     def resolve_created_by_id(obj):
         return str(obj.created_by_id)
@@ -244,6 +247,10 @@ class SnapshotSchema(Schema):
     # def resolve_url_for_view(obj):
     #     return f"/{obj.archive_path}"
 
+    @staticmethod
+    def resolve_search_snippet(obj):
+        return getattr(obj, 'search_snippet', None)
+
     @staticmethod
     def resolve_num_archiveresults(obj, context):
         return obj.archiveresult_set.all().distinct().count()
@@ -282,12 +289,14 @@ class SnapshotFilterSchema(FilterSchema):
 
 @router.get("/snapshots", response=List[SnapshotSchema], url_name="get_snapshots")
 @paginate(CustomPagination)
-def get_snapshots(request, filters: SnapshotFilterSchema = Query(...), with_archiveresults: bool=False):
-    """List all Snapshot entries matching these filters."""
+def get_snapshots(request, filters: SnapshotFilterSchema = Query(...), with_archiveresults: bool=False, fulltext: Optional[str]=None):
+    """List all Snapshot entries matching these filters (pass fulltext=... to page through full-text search matches, best match first)."""
     request.with_archiveresults = with_archiveresults
 
     qs = Snapshot.objects.all()
     results = filters.filter(qs).distinct()
+    if fulltext:
+        return SearchResults(fulltext, snapshots=results)
     return results
 
 @router.get("/snapshot/{snapshot_id}", response=SnapshotSchema, url_name="get_snapshot")
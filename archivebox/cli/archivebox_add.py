@@ -94,6 +94,11 @@ def main(args: Optional[List[str]]=None, stdin: Optional[IO]=None, pwd: Optional
         default="auto",
         choices=["auto", *PARSERS.keys()],
     )
+    parser.add_argument(
+        "--stream",
+        action='store_true',
+        help="Parse, index, and archive the input in batches as it's read, instead of loading it all into memory first (for huge imports)",
+    )
     command = parser.parse_args(args or ())
     urls = command.urls
 
@@ -118,6 +123,7 @@ def main(args: Optional[List[str]]=None, stdin: Optional[IO]=None, pwd: Optional
         init=command.init,
         extractors=command.extract,
         parser=command.parser,
+        stream=command.stream,
         out_dir=pwd or DATA_DIR,
     )
 
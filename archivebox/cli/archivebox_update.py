@@ -45,6 +45,21 @@ def main(args: Optional[List[str]]=None, stdin: Optional[IO]=None, pwd: Optional
         action='store_true',
         help="Update the main index without archiving any content",
     )
+    parser.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help="With --index-only, clear and rewrite the search index entries for the matching links, then compact the search index",
+    )
+    parser.add_argument(
+        '--check-index',
+        action='store_true',
+        help="Compare the search index with the matching links and report which ones are missing from it, stale, or orphaned, without changing anything",
+    )
+    parser.add_argument(
+        '--repair-index',
+        action='store_true',
+        help="Like --check-index, then reindex only the missing and stale links and remove the orphaned ones from the search index",
+    )
     parser.add_argument(
         '--resume', #'-r',
         type=float,
@@ -120,6 +135,9 @@ def main(args: Optional[List[str]]=None, stdin: Optional[IO]=None, pwd: Optional
         resume=command.resume,
         only_new=command.only_new,
         index_only=command.index_only,
+        rebuild_index=command.rebuild_index,
+        check_index=command.check_index,
+        repair_index=command.repair_index,
         overwrite=command.overwrite,
         filter_patterns_str=filter_patterns_str,
         filter_patterns=command.filter_patterns,
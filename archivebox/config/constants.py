@@ -194,6 +194,7 @@ class ConstantsDict(Mapping):
         *DATA_FILE_NAMES,
         "static",                # created by old static exports <v0.6.0
         "sonic",                 # created by docker bind mount
+        "search_index",          # created by the invindex search backend
     ))
 
     CODE_LOCATIONS = benedict({
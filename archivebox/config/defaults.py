@@ -4,7 +4,7 @@ import os
 import sys
 import shutil
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from pathlib import Path
 
@@ -117,6 +117,7 @@ class StorageConfig(BaseConfigSet):
     OUTPUT_PERMISSIONS: str             = Field(default='644')
     RESTRICT_FILE_NAMES: str            = Field(default='windows')
     ENFORCE_ATOMIC_WRITES: bool         = Field(default=True)
+    SCAN_WORKERS: int                   = Field(default=os.cpu_count() or 1)   # number of processes used to scan archive/ data folders (e.g. during init)
     
     # not supposed to be user settable:
     DIR_OUTPUT_PERMISSIONS: str         = Field(default=lambda c: c['OUTPUT_PERMISSIONS'].replace('6', '7').replace('4', '5'))
@@ -152,6 +153,8 @@ class ServerConfig(BaseConfigSet):
     REVERSE_PROXY_WHITELIST: str        = Field(default='')
     LOGOUT_REDIRECT_URL: str            = Field(default='/')
     PREVIEW_ORIGINALS: bool             = Field(default=True)
+    SERVE_STATIC_MODE: str              = Field(default='sendfile')   # how archived files are sent: sendfile (FileResponse, zero-copy on servers with a sendfile wsgi.file_wrapper), stream (python generator), x-accel-redirect (nginx), x-sendfile (apache/lighttpd/caddy)
+    SERVE_STATIC_ACCEL_PREFIX: str      = Field(default='/_archivebox_data/')   # internal nginx location aliased to DATA_DIR, used when SERVE_STATIC_MODE=x-accel-redirect
     
 SERVER_CONFIG = ServerConfig()
 
@@ -170,6 +173,16 @@ class ArchivingConfig(BaseConfigSet):
     
     URL_DENYLIST: str                   = Field(default=r'\.(css|js|otf|ttf|woff|woff2|gstatic\.com|googleapis\.com/css)(\?.*)?$', alias='URL_BLACKLIST')
     URL_ALLOWLIST: str | None           = Field(default=None, alias='URL_WHITELIST')
+
+    ARCHIVING_WORKERS: int              = Field(default=1)     # number of snapshots to archive at the same time
+    ARCHIVING_MAX_PER_DOMAIN: int       = Field(default=2)     # max snapshots of the same domain to archive at the same time
+    ARCHIVING_EXTRACTOR_WORKERS: int    = Field(default=1)     # number of independent extractors to run at the same time within one snapshot
+    ARCHIVING_MAX_CPU_PERCENT: int      = Field(default=90)    # dont start new snapshots while system CPU usage is above this
+    ARCHIVING_MAX_MEMORY_PERCENT: int   = Field(default=90)    # dont start new snapshots while system memory usage is above this
+
+    PRECOMPRESS_OUTPUTS: bool           = Field(default=False) # write .br/.gz copies of compressible outputs (html, css, js, txt...) in the background after archiving, sent instead of the originals to browsers that accept them
+    PRECOMPRESS_FORMATS: List[str]      = Field(default=['br', 'gz'])   # br is skipped if the brotli package isn't installed
+    PRECOMPRESS_MIN_SIZE: int           = Field(default=1024)  # bytes, smaller outputs aren't worth precompressing
     
     # GIT_DOMAINS: str                    = Field(default='github.com,bitbucket.org,gitlab.com,gist.github.com,codeberg.org,gitea.com,git.sr.ht')
     # WGET_USER_AGENT: str                = Field(default=lambda c: c['USER_AGENT'] + ' wget/{WGET_VERSION}')
@@ -211,6 +224,15 @@ class SearchBackendConfig(BaseConfigSet):
     SEARCH_BACKEND_ENGINE: str          = Field(default='ripgrep')
     SEARCH_PROCESS_HTML: bool           = Field(default=True)
     SEARCH_BACKEND_TIMEOUT: int         = Field(default=10)
+    SEARCH_RESULTS_LIMIT: int           = Field(default=500)    # max full-text matches to mix into metadata searches (e.g. the admin search box)
+    SEARCH_MAX_TEXT_LENGTH: int         = Field(default=10_000_000)    # max chars of text sent to the search backend per snapshot
+    SEARCH_CACHE_SIZE: int              = Field(default=1000)   # number of recent search backend results to keep (0 to disable)
+    SEARCH_CACHE_TTL: int               = Field(default=300)    # seconds before a cached search result is re-fetched from the backend
+    SEARCH_INDEX_DELAY: int             = Field(default=5)      # seconds to wait before indexing a new snapshot, so the outputs of all its extractors get indexed in one write
+    SEARCH_INDEX_BATCH_SIZE: int        = Field(default=100)    # max snapshots sent to the search backend per background indexing batch
+    SEARCH_INDEX_RETRIES: int           = Field(default=3)      # times to retry indexing a snapshot after the search backend fails
+    SEARCH_INDEX_RETRY_DELAY: int       = Field(default=60)     # seconds before the first retry, doubled after each failed attempt
+    SEARCH_INDEX_WORKERS: int           = Field(default=4)      # threads reading output files in parallel when checking/repairing the search index
 
 SEARCH_BACKEND_CONFIG = SearchBackendConfig()
 
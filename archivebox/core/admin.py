@@ -475,16 +475,20 @@ class SnapshotAdmin(SearchResultsAdminMixin, ABIDModelAdmin):
         # ordering='archiveresult_count'
     )
     def size(self, obj):
-        archive_size = (Path(obj.link_dir) / 'index.html').exists() and obj.archive_size
+        archive_size = obj.manifest['has_index'] and obj.archive_size
         if archive_size:
             size_txt = printable_filesize(archive_size)
             if archive_size > 52428800:
                 size_txt = mark_safe(f'<b>{size_txt}</b>')
         else:
             size_txt = mark_safe('<span style="opacity: 0.3">...</span>')
+        title = 'View all files'
+        if archive_size and obj.precompressed_size:
+            title += f' (includes {printable_filesize(obj.precompressed_size)} of precompressed .br/.gz copies)'
         return format_html(
-            '<a href="/{}" title="View all files">{}</a>',
+            '<a href="/{}" title="{}">{}</a>',
             obj.archive_path,
+            title,
             size_txt,
         )
 
@@ -0,0 +1,329 @@
+__package__ = 'archivebox.core'
+
+"""
+What's in a snapshot's folder, recorded by archive_link after each extractor so it can be read from the db instead of
+the filesystem:
+    - SnapshotFile: one row per file (path, size, mimetype, sha256, mtime), only rehashed when its size or mtime changes
+    - Snapshot.output_manifest: a summary of the folder for the live index, admin and Link/Snapshot accessors
+      (size, is_archived, canonical paths, headers...)
+
+The manifest stores a results_key (count and latest modified_at/end_ts of the snapshot's ArchiveResults) and is only
+used while that still matches the db, so snapshots archived before manifests existed or changed since (by another
+version, a manual edit...) fall back to checking the filesystem until archive_link, the precompress task,
+`archivebox init` or `archivebox update --index-only` store a current one.
+"""
+
+import json
+import time
+import hashlib
+import mimetypes
+
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Q, Count, Max
+
+from archivebox.misc.precompress import PRECOMPRESSED_DIR_NAME, get_precompressed_size, iter_outputs
+from archivebox.misc.util import ts_to_date_str
+from archivebox.misc.logging import stderr
+
+
+# bump this whenever the structure of the manifest changes, older manifests are then ignored until archivebox init rebuilds them
+MANIFEST_VERSION = 3
+
+# results that aren't worth showing on their own in the live index
+HIDDEN_RESULTS = ('favicon', 'headers', 'title', 'htmltotext', 'warc', 'archive_org')
+
+# other files in the snapshot dir (or one level below) get listed in the live index if they're bigger than this
+PREVIEW_MIN_SIZE = 10_000  # bytes
+PREVIEW_EXTENSIONS = {
+    'txt',
+    'html',
+    'htm',
+    'png',
+    'jpg',
+    'jpeg',
+    'gif',
+    'webp',
+    'svg',
+    'webm',
+    'mp4',
+    'mp3',
+    'opus',
+    'pdf',
+    'md',
+}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# what extractors write besides the path in their output
+EXTRA_RESULT_PATHS = {
+    'wget': ('warc',),
+}
+
+
+def get_result_outputs(snapshot, results: Iterable) -> Dict[str, Dict[str, Any]]:
+    """{name: {name, path, ts, size}} of the outputs worth showing in the live index, in the order they were found"""
+    outputs: Dict[str, Dict[str, Any]] = {}
+    snap_dir = Path(snapshot.link_dir)
+
+    for result in results:
+        if result.status != 'succeeded' or result.extractor in HIDDEN_RESULTS:
+            continue
+        embed_path = result.embed_path()
+        abs_path = snap_dir / (embed_path or 'None')
+        if not (embed_path and abs_path.exists()):
+            continue
+        if abs_path.is_dir() and not any(abs_path.glob('*.*')):
+            continue
+
+        outputs[result.extractor] = {
+            'name': result.extractor,
+            'path': embed_path,
+            'ts': ts_to_date_str(result.end_ts),
+            'size': abs_path.stat().st_size or '?',
+        }
+
+    # add the biggest of the other files in the snapshot dir too
+    existing_files = {output['path'] for output in outputs.values()}
+    for result_file in (*snap_dir.glob('*'), *snap_dir.glob('*/*')):
+        extension = result_file.suffix.lstrip('.').lower()
+        if result_file.is_dir() or result_file.name.startswith('.') or extension not in PREVIEW_EXTENSIONS:
+            continue
+        if result_file.name in existing_files or result_file.name == 'index.html':
+            continue
+
+        file_stat = result_file.stat()
+        if (file_stat.st_size or 0) > PREVIEW_MIN_SIZE:
+            outputs[result_file.name] = {
+                'name': result_file.stem,
+                'path': str(result_file.relative_to(snap_dir)),
+                'ts': ts_to_date_str(file_stat.st_mtime or 0),
+                'size': file_stat.st_size,
+            }
+    return outputs
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_file_sizes(snap_dir: Path) -> Dict[str, int]:
+    """{path relative to the snapshot dir: size} of every file in it, without hashing anything"""
+    sizes = {}
+    for path, relpath in iter_outputs(snap_dir):
+        try:
+            sizes[relpath] = path.stat().st_size
+        except OSError:
+            # removed while we were walking the folder
+            pass
+    return sizes
+
+
+def get_result_paths(snapshot, extractor: str, result) -> List[str]:
+    """the top-level files/folders in the snapshot dir that an extractor's result wrote to (e.g. example.com + warc for wget)"""
+    snap_dir = Path(snapshot.link_dir)
+    paths = list(EXTRA_RESULT_PATHS.get(extractor, ()))
+    if isinstance(result.output, str) and result.output:
+        try:
+            # outputs that aren't paths (titles, urls, errors...) just don't exist
+            relpath = (Path(result.pwd or snap_dir) / result.output).relative_to(snap_dir)
+            if relpath.parts and (snap_dir / relpath).exists():
+                paths.insert(0, relpath.parts[0])
+        except (ValueError, OSError):
+            pass
+    return [path for path in paths if path != PRECOMPRESSED_DIR_NAME]
+
+
+def iter_path_outputs(snap_dir: Path, paths: Iterable[str]):
+    """iter_outputs, but only for the given top-level files/folders in the snapshot dir"""
+    for relpath in paths:
+        path = snap_dir / relpath
+        if path.is_dir() and not path.is_symlink():
+            for subpath, subrelpath in iter_outputs(path):
+                yield subpath, f'{relpath}/{subrelpath}'
+        elif path.is_file() and not path.is_symlink():
+            yield path, relpath
+
+
+def update_output_files(snapshot, paths: Optional[Iterable[str]]=None) -> List:
+    """
+    bring the snapshot's SnapshotFile rows in line with its folder, only rehashing files whose size or mtime changed
+    (only the rows under the given top-level paths if there are any, e.g. the ones an extractor just wrote)
+    """
+    from core.models import SnapshotFile
+
+    snap_dir = Path(snapshot.link_dir)
+    existing = {file.path: file for file in SnapshotFile.objects.filter(snapshot_id=snapshot.pk)}
+    files, created, updated = [], [], []
+
+    if paths is None:
+        outputs = iter_outputs(snap_dir)
+    else:
+        paths = list(paths)
+        outputs = iter_path_outputs(snap_dir, paths)
+        # keep the rows outside of the paths as they are
+        files = [file for relpath, file in existing.items() if relpath.split('/', 1)[0] not in paths]
+        existing = {relpath: file for relpath, file in existing.items() if relpath.split('/', 1)[0] in paths}
+
+    for path, relpath in outputs:
+        try:
+            statobj = path.stat()
+            mtime = datetime.fromtimestamp(statobj.st_mtime, timezone.utc)
+            file = existing.pop(relpath, None)
+            if file and file.size == statobj.st_size and file.mtime == mtime:
+                files.append(file)
+                continue
+            file_hash = hash_file(path)
+        except OSError:
+            # removed while we were walking the folder
+            continue
+
+        if file is None:
+            file = SnapshotFile(snapshot_id=snapshot.pk, path=relpath)
+            created.append(file)
+        else:
+            updated.append(file)
+        file.size = statobj.st_size
+        file.mimetype = mimetypes.guess_type(relpath)[0]
+        file.hash = file_hash
+        file.mtime = mtime
+        files.append(file)
+
+    with transaction.atomic():
+        if existing:
+            SnapshotFile.objects.filter(pk__in=[file.pk for file in existing.values()]).delete()
+        # ignore_conflicts: the precompress worker may be updating the same snapshot's rows at the same time
+        SnapshotFile.objects.bulk_create(created, batch_size=500, ignore_conflicts=True)
+        SnapshotFile.objects.bulk_update(updated, ['size', 'mimetype', 'hash', 'mtime'], batch_size=500)
+    return files
+
+
+def load_headers(snap_dir: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads((snap_dir / 'headers.json').read_text(encoding='utf-8').strip())
+    except Exception:
+        return None
+
+
+def get_results_key(results: Iterable) -> List:
+    """[count, latest modified_at, latest end_ts] of a snapshot's ArchiveResults, changes whenever one is added or rerun"""
+    results = list(results)
+    modified_at = max((result.modified_at for result in results if result.modified_at), default=None)
+    end_ts = max((result.end_ts for result in results if result.end_ts), default=None)
+    return [len(results), modified_at and modified_at.isoformat(), end_ts and end_ts.isoformat()]
+
+
+def with_results_key(snapshots):
+    """annotate a Snapshot queryset with what get_snapshot_results_key needs, so listing it doesn't query each snapshot"""
+    return snapshots.annotate(
+        num_results=Count('archiveresult', distinct=True),
+        results_modified_at=Max('archiveresult__modified_at'),
+        results_end_ts=Max('archiveresult__end_ts'),
+    )
+
+
+def get_snapshot_results_key(snapshot) -> List:
+    """get_results_key of the snapshot's current ArchiveResults, from with_results_key's annotations if it has them"""
+    if hasattr(snapshot, 'num_results'):
+        modified_at, end_ts = snapshot.results_modified_at, snapshot.results_end_ts
+        return [snapshot.num_results, modified_at and modified_at.isoformat(), end_ts and end_ts.isoformat()]
+
+    if hasattr(snapshot, '_prefetched_objects_cache') and 'archiveresult_set' in snapshot._prefetched_objects_cache:
+        return get_results_key(snapshot.archiveresult_set.all())
+
+    from core.models import ArchiveResult
+
+    stats = ArchiveResult.objects.filter(snapshot_id=snapshot.pk).aggregate(
+        num_results=Count('pk'),
+        results_modified_at=Max('modified_at'),
+        results_end_ts=Max('end_ts'),
+    )
+    modified_at, end_ts = stats['results_modified_at'], stats['results_end_ts']
+    return [stats['num_results'], modified_at and modified_at.isoformat(), end_ts and end_ts.isoformat()]
+
+
+def build_output_manifest(snapshot, results: Optional[Iterable]=None, file_sizes: Optional[Dict[str, int]]=None) -> Dict[str, Any]:
+    """scan the snapshot dir for everything the live index, admin and Link/Snapshot accessors need about its outputs"""
+    from core.models import ArchiveResult
+    from ..index.schema import Link
+
+    if results is None:
+        # not snapshot.archiveresult_set, it may have been prefetched before the latest extractors ran
+        results = ArchiveResult.objects.filter(snapshot_id=snapshot.pk).select_related('snapshot')
+    results = list(results)
+    # not snapshot.as_link(), that link reads is_archived and canonical_outputs from the stored manifest
+    link = Link.from_json(snapshot.as_json())
+    snap_dir = Path(snapshot.link_dir)
+    if file_sizes is None:
+        file_sizes = get_file_sizes(snap_dir)
+    precompressed_size = get_precompressed_size(snap_dir)
+
+    warc_path = next((path for path in sorted(file_sizes) if path.startswith('warc/') and '.warc.' in path), 'warc/')
+
+    return {
+        'version': MANIFEST_VERSION,
+        'results_key': get_results_key(results),
+        'computed_at': time.time(),
+        'outputs': get_result_outputs(snapshot, results),
+        'warc_path': warc_path,
+        'size': sum(file_sizes.values()) + precompressed_size,
+        'precompressed_size': precompressed_size,
+        'num_files': len(file_sizes),
+        'has_index': 'index.html' in file_sizes,
+        'headers': load_headers(snap_dir),
+        'is_archived': link.is_archived,
+        'canonical': link.canonical_outputs(),
+    }
+
+
+def save_output_manifest(snapshot, manifest: Dict[str, Any]) -> None:
+    from core.models import Snapshot
+
+    # .update() instead of .save() so modified_at and the other fields aren't touched
+    Snapshot.objects.filter(pk=snapshot.pk).update(output_manifest=manifest)
+    snapshot.output_manifest = manifest
+
+
+def update_output_manifest(snapshot, results: Optional[Iterable]=None, paths: Optional[Iterable[str]]=None) -> Dict[str, Any]:
+    """
+    rescan the snapshot's folder (or just the given top-level paths in it, see get_result_paths),
+    update its SnapshotFile rows and store the recomputed manifest
+    """
+    files = update_output_files(snapshot, paths=paths)
+    manifest = build_output_manifest(snapshot, results, file_sizes={file.path: file.size for file in files})
+    save_output_manifest(snapshot, manifest)
+    return manifest
+
+
+def update_output_manifests(snapshots: Iterable) -> int:
+    """update_output_manifest for each snapshot, e.g. to backfill the ones archived before manifests existed"""
+    updated = 0
+    for snapshot in snapshots:
+        try:
+            update_output_manifest(snapshot)
+            updated += 1
+        except Exception as err:
+            stderr(f'[!] Failed to store the output manifest of {snapshot.timestamp}: {err}', color='lightyellow')
+    return updated
+
+
+def get_snapshots_without_manifest(snapshots):
+    """the snapshots in the given queryset whose manifest is missing or from an older MANIFEST_VERSION"""
+    return snapshots.filter(Q(output_manifest__isnull=True) | ~Q(output_manifest__version=MANIFEST_VERSION))
+
+
+def get_output_manifest(snapshot) -> Optional[Dict[str, Any]]:
+    """the snapshot's stored manifest, or None if it's missing or out of date with its ArchiveResults"""
+    manifest = snapshot.output_manifest
+    if not manifest or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    if manifest.get('results_key') != get_snapshot_results_key(snapshot):
+        return None
+    return manifest
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0075_crawl"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snapshot",
+            name="output_manifest",
+            field=models.JSONField(blank=True, default=None, editable=False, null=True),
+        ),
+    ]
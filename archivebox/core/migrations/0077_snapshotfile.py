@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-17 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0076_snapshot_output_manifest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SnapshotFile",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("path", models.CharField(max_length=1024)),
+                ("size", models.PositiveBigIntegerField()),
+                ("mimetype", models.CharField(blank=True, default=None, max_length=128, null=True)),
+                ("hash", models.CharField(db_index=True, max_length=64)),
+                ("mtime", models.DateTimeField()),
+                (
+                    "snapshot",
+                    models.ForeignKey(
+                        db_column="snapshot_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="core.snapshot",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Snapshot File",
+                "verbose_name_plural": "Snapshot Files",
+                "unique_together": {("snapshot", "path")},
+            },
+        ),
+    ]
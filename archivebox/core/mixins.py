@@ -1,10 +1,19 @@
 from django.contrib import messages
 
-from archivebox.search import query_search_index
+from archivebox.config import SEARCH_BACKEND_CONFIG
+from archivebox.search import query_search_pks
+from archivebox.search.cache import SEARCH_CACHE
 
 class SearchResultsAdminMixin:
+    def changelist_view(self, request, extra_context=None):
+        if SEARCH_BACKEND_CONFIG.USE_SEARCHING_BACKEND and request.GET.get('q', '').strip():
+            # shown under the search box by admin/core/snapshot/change_list.html
+            stats = SEARCH_CACHE.stats()
+            extra_context = {**(extra_context or {}), 'search_cache_stats': {**stats, 'hit_percent': round(stats['hit_rate'] * 100)}}
+        return super().changelist_view(request, extra_context)
+
     def get_search_results(self, request, queryset, search_term: str):
-        """Enhances the search queryset with results from the search backend"""
+        """Enhances the search queryset with the top results from the search backend"""
         
         qs, use_distinct = super().get_search_results(request, queryset, search_term)
 
@@ -12,8 +21,9 @@ class SearchResultsAdminMixin:
         if not search_term:
             return qs.distinct(), use_distinct
         try:
-            qsearch = query_search_index(search_term)
-            qs = qs | qsearch
+            # only the best SEARCH_RESULTS_LIMIT matches, so common terms don't turn into a huge IN (...) clause
+            snapshot_pks = query_search_pks(search_term, limit=SEARCH_BACKEND_CONFIG.SEARCH_RESULTS_LIMIT)
+            qs = qs | queryset.filter(pk__in=snapshot_pks)
         except Exception as err:
             print(f'[!] Error while using search backend: {err.__class__.__name__} {err}')
             messages.add_message(request, messages.WARNING, f'Error from the search backend, only showing results from default admin search fields - Error: {err}')
@@ -1,11 +1,9 @@
 __package__ = 'archivebox.core'
 
 
-from typing import Optional, Dict, Iterable
+from typing import Any, Optional, Dict, Iterable
 from django_stubs_ext.db.models import TypedModelMeta
 
-import json
-
 from pathlib import Path
 
 from django.db import models
@@ -23,12 +21,12 @@ from archivebox.config import CONSTANTS
 from abid_utils.models import ABIDModel, ABIDField, AutoDateTimeField
 from queues.tasks import bg_archive_snapshot
 
-from archivebox.misc.system import get_dir_size
 from archivebox.misc.util import parse_date, base_url
 from ..index.schema import Link
 from ..index.html import snapshot_icons
 from ..extractors import ARCHIVE_METHODS_INDEXING_PRECEDENCE, EXTRACTORS
 from ..parsers import PARSERS
+from .manifest import get_output_manifest, build_output_manifest
 
 
 # class BaseModel(models.Model):
@@ -230,9 +228,13 @@ class Snapshot(ABIDModel):
     tags = models.ManyToManyField(Tag, blank=True, through=SnapshotTag, related_name='snapshot_set', through_fields=('snapshot', 'tag'))
     title = models.CharField(max_length=512, null=True, blank=True, db_index=True)    
 
+    # summary of the outputs on disk, computed when archiving finishes (see core/manifest.py)
+    output_manifest = models.JSONField(default=None, null=True, blank=True, editable=False)
+
     keys = ('url', 'timestamp', 'title', 'tags', 'downloaded_at')
 
     archiveresult_set: models.Manager['ArchiveResult']
+    snapshotfile_set: models.Manager['SnapshotFile']
 
     objects = SnapshotManager()
 
@@ -267,7 +269,9 @@ class Snapshot(ABIDModel):
         }
 
     def as_link(self) -> Link:
-        return Link.from_json(self.as_json())
+        # lets the link read is_archived, canonical_outputs, etc. from this snapshot's manifest instead of the filesystem
+        output_manifest = None if 'output_manifest' in self.get_deferred_fields() else self.stored_manifest
+        return Link.from_json(self.as_json()).overwrite(output_manifest=output_manifest)
 
     def as_link_with_details(self) -> Link:
         from ..index import load_link_details
@@ -322,9 +326,19 @@ class Snapshot(ABIDModel):
         # TODO: remove this
         return self.bookmarked
 
+    @cached_property
+    def stored_manifest(self) -> Optional[Dict[str, Any]]:
+        """summary of the outputs on disk stored in the db, None if it's missing or out of date (see core/manifest.py)"""
+        return get_output_manifest(self)
+
+    @cached_property
+    def manifest(self) -> Dict[str, Any]:
+        """the stored manifest if it's current, otherwise one built from the filesystem (without saving it)"""
+        return self.stored_manifest or build_output_manifest(self)
+
     @cached_property
     def is_archived(self):
-        return self.as_link().is_archived
+        return self.manifest['is_archived']
 
     @cached_property
     def num_outputs(self) -> int:
@@ -347,15 +361,12 @@ class Snapshot(ABIDModel):
 
     @cached_property
     def archive_size(self):
-        cache_key = f'{str(self.pk)[:12]}-{(self.downloaded_at or self.bookmarked_at).timestamp()}-size'
+        return self.manifest['size']
 
-        def calc_dir_size():
-            try:
-                return get_dir_size(self.link_dir)[0]
-            except Exception:
-                return 0
-
-        return cache.get_or_set(cache_key, calc_dir_size)
+    @cached_property
+    def precompressed_size(self):
+        """disk used by the .br/.gz copies of this snapshot's outputs, included in archive_size"""
+        return self.manifest['precompressed_size']
 
     @cached_property
     def thumbnail_url(self) -> Optional[str]:
@@ -380,11 +391,7 @@ class Snapshot(ABIDModel):
 
     @cached_property
     def headers(self) -> Optional[Dict[str, str]]:
-        try:
-            return json.loads((Path(self.link_dir) / 'headers.json').read_text(encoding='utf-8').strip())
-        except Exception:
-            pass
-        return None
+        return self.manifest['headers']
 
     @cached_property
     def status_code(self) -> Optional[str]:
@@ -627,3 +634,24 @@ class ArchiveResult(ABIDModel):
 
     # def symlink_index(self, create=True):
     #     abs_result_dir = self.get_storage_dir(create=create)
+
+
+class SnapshotFile(models.Model):
+    """a file in a snapshot's folder as of the last time archive_link scanned it (see core/manifest.py)"""
+    id = models.AutoField(primary_key=True)
+
+    snapshot = models.ForeignKey(Snapshot, on_delete=models.CASCADE, to_field='id', db_column='snapshot_id')
+
+    path = models.CharField(max_length=1024)                                # relative to the snapshot dir
+    size = models.PositiveBigIntegerField()
+    mimetype = models.CharField(max_length=128, default=None, null=True, blank=True)
+    hash = models.CharField(max_length=64, db_index=True)                   # sha256 hexdigest of the contents
+    mtime = models.DateTimeField()
+
+    class Meta(TypedModelMeta):
+        verbose_name = 'Snapshot File'
+        verbose_name_plural = 'Snapshot Files'
+        unique_together = [('snapshot', 'path')]
+
+    def __str__(self):
+        return self.path
@@ -1,22 +1,45 @@
 import os
 import stat
+import time
+import secrets
 import posixpath
 import mimetypes
 from pathlib import Path
+from urllib.parse import quote
 
 from django.contrib.staticfiles import finders
 from django.views import static
-from django.http import StreamingHttpResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.http import StreamingHttpResponse, FileResponse, Http404, HttpResponse, HttpResponseNotModified
 from django.utils._os import safe_join
-from django.utils.http import http_date
+from django.utils.http import http_date, parse_http_date_safe, parse_etags
+from django.utils.cache import patch_vary_headers
 from django.utils.translation import gettext as _
 
+from archivebox.config import DATA_DIR, SERVER_CONFIG
+from archivebox.misc.precompress import is_compressible, get_precompressed_variant
+
+
+# files modified more recently than this only get a weak ETag, a write within the filesystem's mtime resolution
+# (2s on the FAT/exFAT drives archives often live on) could change them without changing their size or mtime
+ETAG_WEAK_WINDOW = 2
+
+# more ranges than this in one request are ignored and the whole file is sent instead, to keep clients from making
+# us seek around a huge file for thousands of tiny overlapping ranges
+MAX_BYTE_RANGES = 200
+
 
 def serve_static_with_byterange_support(request, path, document_root=None, show_indexes=False):
     """
     Overrides Django's built-in django.views.static.serve function to support byte range requests.
     This allows you to do things like seek into the middle of a huge mp4 or WACZ without downloading the whole file.
     https://github.com/satchamo/django/commit/2ce75c5c4bee2a858c0214d136bfcd351fcde11d
+
+    How the bytes are sent depends on SERVE_STATIC_MODE, see get_proxy_response() and RangedFile.
+    Requests for several ranges at once get a multipart/byteranges response, and conditional requests are
+    answered with the ETag (see get_etag()) and Last-Modified validators: If-None-Match / If-Modified-Since
+    return a 304 when the client's copy is still current, and If-Range only applies the Range if it is.
+    Clients that accept br/gzip get the precompressed copy of the file instead, if it has an up-to-date one
+    (see archivebox.misc.precompress).
     """
     assert document_root
     path = posixpath.normpath(path).lstrip("/")
@@ -28,48 +51,164 @@ def serve_static_with_byterange_support(request, path, document_root=None, show_
     if not fullpath.exists():
         raise Http404(_("“%(path)s” does not exist") % {"path": fullpath})
     
-    # Respect the If-Modified-Since header.
     statobj = fullpath.stat()
-    if not static.was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"), statobj.st_mtime):
-        return HttpResponseNotModified()
-    
     content_type, encoding = mimetypes.guess_type(str(fullpath))
     content_type = content_type or "application/octet-stream"
-    
-    # setup resposne object
-    ranged_file = RangedFileReader(open(fullpath, "rb"))
-    response = StreamingHttpResponse(ranged_file, content_type=content_type)
-    response.headers["Last-Modified"] = http_date(statobj.st_mtime)
 
+    # the response depends on Accept-Encoding whenever the file could have a precompressed copy
+    vary_encoding = is_compressible(fullpath)
+    if vary_encoding and stat.S_ISREG(statobj.st_mode):
+        variant = get_precompressed_variant(document_root, path, statobj, request.META.get("HTTP_ACCEPT_ENCODING"))
+        if variant is not None:
+            # from here on the precompressed copy is the file being served, with its own ETag, size and ranges
+            fullpath, statobj, encoding = variant
+
+    etag = get_etag(statobj)
+
+    # Respect the If-None-Match header, or If-Modified-Since when there isn't one (RFC 9110 13.2.2).
+    if "HTTP_IF_NONE_MATCH" in request.META:
+        not_modified = etag_matches(request.META["HTTP_IF_NONE_MATCH"], etag, weak=True)
+    else:
+        not_modified = not static.was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"), statobj.st_mtime)
+    if not_modified:
+        return set_cache_headers(HttpResponseNotModified(), statobj, etag, vary_encoding)
+
+    # let the reverse proxy in front of us send the file (it handles Range requests itself)
+    response = get_proxy_response(fullpath, content_type)
+    if response is not None:
+        set_cache_headers(response, statobj, etag, vary_encoding)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    start, stop = 0, None
+    status = 200
     # handle byte-range requests by serving chunk of file    
     if stat.S_ISREG(statobj.st_mode):
         size = statobj.st_size
-        response["Content-Length"] = size
-        response["Accept-Ranges"] = "bytes"
-        response["X-Django-Ranges-Supported"] = "1"
-        # Respect the Range header.
-        if "HTTP_RANGE" in request.META:
+        stop = size
+        # Respect the Range header, unless If-Range says the client's copy of the file is out of date.
+        if "HTTP_RANGE" in request.META and if_range_matches(request.META.get("HTTP_IF_RANGE"), etag, statobj.st_mtime):
             try:
                 ranges = parse_range_header(request.META['HTTP_RANGE'], size)
             except ValueError:
                 ranges = None
-            # only handle syntactically valid headers, that are simple (no
-            # multipart byteranges)
-            if ranges is not None and len(ranges) == 1:
-                start, stop = ranges[0]
-                if stop > size:
+            # only handle syntactically valid headers, and send the whole file for unreasonably many ranges
+            if ranges is not None and len(ranges) <= MAX_BYTE_RANGES:
+                ranges = coalesce_ranges(ranges, size)
+                if not ranges:
                     # requested range not satisfiable
-                    return HttpResponse(status=416)
-                ranged_file.start = start
-                ranged_file.stop = stop
-                response["Content-Range"] = "bytes %d-%d/%d" % (start, stop - 1, size)
-                response["Content-Length"] = stop - start
-                response.status_code = 206
+                    response = HttpResponse(status=416)
+                    response["Content-Range"] = "bytes */%d" % size
+                    return response
+                if len(ranges) > 1:
+                    return set_cache_headers(get_multipart_response(fullpath, ranges, content_type, size), statobj, etag, vary_encoding)
+                start, stop = ranges[0]
+                status = 206
+
+    # setup resposne object
+    if SERVER_CONFIG.SERVE_STATIC_MODE == 'stream':
+        response = StreamingHttpResponse(
+            RangedFileReader(open(fullpath, "rb"), start=start, stop=float("inf") if stop is None else stop),
+            content_type=content_type,
+        )
+    else:
+        response = FileResponse(RangedFile(open(fullpath, "rb"), start=start, stop=stop), content_type=content_type)
+        response.block_size = RangedFile.block_size
+    response.status_code = status
+    set_cache_headers(response, statobj, etag, vary_encoding)
+
+    if stop is not None:
+        response["Content-Length"] = stop - start
+        response["Accept-Ranges"] = "bytes"
+        response["X-Django-Ranges-Supported"] = "1"
+        if status == 206:
+            response["Content-Range"] = "bytes %d-%d/%d" % (start, stop - 1, statobj.st_size)
     if encoding:
         response.headers["Content-Encoding"] = encoding
     return response
 
 
+def get_etag(statobj):
+    """
+    An ETag made of the file's inode, size and mtime (like nginx's and Apache's), so it's computed from a stat() without
+    reading the file. It's weak for files modified in the last ETAG_WEAK_WINDOW seconds, as they may still be changing.
+    """
+    etag = '"%x-%x-%x"' % (statobj.st_ino, statobj.st_size, statobj.st_mtime_ns)
+    if time.time() - statobj.st_mtime < ETAG_WEAK_WINDOW:
+        return 'W/' + etag
+    return etag
+
+
+def etag_matches(header, etag, weak=False):
+    """
+    Whether an If-None-Match / If-Range header value lists the etag, using the weak comparison (W/ prefixes are ignored)
+    or the strong one (weak ETags never match) from RFC 9110 8.8.3.2.
+    """
+    for candidate in parse_etags(header):
+        if candidate == "*":
+            return True
+        if weak:
+            if candidate.removeprefix("W/") == etag.removeprefix("W/"):
+                return True
+        elif candidate == etag and not etag.startswith("W/"):
+            return True
+    return False
+
+
+def if_range_matches(header, etag, mtime):
+    """Whether to apply the Range header: If-Range is missing, or names the current version of the file by ETag or date"""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith(("W/", '"')):
+        return etag_matches(header, etag)
+    return parse_http_date_safe(header) == int(mtime)
+
+
+def set_cache_headers(response, statobj, etag, vary_encoding=False):
+    response.headers["Last-Modified"] = http_date(statobj.st_mtime)
+    response.headers["ETag"] = etag
+    if vary_encoding:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def get_multipart_response(fullpath, ranges, content_type, size):
+    reader = MultipartRangedFileReader(open(fullpath, "rb"), ranges, content_type, size)
+    response = StreamingHttpResponse(reader, status=206, content_type=reader.content_type)
+    response["Content-Length"] = reader.content_length
+    response["Accept-Ranges"] = "bytes"
+    response["X-Django-Ranges-Supported"] = "1"
+    # no Content-Encoding, it would apply to the multipart body, not to the parts of the file in it
+    return response
+
+
+def get_proxy_response(fullpath, content_type):
+    """
+    With SERVE_STATIC_MODE=x-accel-redirect (nginx) or x-sendfile (Apache mod_xsendfile, lighttpd, Caddy), return an
+    empty response that tells the reverse proxy which file to send in its place, so no Django worker is tied up for the
+    whole transfer. Returns None to serve the file from Django instead (e.g. for files outside of DATA_DIR).
+    """
+    mode = SERVER_CONFIG.SERVE_STATIC_MODE
+    if mode not in ('x-sendfile', 'x-accel-redirect'):
+        return None
+
+    # the proxy is only set up to send files from DATA_DIR, anything else (e.g. a symlink out of it) is served by Django
+    try:
+        relative_path = Path(os.path.realpath(fullpath)).relative_to(os.path.realpath(DATA_DIR))
+    except ValueError:
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-sendfile':
+        response.headers["X-Sendfile"] = str(fullpath)
+    else:
+        # the prefix should be an `internal` nginx location aliased to the DATA_DIR
+        response.headers["X-Accel-Redirect"] = SERVER_CONFIG.SERVE_STATIC_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative_path.as_posix())
+    return response
+
+
 def serve_static(request, path, **kwargs):
     """
     Serve static files below a given point in the directory structure or
@@ -128,19 +267,42 @@ def parse_range_header(header, resource_size):
             stop = resource_size
         else:
             # byte-range-spec: first-byte-pos "-" [last-byte-pos]
-            start, stop = val.split("-", 1)
-            start = int(start)
+            first_byte, last_byte = val.split("-", 1)
+            start = int(first_byte)
             # the +1 is here since we want the stopping point to be exclusive, whereas in
             # the HTTP spec, the last-byte-pos is inclusive
-            stop = int(stop) + 1 if stop else resource_size
-            if start >= stop:
+            stop = int(last_byte) + 1 if last_byte else resource_size
+            if last_byte and start >= stop:
                 return None
+            # open-ended ranges starting past the end of the file are valid, coalesce_ranges() drops them as unsatisfiable
 
         ranges.append((start, stop))
 
     return ranges
 
 
+def coalesce_ranges(ranges, resource_size):
+    """
+    Clamps the (start, stop) ranges from parse_range_header() to the size of the file, drops the unsatisfiable ones
+    (starting past the end), and merges the ones that overlap or touch. The rest keep the order they were requested in.
+    """
+    coalesced = []
+    for start, stop in ranges:
+        stop = min(stop, resource_size)
+        if start >= stop:
+            continue
+        overlapping = [i for i, (other_start, other_stop) in enumerate(coalesced) if start <= other_stop and other_start <= stop]
+        if not overlapping:
+            coalesced.append((start, stop))
+            continue
+        start = min(start, *(coalesced[i][0] for i in overlapping))
+        stop = max(stop, *(coalesced[i][1] for i in overlapping))
+        coalesced[overlapping[0]] = (start, stop)
+        for i in reversed(overlapping[1:]):
+            del coalesced[i]
+    return coalesced
+
+
 class RangedFileReader:
     """
     Wraps a file like object with an iterator that runs over part (or all) of
@@ -167,3 +329,69 @@ class RangedFileReader:
 
             yield data
             position += self.block_size
+
+
+class RangedFile:
+    """
+    A file that reads from start up to, but not including, stop (or to the end of the file if stop is None), for FileResponse.
+    The real file is left positioned at start and its fileno() is exposed, so WSGI servers that implement wsgi.file_wrapper
+    with os.sendfile() (e.g. gunicorn) send the range straight from the page cache to the socket without copying it through
+    python, other servers (e.g. daphne) read it in big blocks instead of RangedFileReader's small ones.
+    """
+
+    block_size = 1024 * 1024
+
+    def __init__(self, file_like, start=0, stop=None):
+        self.f = file_like
+        self.f.seek(start)
+        self.remaining = None if stop is None else stop - start
+
+    def read(self, size=-1):
+        if self.remaining is not None:
+            size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+class MultipartRangedFileReader:
+    """
+    Iterates over a multipart/byteranges body (RFC 9110 14.6) with one part for each (start, stop) range of the file,
+    in the order given. The body is generated as it's sent, but its length is known up front for the Content-Length.
+    """
+
+    def __init__(self, file_like, ranges, content_type, size, boundary=None):
+        self.f = file_like
+        self.ranges = ranges
+        self.boundary = boundary or secrets.token_hex(16)
+        self.part_headers = [
+            ("--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (self.boundary, content_type, start, stop - 1, size)).encode()
+            for start, stop in ranges
+        ]
+        self.trailer = ("--%s--\r\n" % self.boundary).encode()
+
+    @property
+    def content_type(self):
+        return "multipart/byteranges; boundary=%s" % self.boundary
+
+    @property
+    def content_length(self):
+        parts = sum(len(header) + (stop - start) + 2 for header, (start, stop) in zip(self.part_headers, self.ranges))
+        return parts + len(self.trailer)
+
+    def __iter__(self):
+        for header, (start, stop) in zip(self.part_headers, self.ranges):
+            yield header
+            yield from RangedFileReader(self.f, start=start, stop=stop)
+            yield b"\r\n"
+        yield self.trailer
+
+    def close(self):
+        self.f.close()
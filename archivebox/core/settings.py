@@ -288,6 +288,8 @@ DJANGO_HUEY = {
     "default": "system_tasks",
     "queues": {
         HUEY["name"]: HUEY.copy(),
+        "search_indexing": {**HUEY, "name": "search_indexing"},
+        "precompress": {**HUEY, "name": "precompress"},
         # more registered here at plugin import-time by BaseQueue.register()
         **abx.django.use.get_DJANGO_HUEY_QUEUES(QUEUE_DATABASE_NAME=QUEUE_DATABASE_NAME),
     },
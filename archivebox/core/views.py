@@ -2,7 +2,6 @@ __package__ = 'archivebox.core'
 
 import inspect
 from typing import Callable, get_type_hints
-from pathlib import Path
 
 from django.shortcuts import render, redirect
 from django.http import HttpRequest, HttpResponse, Http404
@@ -22,18 +21,19 @@ from admin_data_views.utils import render_with_table_view, render_with_item_view
 
 
 from core.models import Snapshot
+from core.manifest import build_output_manifest, save_output_manifest
 from core.forms import AddLinkForm
 from core.admin import result_url
 
 from queues.tasks import bg_add
 
-from archivebox.config import CONSTANTS_CONFIG, DATA_DIR, VERSION, SHELL_CONFIG, SERVER_CONFIG
+from archivebox.config import CONSTANTS_CONFIG, DATA_DIR, VERSION, SHELL_CONFIG, SERVER_CONFIG, SEARCH_BACKEND_CONFIG
 from archivebox.misc.util import base_url, htmlencode, ts_to_date_str
 
 from .serve_static import serve_static_with_byterange_support
 from ..plugins_extractor.archivedotorg.apps import ARCHIVEDOTORG_CONFIG
 from ..logging_util import printable_filesize
-from ..search import query_search_index
+from ..search import query_search_pks, search_rank, SearchResults
 
 
 class HomepageView(View):
@@ -47,76 +47,27 @@ class HomepageView(View):
         return redirect(f'/admin/login/?next={request.path}')
 
 
+# the Link properties the live index template can use that don't touch the filesystem (or the db)
+LIVE_INDEX_LINK_KEYS = (
+    'link_dir', 'archive_path', 'base_url', 'scheme', 'domain', 'path', 'basename', 'extension', 'is_static',
+    'bookmarked_date', 'downloaded_datestr', 'oldest_archive_date', 'newest_archive_date', 'num_failures',
+)
+
+
 class SnapshotView(View):
     # render static html index from filesystem archive/<timestamp>/index.html
 
     @staticmethod
     def render_live_index(request, snapshot):
         TITLE_LOADING_MSG = 'Not yet archived...'
-        HIDDEN_RESULTS = ('favicon', 'headers', 'title', 'htmltotext', 'warc', 'archive_org')
-
-        archiveresults = {}
-
-        results = snapshot.archiveresult_set.all()
-
-        for result in results:
-            embed_path = result.embed_path()
-            abs_path = result.snapshot_dir / (embed_path or 'None')
-
-            if (result.status == 'succeeded'
-                and (result.extractor not in HIDDEN_RESULTS)
-                and embed_path
-                and abs_path.exists()):
-                if abs_path.is_dir() and not any(abs_path.glob('*.*')):
-                    continue
-
-                result_info = {
-                    'name': result.extractor,
-                    'path': embed_path,
-                    'ts': ts_to_date_str(result.end_ts),
-                    'size': abs_path.stat().st_size or '?',
-                }
-                archiveresults[result.extractor] = result_info
-
-        existing_files = {result['path'] for result in archiveresults.values()}
-        min_size_threshold = 10_000  # bytes
-        allowed_extensions = {
-            'txt',
-            'html',
-            'htm',
-            'png',
-            'jpg',
-            'jpeg',
-            'gif',
-            'webp'
-            'svg',
-            'webm',
-            'mp4',
-            'mp3',
-            'opus',
-            'pdf',
-            'md',
-        }
-
-
-        # iterate through all the files in the snapshot dir and add the biggest ones to1 the result list
-        snap_dir = Path(snapshot.link_dir)
-        for result_file in (*snap_dir.glob('*'), *snap_dir.glob('*/*')):
-            extension = result_file.suffix.lstrip('.').lower()
-            if result_file.is_dir() or result_file.name.startswith('.') or extension not in allowed_extensions:
-                continue
-            if result_file.name in existing_files or result_file.name == 'index.html':
-                continue
 
-            file_size = result_file.stat().st_size or 0
-
-            if file_size > min_size_threshold:
-                archiveresults[result_file.name] = {
-                    'name': result_file.stem,
-                    'path': result_file.relative_to(snap_dir),
-                    'ts': ts_to_date_str(result_file.stat().st_mtime or 0),
-                    'size': file_size,
-                }
+        # what's on disk comes from the manifest stored while archiving, the filesystem is only scanned if it's missing
+        # or stale (archived before manifests existed, or its results changed since), and the rebuilt one is stored for next time
+        manifest = snapshot.stored_manifest
+        if manifest is None:
+            manifest = build_output_manifest(snapshot)
+            save_output_manifest(snapshot, manifest)
+        archiveresults = manifest['outputs']
 
         preferred_types = ('singlefile', 'screenshot', 'wget', 'dom', 'media', 'pdf', 'readability', 'mercury')
         all_types = preferred_types + tuple(result_type for result_type in archiveresults.keys() if result_type not in preferred_types)
@@ -129,27 +80,36 @@ class SnapshotView(View):
 
         link = snapshot.as_link()
 
-        link_info = link._asdict(extended=True)
-
-        try:
-            warc_path = 'warc/' + list(Path(snap_dir).glob('warc/*.warc.*'))[0].name
-        except IndexError:
-            warc_path = 'warc/'
+        # the same as link._asdict(extended=True), but without the filesystem checks it does for is_archived and canonical
+        link_info = {
+            **link._asdict(),
+            **{key: getattr(link, key) for key in LIVE_INDEX_LINK_KEYS},
+            'snapshot_id': str(snapshot.pk),
+            'snapshot_abid': str(snapshot.ABID),
+            'hash': link.url_hash,
+            'tags_str': (link.tags or '').strip(','),
+            'icons': None,
+            'num_outputs': snapshot.num_outputs,
+            'latest': link.latest_outputs(),
+            'is_archived': manifest['is_archived'],
+            'canonical': manifest['canonical'],
+        }
 
         context = {
             **link_info,
             **link_info['canonical'],
             'title': htmlencode(
                 link.title
-                or (link.base_url if link.is_archived else TITLE_LOADING_MSG)
+                or (link.base_url if manifest['is_archived'] else TITLE_LOADING_MSG)
             ),
             'extension': link.extension or 'html',
             'tags': link.tags or 'untagged',
-            'size': printable_filesize(link.archive_size) if link.archive_size else 'pending',
-            'status': 'archived' if link.is_archived else 'not yet archived',
-            'status_color': 'success' if link.is_archived else 'danger',
+            'size': printable_filesize(manifest['size']) if manifest['size'] else 'pending',
+            'precompressed_size': printable_filesize(manifest['precompressed_size']) if manifest['precompressed_size'] else '',
+            'status': 'archived' if manifest['is_archived'] else 'not yet archived',
+            'status_color': 'success' if manifest['is_archived'] else 'danger',
             'oldest_archive_date': ts_to_date_str(link.oldest_archive_date),
-            'warc_path': warc_path,
+            'warc_path': manifest['warc_path'],
             'SAVE_ARCHIVE_DOT_ORG': ARCHIVEDOTORG_CONFIG.SAVE_ARCHIVE_DOT_ORG,
             'PREVIEW_ORIGINALS': SERVER_CONFIG.PREVIEW_ORIGINALS,
             'archiveresults': sorted(archiveresults.values(), key=lambda r: all_types.index(r['name']) if r['name'] in all_types else -r['size']),
@@ -374,6 +334,8 @@ class PublicIndexView(ListView):
             'VERSION': VERSION,
             'COMMIT_HASH': SHELL_CONFIG.COMMIT_HASH,
             'FOOTER_INFO': SERVER_CONFIG.FOOTER_INFO,
+            'query': self.request.GET.get('q', default = '').strip(),
+            'query_type': self.request.GET.get('query_type', default = ''),
         }
 
     def get_queryset(self, **kwargs):
@@ -386,16 +348,25 @@ class PublicIndexView(ListView):
         query_type = self.request.GET.get('query_type')
 
         if not query_type or query_type == 'all':
-            qs = qs.filter(Q(title__icontains=query) | Q(url__icontains=query) | Q(timestamp__icontains=query) | Q(tags__name__icontains=query))
+            # metadata matches + the top full-text matches, with the best full-text matches first
+            meta_filter = Q(title__icontains=query) | Q(url__icontains=query) | Q(timestamp__icontains=query) | Q(tags__name__icontains=query)
             try:
-                qs = qs | query_search_index(query)
+                snapshot_pks = query_search_pks(query, limit=SEARCH_BACKEND_CONFIG.SEARCH_RESULTS_LIMIT)
             except Exception as err:
                 print(f'[!] Error while using search backend: {err.__class__.__name__} {err}')
+                snapshot_pks = []
+            qs = qs.filter(meta_filter | Q(pk__in=snapshot_pks))
+            if snapshot_pks:
+                qs = qs.annotate(search_rank=search_rank(snapshot_pks)).order_by('search_rank', *self.ordering)
         elif query_type == 'fulltext':
+            # paged straight from the search backend in ranked order, instead of loading every match
             try:
-                qs = qs | query_search_index(query)
+                results = SearchResults(query, snapshots=qs)
+                results.count()
+                return results
             except Exception as err:
                 print(f'[!] Error while using search backend: {err.__class__.__name__} {err}')
+                return qs.none()
         elif query_type == 'meta':
             qs = qs.filter(Q(title__icontains=query) | Q(url__icontains=query) | Q(timestamp__icontains=query) | Q(tags__name__icontains=query))
         elif query_type == 'url':
@@ -1,15 +1,17 @@
 __package__ = 'archivebox.extractors'
 
-from typing import Callable, Optional, Dict, List, Iterable, Union, Protocol, cast
+from typing import Callable, Optional, Dict, List, Iterable, Iterator, Set, Tuple, Union, Protocol, cast
 
 import os
 import sys
 from pathlib import Path
 from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
 
 from django.db.models import QuerySet
 
+from archivebox.config import ARCHIVING_CONFIG
 from archivebox.config.legacy import (
     SAVE_ALLOWLIST_PTN,
     SAVE_DENYLIST_PTN,
@@ -45,6 +47,7 @@ from .git import should_save_git, save_git
 from .media import should_save_media, save_media
 from .archive_org import should_save_archive_dot_org, save_archive_dot_org
 from .headers import should_save_headers, save_headers
+from ..queues.pool import ArchivingPool
 
 
 ShouldSaveFunction = Callable[[Link, Optional[Path], Optional[bool]], bool]
@@ -60,7 +63,7 @@ def get_default_archive_methods() -> List[ArchiveMethodEntry]:
         ('screenshot', should_save_screenshot, save_screenshot),
         ('dom', should_save_dom, save_dom),
         ('wget', should_save_wget, save_wget),
-        # keep title, readability, and htmltotext below wget and singlefile, as they depend on them
+        # keep title, readability, and htmltotext below wget and singlefile, as they depend on them (see DEPENDS_ON)
         ('title', should_save_title, save_title),
         ('readability', should_save_readability, save_readability),
         ('mercury', should_save_mercury, save_mercury),
@@ -104,13 +107,108 @@ def ignore_methods(to_ignore: List[str]) -> Iterable[str]:
     ARCHIVE_METHODS = get_default_archive_methods()
     return [x[0] for x in ARCHIVE_METHODS if x[0] not in to_ignore]
 
+def get_archive_method_dependencies(methods: List[ArchiveMethodEntry]) -> Dict[str, Set[str]]:
+    """
+    Map each method name to the set of methods it has to wait for, based on the DEPENDS_ON declared in
+    each extractor module. Only dependencies that come earlier in the list are kept, so the result is
+    always acyclic and running the methods in list order always satisfies it.
+
+    Methods that set USES_CHROME also wait for every chrome method before them, as they all share the
+    profile lock in CHROME_USER_DATA_DIR and would fail if two of them launched chrome at the same time.
+    """
+    dependencies: Dict[str, Set[str]] = {}
+    seen: Set[str] = set()
+    chrome_methods: Set[str] = set()
+    for method_name, _should_run, _method_function in methods:
+        module = EXTRACTORS.get(method_name)
+        dependencies[method_name] = {name for name in getattr(module, 'DEPENDS_ON', ()) if name in seen}
+        if getattr(module, 'USES_CHROME', False):
+            dependencies[method_name] |= chrome_methods
+            chrome_methods.add(method_name)
+        seen.add(method_name)
+    return dependencies
+
+
+def run_archive_methods(methods: List[ArchiveMethodEntry],
+                        save_method: Callable[[ArchiveMethodEntry], Optional[ArchiveResult]],
+                        max_workers: int=1) -> Iterator[Tuple[str, Optional[ArchiveResult]]]:
+    """
+    Call save_method() for each archive method and yield (method_name, result) as each one finishes.
+
+    With max_workers > 1 the methods are run as a DAG: independent methods (e.g. favicon, headers, git,
+    media, archive_org, and one chrome-based method at a time) run at the same time, and a method only starts
+    once all the methods it depends on have finished (e.g. title/readability/htmltotext wait for dom/singlefile/wget).
+    """
+    if max_workers <= 1:
+        for method in methods:
+            yield method[0], save_method(method)
+        return
+
+    dependencies = get_archive_method_dependencies(methods)
+    pending = list(methods)
+    finished: Set[str] = set()
+    running: Dict[Future, str] = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='archivebox_extractor') as executor:
+        try:
+            while pending or running:
+                for method in list(pending):
+                    if len(running) >= max_workers:
+                        break
+                    if dependencies[method[0]] <= finished:
+                        pending.remove(method)
+                        running[executor.submit(_save_method_in_thread, save_method, method)] = method[0]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    method_name = running.pop(future)
+                    finished.add(method_name)
+                    yield method_name, future.result()
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def _save_method_in_thread(save_method: Callable[[ArchiveMethodEntry], Optional[ArchiveResult]], method: ArchiveMethodEntry) -> Optional[ArchiveResult]:
+    from django.db import connections
+    try:
+        return save_method(method)
+    finally:
+        # extractors like title write to the DB, close the connections django opened for this thread
+        connections.close_all()
+
+
+def log_archive_method_exception(method_name: str, link: Link, e: Exception) -> Exception:
+    """write the exception to the ERROR_LOG and return it chained with the method + url it happened in"""
+    from django.conf import settings
+
+    # https://github.com/ArchiveBox/ArchiveBox/issues/984#issuecomment-1150541627
+    with open(settings.ERROR_LOG, "a", encoding='utf-8') as f:
+        command = ' '.join(sys.argv)
+        ts = datetime.now(timezone.utc).strftime('%Y-%m-%d__%H:%M:%S')
+        f.write(("\n" + 'Exception in archive_methods.save_{}(Link(url={})) command={}; ts={}'.format(
+            method_name,
+            link.url,
+            command,
+            ts
+        ) + "\n" + str(e) + "\n"))
+        #f.write(f"\n> {command}; ts={ts} version={config['VERSION']} docker={config['IN_DOCKER']} is_tty={config['IS_TTY']}\n")
+
+    # print(f'        ERROR: {method_name} {e.__class__.__name__}: {e} {getattr(e, "hints", "")}', ts, link.url, command)
+    e.__cause__ = Exception('Exception in archive_methods.save_{}(Link(url={}))'.format(
+        method_name,
+        link.url,
+    ))
+    return e
+
 @enforce_types
 def archive_link(link: Link, overwrite: bool=False, methods: Optional[Iterable[str]]=None, out_dir: Optional[Path]=None, created_by_id: int | None=None) -> Link:
     """download the DOM, PDF, and a screenshot into a folder named after the link's timestamp"""
 
-    from django.conf import settings
-
-    from ..search import write_search_index
+    from ..search import queue_search_index
+    from ..misc.precompress import queue_precompress
+    from core.manifest import update_output_manifest, get_result_paths
+    from plugins_extractor.chrome.chrome_pool import CHROME_POOL
 
     # TODO: Remove when the input is changed to be a snapshot. Suboptimal approach.
     from core.models import Snapshot, ArchiveResult
@@ -119,8 +217,8 @@ def archive_link(link: Link, overwrite: bool=False, methods: Optional[Iterable[s
     except Snapshot.DoesNotExist:
         snapshot = write_link_to_sql_index(link, created_by_id=created_by_id)
 
-    active_methods = get_archive_methods_for_link(link)
-    
+    active_methods = list(get_archive_methods_for_link(link))
+
     if methods:
         active_methods = [
             method for method in active_methods
@@ -128,6 +226,8 @@ def archive_link(link: Link, overwrite: bool=False, methods: Optional[Iterable[s
         ]
 
     out_dir = out_dir or Path(link.link_dir)
+    # page captures left over from an earlier run of this snapshot (e.g. before an --overwrite) must not be reused
+    CHROME_POOL.discard_captures(out_dir)
     try:
         is_new = not Path(out_dir).exists()
         if is_new:
@@ -139,54 +239,62 @@ def archive_link(link: Link, overwrite: bool=False, methods: Optional[Iterable[s
         link = link.overwrite(downloaded_at=datetime.now(timezone.utc))
         stats = {'skipped': 0, 'succeeded': 0, 'failed': 0}
         start_ts = datetime.now(timezone.utc)
+        indexable_methods = {method for method, _precedence in ARCHIVE_METHODS_INDEXING_PRECEDENCE}
+        needs_indexing = False
 
-        for method_name, should_run, method_function in active_methods:
-            try:
-                if method_name not in link.history:
-                    link.history[method_name] = []
+        for method_name, _should_run, _method_function in active_methods:
+            if method_name not in link.history:
+                link.history[method_name] = []
 
-                if should_run(link, out_dir, overwrite):
-                    log_archive_method_started(method_name)
+        def save_method(method: ArchiveMethodEntry):
+            method_name, should_run, method_function = method
+            try:
+                if not should_run(link, out_dir, overwrite):
+                    return None
+                log_archive_method_started(method_name)
+                return method_function(link=link, out_dir=out_dir)
+            except Exception as e:
+                raise log_archive_method_exception(method_name, link, e)
 
-                    result = method_function(link=link, out_dir=out_dir)
+        for method_name, result in run_archive_methods(active_methods, save_method, max_workers=ARCHIVING_CONFIG.ARCHIVING_EXTRACTOR_WORKERS):
+            if result is None:
+                # print('{black}      X {}{reset}'.format(method_name, **ANSI))
+                stats['skipped'] += 1
+                continue
 
-                    link.history[method_name].append(result)
+            try:
+                link.history[method_name].append(result)
 
-                    stats[result.status] += 1
-                    log_archive_method_finished(result)
-                    write_search_index(link=link, texts=result.index_texts)
-                    ArchiveResult.objects.create(snapshot=snapshot, extractor=method_name, cmd=result.cmd, cmd_version=result.cmd_version,
-                                                 output=result.output, pwd=result.pwd, start_ts=result.start_ts, end_ts=result.end_ts, status=result.status, created_by_id=snapshot.created_by_id)
+                stats[result.status] += 1
+                log_archive_method_finished(result)
+                needs_indexing = needs_indexing or (result.status == 'succeeded' and method_name in indexable_methods)
+                ArchiveResult.objects.create(snapshot=snapshot, extractor=method_name, cmd=result.cmd, cmd_version=result.cmd_version,
+                                             output=result.output, pwd=result.pwd, start_ts=result.start_ts, end_ts=result.end_ts, status=result.status, created_by_id=snapshot.created_by_id)
 
 
-                    # bump the downloaded_at time on the main Snapshot here, this is critical
-                    # to be able to cache summaries of the ArchiveResults for a given
-                    # snapshot without having to load all the results from the DB each time.
-                    # (we use {Snapshot.pk}-{Snapshot.downloaded_at} as the cache key and assume
-                    # ArchiveResults are unchanged as long as the downloaded_at timestamp is unchanged)
-                    snapshot.save()
-                else:
-                    # print('{black}      X {}{reset}'.format(method_name, **ANSI))
-                    stats['skipped'] += 1
+                # bump the downloaded_at time on the main Snapshot here, this is critical
+                # to be able to cache summaries of the ArchiveResults for a given
+                # snapshot without having to load all the results from the DB each time.
+                # (we use {Snapshot.pk}-{Snapshot.downloaded_at} as the cache key and assume
+                # ArchiveResults are unchanged as long as the downloaded_at timestamp is unchanged)
+                snapshot.save()
             except Exception as e:
-                # https://github.com/ArchiveBox/ArchiveBox/issues/984#issuecomment-1150541627
-                with open(settings.ERROR_LOG, "a", encoding='utf-8') as f:
-                    command = ' '.join(sys.argv)
-                    ts = datetime.now(timezone.utc).strftime('%Y-%m-%d__%H:%M:%S')
-                    f.write(("\n" + 'Exception in archive_methods.save_{}(Link(url={})) command={}; ts={}'.format(
-                        method_name,
-                        link.url,
-                        command,
-                        ts
-                    ) + "\n" + str(e) + "\n"))
-                    #f.write(f"\n> {command}; ts={ts} version={config['VERSION']} docker={config['IN_DOCKER']} is_tty={config['IS_TTY']}\n")
-
-                # print(f'        ERROR: {method_name} {e.__class__.__name__}: {e} {getattr(e, "hints", "")}', ts, link.url, command)
-                raise e from Exception('Exception in archive_methods.save_{}(Link(url={}))'.format(
-                    method_name,
-                    link.url,
-                ))
+                raise log_archive_method_exception(method_name, link, e)
+
+            try:
+                # record the files this extractor wrote, so they can be listed without scanning the folder
+                update_output_manifest(snapshot, paths=get_result_paths(snapshot, method_name, result))
+            except Exception as err:
+                print('    ! Failed to store the output manifest: {}: {}'.format(err.__class__.__name__, err))
+
 
+        if needs_indexing:
+            # indexed in the background with one write per snapshot, instead of once per extractor in the loop above
+            queue_search_index([str(snapshot.pk)])
+
+        if stats['succeeded']:
+            # write .br/.gz copies of the new outputs in the background (if PRECOMPRESS_OUTPUTS is enabled)
+            queue_precompress(out_dir)
 
         # print('    ', stats)
 
@@ -199,6 +307,13 @@ def archive_link(link: Link, overwrite: bool=False, methods: Optional[Iterable[s
 
         write_link_details(link, out_dir=out_dir, skip_sql_index=False)
 
+        try:
+            # again for the whole folder, now that the index files have been rewritten
+            update_output_manifest(snapshot)
+        except Exception as err:
+            # its outputs are checked on the filesystem until the next archive_link, init, or update --index-only stores it
+            print('    ! Failed to store the output manifest: {}: {}'.format(err.__class__.__name__, err))
+
         log_link_archiving_finished(link, out_dir, is_new, stats, start_ts)
 
     except KeyboardInterrupt:
@@ -212,6 +327,10 @@ def archive_link(link: Link, overwrite: bool=False, methods: Optional[Iterable[s
         print('    ! Failed to archive link: {}: {}'.format(err.__class__.__name__, err))
         raise
 
+    finally:
+        # e.g. the pdf capture made alongside the screenshot when only the screenshot method was run
+        CHROME_POOL.discard_captures(out_dir)
+
     return link
 
 @enforce_types
@@ -228,7 +347,32 @@ def archive_links(all_links: Union[Iterable[Link], QuerySet], overwrite: bool=Fa
     if num_links == 0:
         return []
 
+    # snapshots get queued to be indexed as they're archived, whatever the search_indexing
+    # worker hasn't picked up yet (or all of them if it isn't running) is indexed at the end
+    from ..search import index_queued_snapshots
+
     log_archiving_started(num_links)
+
+    if ARCHIVING_CONFIG.ARCHIVING_WORKERS > 1:
+        pool = ArchivingPool()
+        try:
+            pool.run(
+                (get_link(link) for link in all_links),
+                lambda link: archive_link(link, overwrite=overwrite, methods=methods, out_dir=Path(link.link_dir), created_by_id=created_by_id),
+                num_links=num_links,
+            )
+        except KeyboardInterrupt:
+            paused_at = pool.oldest_running
+            log_archiving_paused(num_links, pool.num_finished, paused_at.timestamp if paused_at else '')
+            raise SystemExit(0)
+        except BaseException:
+            print()
+            raise
+
+        index_queued_snapshots()
+        log_archiving_finished(num_links)
+        return all_links
+
     idx: int = 0
     try:
         for link in all_links:
@@ -242,6 +386,7 @@ def archive_links(all_links: Union[Iterable[Link], QuerySet], overwrite: bool=Fa
         print()
         raise
 
+    index_queued_snapshots()
     log_archiving_finished(num_links)
     return all_links
 
@@ -253,6 +398,11 @@ class ExtractorModuleProtocol(Protocol):
     """Type interface for an Extractor Module (WIP)"""
     
     get_output_path: Callable
+
+    # optional: names of other extractors whose outputs this one reads, used to order them in archive_link()
+    # DEPENDS_ON: Tuple[str, ...]
+    # optional: True if this extractor launches chrome, they are run one at a time in archive_link()
+    # USES_CHROME: bool
     
     # TODO:
     # get_embed_path: Callable | None
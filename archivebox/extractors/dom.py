@@ -11,6 +11,7 @@ from archivebox.misc.util import (
 )
 from ..logging_util import TimedProgress
 
+USES_CHROME = True          # drives chrome with CHROME_USER_DATA_DIR, only one of these can run at a time
 
 def get_output_path():
     return 'output.html'
@@ -35,6 +36,7 @@ def save_dom(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -> Archi
     """print HTML of site to file using chrome --dump-html"""
 
     from plugins_extractor.chrome.apps import CHROME_CONFIG, CHROME_BINARY
+    from plugins_extractor.chrome.chrome_pool import CHROME_POOL
 
     CHROME_BIN = CHROME_BINARY.load()
     assert CHROME_BIN.abspath and CHROME_BIN.version
@@ -51,12 +53,15 @@ def save_dom(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -> Archi
     status = 'succeeded'
     timer = TimedProgress(timeout, prefix='      ')
     try:
-        result = run(cmd, cwd=str(out_dir), timeout=timeout, text=True)
-        atomic_write(output_path, result.stdout)
+        if CHROME_POOL.is_available:
+            atomic_write(output_path, CHROME_POOL.get_output('dom', link.url, out_dir, timeout=timeout))
+        else:
+            result = run(cmd, cwd=str(out_dir), timeout=timeout, text=True)
+            atomic_write(output_path, result.stdout)
 
-        if result.returncode:
-            hints = result.stderr
-            raise ArchiveError('Failed to save DOM', hints)
+            if result.returncode:
+                hints = result.stderr
+                raise ArchiveError('Failed to save DOM', hints)
 
         chmod_file(output, cwd=str(out_dir))
     except Exception as err:
@@ -15,6 +15,8 @@ from ..index.schema import Link, ArchiveResult, ArchiveError
 from .title import get_html
 
 
+DEPENDS_ON = ('dom', 'singlefile', 'wget')         # text is extracted from the html saved by these
+
 def get_output_path():
     return "htmltotext.txt"
 
@@ -100,6 +102,12 @@ class HTMLTextExtractor(HTMLParser):
                 # whitespace characters were stripped
                 self.output.write(' ')
 
+    def take_output(self) -> str:
+        """return the text extracted since the last call and clear it, for feeding a document in one chunk at a time"""
+        text = self.output.getvalue()
+        self.output = io.StringIO()
+        return text
+
     def __str__(self):
         return self.output.getvalue()
 
@@ -4,13 +4,14 @@ from pathlib import Path
 from typing import Optional
 
 from ..index.schema import Link, ArchiveResult, ArchiveOutput, ArchiveError
-from archivebox.misc.system import run, chmod_file
+from archivebox.misc.system import run, chmod_file, atomic_write
 from archivebox.misc.util import (
     enforce_types,
     is_static_file,
 )
 from ..logging_util import TimedProgress
 
+USES_CHROME = True          # drives chrome with CHROME_USER_DATA_DIR, only one of these can run at a time
 
 def get_output_path():
     return 'output.pdf'
@@ -35,6 +36,7 @@ def save_pdf(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -> Archi
     """print PDF of site to file using chrome --headless"""
 
     from plugins_extractor.chrome.apps import CHROME_CONFIG, CHROME_BINARY
+    from plugins_extractor.chrome.chrome_pool import CHROME_POOL
 
     CHROME_BIN = CHROME_BINARY.load()
     assert CHROME_BIN.abspath and CHROME_BIN.version
@@ -50,11 +52,15 @@ def save_pdf(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -> Archi
     status = 'succeeded'
     timer = TimedProgress(timeout, prefix='      ')
     try:
-        result = run(cmd, cwd=str(out_dir), timeout=timeout, text=True)
-
-        if result.returncode:
-            hints = (result.stderr or result.stdout)
-            raise ArchiveError('Failed to save PDF', hints)
+        if CHROME_POOL.is_available:
+            pdf = CHROME_POOL.get_output('pdf', link.url, out_dir, timeout=timeout)
+            atomic_write(out_dir / output, pdf)
+        else:
+            result = run(cmd, cwd=str(out_dir), timeout=timeout, text=True)
+
+            if result.returncode:
+                hints = (result.stderr or result.stdout)
+                raise ArchiveError('Failed to save PDF', hints)
         
         chmod_file(get_output_path(), cwd=str(out_dir))
     except Exception as err:
@@ -12,6 +12,8 @@ from archivebox.misc.util import enforce_types, is_static_file
 from ..logging_util import TimedProgress
 from .title import get_html
 
+DEPENDS_ON = ('dom', 'singlefile', 'wget')         # get_html() reads the page html from these outputs
+
 def get_output_path():
     return 'readability/'
 
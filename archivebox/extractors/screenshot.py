@@ -4,10 +4,11 @@ from pathlib import Path
 from typing import Optional
 
 from ..index.schema import Link, ArchiveResult, ArchiveOutput, ArchiveError
-from archivebox.misc.system import run, chmod_file
+from archivebox.misc.system import run, chmod_file, atomic_write
 from archivebox.misc.util import enforce_types, is_static_file
 from ..logging_util import TimedProgress
 
+USES_CHROME = True          # drives chrome with CHROME_USER_DATA_DIR, only one of these can run at a time
 
 def get_output_path():
     return 'screenshot.png'
@@ -31,6 +32,7 @@ def save_screenshot(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -
     """take screenshot of site using chrome --headless"""
     
     from plugins_extractor.chrome.apps import CHROME_CONFIG, CHROME_BINARY
+    from plugins_extractor.chrome.chrome_pool import CHROME_POOL
     CHROME_BIN = CHROME_BINARY.load()
     assert CHROME_BIN.abspath and CHROME_BIN.version
 
@@ -45,11 +47,15 @@ def save_screenshot(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -
     status = 'succeeded'
     timer = TimedProgress(timeout, prefix='      ')
     try:
-        result = run(cmd, cwd=str(out_dir), timeout=timeout, text=True)
+        if CHROME_POOL.is_available:
+            screenshot = CHROME_POOL.get_output('screenshot', link.url, out_dir, timeout=timeout)
+            atomic_write(out_dir / output, screenshot)
+        else:
+            result = run(cmd, cwd=str(out_dir), timeout=timeout, text=True)
 
-        if result.returncode:
-            hints = (result.stderr or result.stdout)
-            raise ArchiveError('Failed to save screenshot', hints)
+            if result.returncode:
+                hints = (result.stderr or result.stdout)
+                raise ArchiveError('Failed to save screenshot', hints)
 
         chmod_file(output, cwd=str(out_dir))
     except Exception as err:
@@ -1,6 +1,7 @@
 __package__ = 'archivebox.extractors'
 
 from pathlib import Path
+from contextlib import nullcontext
 
 from typing import Optional
 import json
@@ -10,6 +11,7 @@ from archivebox.misc.system import run, chmod_file
 from archivebox.misc.util import enforce_types, is_static_file, dedupe
 from ..logging_util import TimedProgress
 
+USES_CHROME = True          # drives chrome with CHROME_USER_DATA_DIR, only one of these can run at a time
 
 def get_output_path():
     return 'singlefile.html'
@@ -34,6 +36,7 @@ def save_singlefile(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -
     """download full site using single-file"""
     
     from plugins_extractor.chrome.apps import CHROME_CONFIG, CHROME_BINARY
+    from plugins_extractor.chrome.chrome_pool import CHROME_POOL
     from plugins_extractor.singlefile.apps import SINGLEFILE_CONFIG, SINGLEFILE_BINARY
 
     CHROME_BIN = CHROME_BINARY.load()
@@ -64,7 +67,12 @@ def save_singlefile(link: Link, out_dir: Optional[Path]=None, timeout: int=60) -
     timer = TimedProgress(timeout, prefix='      ')
     result = None
     try:
-        result = run(cmd, cwd=str(out_dir), timeout=timeout, text=True, capture_output=True)
+        # attach to an already-running browser from the pool instead of having single-file launch its own
+        with (CHROME_POOL.browser() if CHROME_POOL.is_available else nullcontext()) as browser:
+            run_cmd = cmd
+            if browser:
+                run_cmd = [*cmd[:-2], f'--browser-remote-debugging-URL={browser.http_url}', *cmd[-2:]]
+            result = run(run_cmd, cwd=str(out_dir), timeout=timeout, text=True, capture_output=True)
 
         # parse out number of files downloaded from last line of stderr:
         #  "Downloaded: 76 files, 4.0M in 1.6s (2.52 MB/s)"
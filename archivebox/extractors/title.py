@@ -15,6 +15,7 @@ from archivebox.plugins_extractor.curl.apps import CURL_CONFIG, CURL_BINARY
 from ..index.schema import Link, ArchiveResult, ArchiveOutput, ArchiveError
 from ..logging_util import TimedProgress
 
+DEPENDS_ON = ('dom', 'singlefile', 'wget')         # get_html() reads the page html from these outputs
 
 
 HTML_TITLE_REGEX = re.compile(
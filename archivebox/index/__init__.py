@@ -5,15 +5,16 @@ import shutil
 from pathlib import Path
 
 from itertools import chain
-from typing import List, Tuple, Dict, Optional, Iterable
+from typing import List, Tuple, Dict, Set, Optional, Iterable, Iterator
 from collections import OrderedDict
 from contextlib import contextmanager
 from urllib.parse import urlparse
 from django.db.models import QuerySet, Q
+from django.db.models.expressions import RawSQL
 
 
 from archivebox.config import DATA_DIR, CONSTANTS, ARCHIVING_CONFIG, STORAGE_CONFIG, SEARCH_BACKEND_CONFIG
-from archivebox.misc.util import scheme, enforce_types, ExtendedEncoder
+from archivebox.misc.util import scheme, enforce_types, chunked, ExtendedEncoder
 from archivebox.misc.logging import stderr
 from archivebox.config.legacy import URL_DENYLIST_PTN, URL_ALLOWLIST_PTN
 
@@ -37,11 +38,19 @@ from .json import (
     write_json_link_details,
 )
 from .sql import (
+    SQL_INDEX_CHUNK_SIZE,
     write_sql_main_index,
     write_sql_link_details,
 )
 
 
+# number of links parsed, deduped, and written to the index at a time during a streaming import
+IMPORT_BATCH_SIZE = 1000
+
+# above this many urls, match them against the index by joining on a temp table instead of running chunked url__in queries
+DEDUPE_TEMP_TABLE_THRESHOLD = 50_000
+
+
 ### Link filtering and checking
 
 @enforce_types
@@ -273,17 +282,85 @@ def parse_links_from_source(source_path: str, root_url: Optional[str]=None, pars
 
     return new_links
 
+@enforce_types
+def stream_links_from_source(source_path: str, root_url: Optional[str]=None, parser: str="auto", batch_size: int=IMPORT_BATCH_SIZE) -> Iterator[List[Link]]:
+    """
+    like parse_links_from_source(), but parses the file lazily with a single parser and yields
+    validated links in fixed-size batches, so memory use stays flat no matter how big the input is
+    """
+
+    from ..parsers import parse_links_streaming
+
+    raw_links, parser_name = parse_links_streaming(source_path, root_url=root_url, parser=parser)
+
+    num_parsed = 0
+    def counted(links: Iterator[Link]) -> Iterator[Link]:
+        nonlocal num_parsed
+        for link in links:
+            num_parsed += 1
+            yield link
+
+    for batch in chunked(archivable_links(counted(raw_links)), batch_size):
+        # dupes within a batch are merged here, dupes across batches are caught by dedupe_links() once earlier batches are written
+        yield list(fix_duplicate_links(sorted_links(batch)))
+
+    log_parsing_finished(num_parsed, parser_name)
+
+@contextmanager
+def temporary_url_table(urls: Iterable[str]) -> Iterator[str]:
+    """load urls into a temporary sqlite table (only visible to this db connection) and yield its name"""
+    from django.db import connection
+
+    table_name = 'temp.archivebox_dedupe_urls'
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+        cursor.execute(f'CREATE TABLE {table_name} (url TEXT PRIMARY KEY)')
+        for chunk in chunked(urls, 10_000):
+            cursor.executemany(f'INSERT OR IGNORE INTO {table_name} (url) VALUES (%s)', [(url,) for url in chunk])
+    try:
+        yield table_name
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+
+
+def filter_by_urls(snapshots: QuerySet, urls: Iterable[str]) -> Iterator:
+    """
+    yield everything in the given queryset with a url in urls, using a few set-based queries instead of one per url
+    (works on any queryset, e.g. snapshots.values_list('url', flat=True) to only fetch the matching urls)
+    """
+    urls = list(dict.fromkeys(urls))
+
+    if len(urls) > DEDUPE_TEMP_TABLE_THRESHOLD:
+        with temporary_url_table(urls) as table_name:
+            yield from snapshots.filter(url__in=RawSQL(f'SELECT url FROM {table_name}', ())).iterator(chunk_size=SQL_INDEX_CHUNK_SIZE)
+        return
+
+    for chunk in chunked(urls, SQL_INDEX_CHUNK_SIZE):
+        yield from snapshots.filter(url__in=chunk).iterator(chunk_size=SQL_INDEX_CHUNK_SIZE)
+
+
+def indexed_values(snapshots: QuerySet, field: str) -> Set[str]:
+    """load every value of one field (e.g. timestamp or url) in the main index into a set, to check membership without a query per folder"""
+    return set(snapshots.prefetch_related(None).values_list(field, flat=True).iterator(chunk_size=10_000))
+
+
 @enforce_types
 def fix_duplicate_links_in_index(snapshots: QuerySet, links: Iterable[Link]) -> Iterable[Link]:
     """
     Given a list of in-memory Links, dedupe and merge them with any conflicting Snapshots in the DB.
     """
+    links = list(links)
+    index_links = {
+        snapshot.url: snapshot.as_link()
+        for snapshot in filter_by_urls(snapshots, (link.url for link in links))
+    }
+
     unique_urls: OrderedDict[str, Link] = OrderedDict()
 
     for link in links:
-        index_link = snapshots.filter(url=link.url)
-        if index_link:
-            link = merge_links(index_link[0].as_link(), link)
+        if link.url in index_links:
+            link = merge_links(index_links[link.url], link)
 
         unique_urls[link.url] = link
 
@@ -296,21 +373,20 @@ def dedupe_links(snapshots: QuerySet,
     The validation of links happened at a different stage. This method will
     focus on actual deduplication and timestamp fixing.
     """
-    
-    # merge existing links in out_dir and new links
-    dedup_links = fix_duplicate_links_in_index(snapshots, new_links)
 
+    existing_urls = set(filter_by_urls(
+        snapshots.prefetch_related(None).values_list('url', flat=True),
+        (link.url for link in new_links),
+    ))
+
+    # links already in the index are dropped entirely (merging them would be thrown away anyway),
+    # if the same new url appears more than once, it's kept once where it first appeared, with its last version
+    dedup_links_dict = {link.url: link for link in new_links}
     new_links = [
-        link for link in new_links
-        if not snapshots.filter(url=link.url).exists()
+        dedup_links_dict[url]
+        for url in dict.fromkeys(link.url for link in new_links)
+        if url not in existing_urls
     ]
-
-    dedup_links_dict = {link.url: link for link in dedup_links}
-
-    # Replace links in new_links with the dedup version
-    for i in range(len(new_links)):
-        if new_links[i].url in dedup_links_dict.keys():
-            new_links[i] = dedup_links_dict[new_links[i].url]
     log_deduping_finished(len(new_links))
 
     return new_links
@@ -398,7 +474,9 @@ def snapshot_filter(snapshots: QuerySet, filter_patterns: List[str], filter_type
 
 def get_indexed_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optional[Link]]:
     """indexed links without checking archive status or data directory validity"""
-    links = (snapshot.as_link() for snapshot in snapshots.iterator(chunk_size=500))
+    from core.manifest import with_results_key
+
+    links = (snapshot.as_link() for snapshot in with_results_key(snapshots).iterator(chunk_size=500))
     return {
         link.link_dir: link
         for link in links
@@ -406,7 +484,9 @@ def get_indexed_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optional
 
 def get_archived_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optional[Link]]:
     """indexed links that are archived with a valid data directory"""
-    links = (snapshot.as_link() for snapshot in snapshots.iterator(chunk_size=500))
+    from core.manifest import with_results_key
+
+    links = (snapshot.as_link() for snapshot in with_results_key(snapshots).iterator(chunk_size=500))
     return {
         link.link_dir: link
         for link in filter(is_archived, links)
@@ -414,7 +494,9 @@ def get_archived_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optiona
 
 def get_unarchived_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optional[Link]]:
     """indexed links that are unarchived with no data directory or an empty data directory"""
-    links = (snapshot.as_link() for snapshot in snapshots.iterator(chunk_size=500))
+    from core.manifest import with_results_key
+
+    links = (snapshot.as_link() for snapshot in with_results_key(snapshots).iterator(chunk_size=500))
     return {
         link.link_dir: link
         for link in filter(is_unarchived, links)
@@ -460,10 +542,11 @@ def get_duplicate_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Option
     by_timestamp = {}
     duplicate_folders = {}
 
+    indexed_timestamps = indexed_values(snapshots, 'timestamp')
     data_folders = (
         str(entry)
         for entry in CONSTANTS.ARCHIVE_DIR.iterdir()
-            if entry.is_dir() and not snapshots.filter(timestamp=entry.name).exists()
+            if entry.is_dir() and entry.name not in indexed_timestamps
     )
 
     for path in chain(snapshots.iterator(chunk_size=500), data_folders):
@@ -491,6 +574,7 @@ def get_duplicate_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Option
 def get_orphaned_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optional[Link]]:
     """dirs that contain a valid index but aren't listed in the main index"""
     orphaned_folders = {}
+    indexed_timestamps = indexed_values(snapshots, 'timestamp')
 
     for entry in CONSTANTS.ARCHIVE_DIR.iterdir():
         if entry.is_dir():
@@ -500,7 +584,7 @@ def get_orphaned_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optiona
             except Exception:
                 pass
 
-            if link and not snapshots.filter(timestamp=entry.name).exists():
+            if link and entry.name not in indexed_timestamps:
                 # folder is a valid link data dir with index details, but it's not in the main index
                 orphaned_folders[str(entry)] = link
 
@@ -508,8 +592,10 @@ def get_orphaned_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optiona
 
 def get_corrupted_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optional[Link]]:
     """dirs that don't contain a valid index and aren't listed in the main index"""
+    from core.manifest import with_results_key
+
     corrupted = {}
-    for snapshot in snapshots.iterator(chunk_size=500):
+    for snapshot in with_results_key(snapshots).iterator(chunk_size=500):
         link = snapshot.as_link()
         if is_corrupt(link):
             corrupted[link.link_dir] = link
@@ -518,6 +604,7 @@ def get_corrupted_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Option
 def get_unrecognized_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Optional[Link]]:
     """dirs that don't contain recognizable archive data and aren't listed in the main index"""
     unrecognized_folders: Dict[str, Optional[Link]] = {}
+    indexed_timestamps = indexed_values(snapshots, 'timestamp')
 
     for entry in (Path(out_dir) / CONSTANTS.ARCHIVE_DIR_NAME).iterdir():
         if entry.is_dir():
@@ -542,8 +629,7 @@ def get_unrecognized_folders(snapshots, out_dir: Path=DATA_DIR) -> Dict[str, Opt
             
             elif not index_exists:
                 # link details index doesn't exist and the folder isn't in the main index
-                timestamp = entry.name
-                if not snapshots.filter(timestamp=timestamp).exists():
+                if entry.name not in indexed_timestamps:
                     unrecognized_folders[str(entry)] = link
 
     return unrecognized_folders
@@ -584,29 +670,35 @@ def is_unarchived(link: Link) -> bool:
     return not link.is_archived
 
 
-def fix_invalid_folder_locations(out_dir: Path=DATA_DIR) -> Tuple[List[str], List[str]]:
+def fix_invalid_folder_locations(out_dir: Path=DATA_DIR, folders: Optional[Iterable[str]]=None) -> Tuple[List[str], List[str]]:
+    """move data folders that aren't named after their link's timestamp (only checks the given folder paths if passed, otherwise all of archive/)"""
     fixed = []
     cant_fix = []
-    for entry in os.scandir(out_dir / CONSTANTS.ARCHIVE_DIR_NAME):
-        if entry.is_dir(follow_symlinks=True):
-            if (Path(entry.path) / 'index.json').exists():
-                try:
-                    link = parse_json_link_details(entry.path)
-                except KeyError:
-                    link = None
-                if not link:
-                    continue
-
-                if not entry.path.endswith(f'/{link.timestamp}'):
-                    dest = out_dir /CONSTANTS.ARCHIVE_DIR_NAME / link.timestamp
-                    if dest.exists():
-                        cant_fix.append(entry.path)
-                    else:
-                        shutil.move(entry.path, dest)
-                        fixed.append(dest)
-                        timestamp = entry.path.rsplit('/', 1)[-1]
-                        assert link.link_dir == entry.path
-                        assert link.timestamp == timestamp
-                        write_json_link_details(link, out_dir=entry.path)
+    if folders is None:
+        folders = (
+            entry.path
+            for entry in os.scandir(out_dir / CONSTANTS.ARCHIVE_DIR_NAME)
+                if entry.is_dir(follow_symlinks=True)
+        )
+    for path in folders:
+        if (Path(path) / 'index.json').exists():
+            try:
+                link = parse_json_link_details(path)
+            except KeyError:
+                link = None
+            if not link:
+                continue
+
+            if not path.endswith(f'/{link.timestamp}'):
+                dest = out_dir /CONSTANTS.ARCHIVE_DIR_NAME / link.timestamp
+                if dest.exists():
+                    cant_fix.append(path)
+                else:
+                    shutil.move(path, dest)
+                    fixed.append(dest)
+                    timestamp = path.rsplit('/', 1)[-1]
+                    assert link.link_dir == path
+                    assert link.timestamp == timestamp
+                    write_json_link_details(link, out_dir=path)
 
     return fixed, cant_fix
@@ -0,0 +1,309 @@
+__package__ = 'archivebox.index'
+
+import os
+import json
+import sqlite3
+
+from pathlib import Path
+from itertools import chain
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Iterator, Iterable
+
+from django.db.models import QuerySet
+
+from archivebox.config import DATA_DIR, CONSTANTS, STORAGE_CONFIG
+from archivebox.misc.util import enforce_types, domain, chunked
+
+from .schema import Link
+from .json import parse_json_link_details
+
+
+# sidecar db that remembers what each archive/<timestamp> folder looked like last time it was scanned
+FOLDER_STATUS_DB = CONSTANTS.CACHE_DIR / 'folder_status.sqlite3'
+
+# number of folders handed to each worker process at a time, the folder_status cache is committed after each one
+SCAN_CHUNK_SIZE = 1000
+
+# the same paths checked by Link.is_archived, (plus the domain folder wget saves into, which depends on the url)
+OUTPUT_PATHS = (
+    'output.html',
+    'output.pdf',
+    'screenshot.png',
+    'singlefile.html',
+    'readability/content.html',
+    'mercury/content.html',
+    'htmltotext.txt',
+    'media',
+    'git',
+)
+
+# subfolders that OUTPUT_PATHS look inside of, files written into these don't change the mtime of the data folder itself
+OUTPUT_SUBDIRS = tuple(dict.fromkeys(path.split('/', 1)[0] for path in OUTPUT_PATHS if '/' in path))
+
+FOLDER_STATUSES = (
+    'indexed', 'archived', 'unarchived',
+    'present', 'valid', 'invalid',
+    'duplicate', 'orphaned', 'corrupted', 'unrecognized',
+)
+
+# statuses that are reported per main index entry (the rest are reported per data folder found on disk)
+SNAPSHOT_STATUSES = ('indexed', 'archived', 'unarchived', 'valid', 'corrupted')
+
+
+@dataclass
+class FolderScan:
+    """what was found in one archive/<timestamp> data folder, without any knowledge of the main index"""
+    name: str
+    dir_mtime: float
+    index_mtime: Optional[float]    # None if there's no index.json
+    subdir_mtimes: List[Optional[float]]    # mtime of each of OUTPUT_SUBDIRS, None if it doesn't exist
+    index_status: str               # 'missing', 'valid', 'guessable' (only loads with guess=True), or 'invalid'
+    url: Optional[str]              # url + timestamp from index.json (if it could be loaded)
+    timestamp: Optional[str]
+    outputs: List[str]              # which of OUTPUT_PATHS exist + names of all top-level subfolders
+
+    def has_outputs(self, url: str) -> bool:
+        """equivalent to Link.is_archived for a link with the given url stored in this folder"""
+        return domain(url) in self.outputs or any(path in self.outputs for path in OUTPUT_PATHS)
+
+
+def get_folder_status_db() -> sqlite3.Connection:
+    FOLDER_STATUS_DB.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(FOLDER_STATUS_DB)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS folder_status (
+            name TEXT PRIMARY KEY,
+            dir_mtime REAL NOT NULL,
+            index_mtime REAL,
+            subdir_mtimes TEXT NOT NULL,
+            index_status TEXT NOT NULL,
+            url TEXT,
+            timestamp TEXT,
+            outputs TEXT NOT NULL
+        )
+    ''')
+    return db
+
+
+def get_subdir_mtimes(path: str) -> List[Optional[float]]:
+    """the mtime of each of OUTPUT_SUBDIRS in a data folder, None for the ones that don't exist"""
+    subdir_mtimes: List[Optional[float]] = []
+    for subdir in OUTPUT_SUBDIRS:
+        try:
+            subdir_mtimes.append(os.stat(os.path.join(path, subdir)).st_mtime)
+        except (FileNotFoundError, NotADirectoryError):
+            subdir_mtimes.append(None)
+    return subdir_mtimes
+
+
+def scan_folder(path: str, name: str, dir_mtime: float, index_mtime: Optional[float], subdir_mtimes: List[Optional[float]]) -> FolderScan:
+    """read a single data folder's index.json and check which outputs it contains"""
+
+    index_status, link = 'missing', None
+    if index_mtime is not None:
+        for index_status, guess in (('valid', False), ('guessable', True)):
+            try:
+                link = parse_json_link_details(path, guess=guess)
+            except Exception:
+                link = None
+            if link:
+                break
+        else:
+            index_status = 'invalid'
+
+    outputs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name in OUTPUT_PATHS or entry.is_dir(follow_symlinks=True):
+                outputs.append(entry.name)
+    outputs += [
+        output_path
+        for output_path in OUTPUT_PATHS
+        if '/' in output_path and output_path.split('/', 1)[0] in outputs and os.path.exists(os.path.join(path, output_path))
+    ]
+
+    return FolderScan(
+        name=name,
+        dir_mtime=dir_mtime,
+        index_mtime=index_mtime,
+        subdir_mtimes=subdir_mtimes,
+        index_status=index_status,
+        url=link.url if link else None,
+        timestamp=link.timestamp if link else None,
+        outputs=outputs,
+    )
+
+
+def scan_folders_chunk(to_scan: List[tuple]) -> List[FolderScan]:
+    """scan_folder() for a list of (path, name, dir_mtime, index_mtime, subdir_mtimes), run in a worker process"""
+    return [scan_folder(*args) for args in to_scan]
+
+
+def load_links_chunk(paths: List[str]) -> List[Optional[Link]]:
+    """parse_json_link_details() for a list of folder paths, run in a worker process"""
+    links = []
+    for path in paths:
+        try:
+            links.append(parse_json_link_details(path))
+        except Exception:
+            links.append(None)
+    return links
+
+
+def map_chunks(func, items: List, workers: Optional[int]=None) -> Iterator[list]:
+    """call func on SCAN_CHUNK_SIZE items at a time, spread across a pool of worker processes, yields results in order"""
+    workers = max(workers or STORAGE_CONFIG.SCAN_WORKERS, 1)
+    chunks = chunked(items, SCAN_CHUNK_SIZE)
+    if workers == 1 or len(items) <= SCAN_CHUNK_SIZE:
+        yield from map(func, chunks)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield from pool.map(func, chunks)
+    finally:
+        # on Ctrl+C drop any chunks that haven't started yet instead of waiting for them to finish
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+@enforce_types
+def scan_archive_folders(out_dir: Path=DATA_DIR, workers: Optional[int]=None) -> Dict[str, FolderScan]:
+    """
+    Scan every folder in archive/ in one pass using os.scandir + stat.
+    Folders whose mtime, index.json mtime, and OUTPUT_SUBDIRS mtimes haven't changed since the last scan are
+    loaded from the folder_status cache instead of being re-read, so repeat scans only revisit folders that changed.
+
+    Folders that do need to be re-read are spread across a pool of worker processes, and the cache is
+    committed after every chunk, so an interrupted scan picks up where it stopped the next time it runs.
+    """
+
+    archive_dir = out_dir / CONSTANTS.ARCHIVE_DIR_NAME
+    db = get_folder_status_db()
+    try:
+        cached = {
+            row[0]: FolderScan(*row[:3], json.loads(row[3]), *row[4:-1], outputs=json.loads(row[-1]))
+            for row in db.execute('SELECT name, dir_mtime, index_mtime, subdir_mtimes, index_status, url, timestamp, outputs FROM folder_status')
+        }
+
+        folders: Dict[str, FolderScan] = {}
+        to_scan: List[tuple] = []
+        with os.scandir(archive_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=True):
+                    continue
+                dir_mtime = entry.stat().st_mtime
+                try:
+                    index_mtime = os.stat(os.path.join(entry.path, CONSTANTS.JSON_INDEX_FILENAME)).st_mtime
+                except FileNotFoundError:
+                    index_mtime = None
+                subdir_mtimes = get_subdir_mtimes(entry.path)
+
+                folder = cached.get(entry.name)
+                if folder and folder.dir_mtime == dir_mtime and folder.index_mtime == index_mtime and folder.subdir_mtimes == subdir_mtimes:
+                    folders[entry.name] = folder
+                else:
+                    to_scan.append((entry.path, entry.name, dir_mtime, index_mtime, subdir_mtimes))
+
+        for scanned in map_chunks(scan_folders_chunk, to_scan, workers=workers):
+            with db:
+                db.executemany(
+                    'INSERT OR REPLACE INTO folder_status VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [
+                        (f.name, f.dir_mtime, f.index_mtime, json.dumps(f.subdir_mtimes), f.index_status, f.url, f.timestamp, json.dumps(f.outputs))
+                        for f in scanned
+                    ],
+                )
+            folders.update((folder.name, folder) for folder in scanned)
+
+        with db:
+            removed = [(name,) for name in cached if name not in folders]
+            db.executemany('DELETE FROM folder_status WHERE name = ?', removed)
+    finally:
+        db.close()
+
+    return folders
+
+
+def load_folder_details(paths: List[str], workers: Optional[int]=None) -> Iterator[Link]:
+    """load the index.json Link from each of the given data folders using a pool of worker processes, skipping any that can't be parsed"""
+    for links in map_chunks(load_links_chunk, paths, workers=workers):
+        yield from filter(None, links)
+
+
+@enforce_types
+def classify_folders(snapshots: QuerySet, out_dir: Path=DATA_DIR) -> Dict[str, List[str]]:
+    """
+    Sort every main index entry and every data folder into all the get_*_folders() statuses at once,
+    returns {status: [folder_path, ...]}
+    """
+
+    archive_dir = out_dir / CONSTANTS.ARCHIVE_DIR_NAME
+    folders = scan_archive_folders(out_dir=out_dir)
+    indexed = dict(snapshots.prefetch_related(None).values_list('timestamp', 'url').iterator(chunk_size=2000))
+
+    statuses: Dict[str, List[str]] = {status: [] for status in FOLDER_STATUSES}
+
+    for timestamp, url in indexed.items():
+        path = str(archive_dir / timestamp)
+        folder = folders.get(timestamp)
+        is_valid = bool(folder and folder.index_status in ('valid', 'guessable') and folder.url == url)
+
+        statuses['indexed'].append(path)
+        if is_valid and folder.has_outputs(url):
+            statuses['archived'].append(path)
+        if not folder or not folder.has_outputs(url):
+            statuses['unarchived'].append(path)
+        if is_valid:
+            statuses['valid'].append(path)
+        if folder and not is_valid:
+            statuses['corrupted'].append(path)
+
+    # main index entries are checked for duplicates first, then any other data folders
+    by_timestamp: Dict[str, int] = {}
+    by_url: Dict[str, int] = {}
+    in_index_first = chain(
+        (folders[timestamp] for timestamp in indexed if timestamp in folders),
+        (folder for folder in folders.values() if folder.name not in indexed),
+    )
+    for folder in in_index_first:
+        path = str(archive_dir / folder.name)
+        if folder.index_status == 'valid':
+            by_timestamp[folder.timestamp] = by_timestamp.get(folder.timestamp, 0) + 1
+            by_url[folder.url] = by_url.get(folder.url, 0) + 1
+            if by_timestamp[folder.timestamp] > 1 or by_url[folder.url] > 1:
+                statuses['duplicate'].append(path)
+
+    for folder in folders.values():
+        path = str(archive_dir / folder.name)
+        statuses['present'].append(path)
+        if folder.index_status == 'valid' and folder.name not in indexed:
+            statuses['orphaned'].append(path)
+        if folder.index_status == 'invalid' or (folder.index_status == 'missing' and folder.name not in indexed):
+            statuses['unrecognized'].append(path)
+
+    statuses['invalid'] = list(dict.fromkeys(
+        statuses['duplicate'] + statuses['orphaned'] + statuses['corrupted'] + statuses['unrecognized']
+    ))
+    return statuses
+
+
+def load_folder_links(snapshots: QuerySet, status: str, paths: Iterable[str]) -> Iterator[tuple]:
+    """yield (folder, link) for each of the given folder paths, loading links the same way the matching get_*_folders() does"""
+
+    paths = list(paths)
+    if status in SNAPSHOT_STATUSES:
+        timestamps = [Path(path).name for path in paths]
+        for chunk in chunked(timestamps, 500):
+            for snapshot in snapshots.filter(timestamp__in=chunk).iterator(chunk_size=500):
+                link = snapshot.as_link_with_details() if status == 'valid' else snapshot.as_link()
+                yield link.link_dir, link
+        return
+
+    for path in paths:
+        try:
+            link = parse_json_link_details(path)
+        except Exception:
+            link = None
+        # get_present_folders() has always been keyed by folder name rather than path
+        yield (Path(path).name if status == 'present' else path), link
@@ -134,6 +134,9 @@ class Link:
     history: Dict[str, List[ArchiveResult]] = field(default_factory=lambda: {})
     downloaded_at: Optional[datetime] = None
     schema: str = 'Link'
+    # the summary of the outputs stored in the db (see core/manifest.py), set by Snapshot.as_link() when it's current,
+    # is_archived, archive_size and canonical_outputs() check the filesystem instead when it's None (not saved in index.json)
+    output_manifest: Optional[Dict[str, Any]] = field(default=None, compare=False, repr=False, metadata={'serialize': False})
 
     def __str__(self) -> str:
         return f'[{self.timestamp}] {self.url} "{self.title}"'
@@ -169,6 +172,7 @@ class Link:
             assert isinstance(self.sources, list)
             assert all(isinstance(source, str) and source for source in self.sources)
             assert isinstance(self.history, dict)
+            assert self.output_manifest is None or isinstance(self.output_manifest, dict)
             for method, results in self.history.items():
                 assert isinstance(method, str) and method
                 assert isinstance(results, list)
@@ -274,7 +278,7 @@ class Link:
 
     @classmethod
     def field_names(cls):
-        return [f.name for f in fields(cls)]
+        return [f.name for f in fields(cls) if f.metadata.get('serialize', True)]
 
     @property
     def link_dir(self) -> str:
@@ -286,6 +290,8 @@ class Link:
     
     @property
     def archive_size(self) -> float:
+        if self.output_manifest:
+            return self.output_manifest['size']
         try:
             return get_dir_size(self.archive_path)[0]
         except Exception:
@@ -382,6 +388,9 @@ class Link:
     def is_archived(self) -> bool:
         from archivebox.misc.util import domain
 
+        if self.output_manifest:
+            return self.output_manifest['is_archived']
+
         output_paths = (
             domain(self.url),
             'output.html',
@@ -423,17 +432,21 @@ class Link:
         return latest
 
 
-    def canonical_outputs(self) -> Dict[str, Optional[str]]:
-        """predict the expected output paths that should be present after archiving"""
+    def canonical_outputs(self, probe: bool=True) -> Dict[str, Optional[str]]:
+        """predict the expected output paths that should be present after archiving (probe=False skips looking for wget's output)"""
+
+        if self.output_manifest:
+            return dict(self.output_manifest['canonical'])
 
         from ..extractors.wget import wget_output_path
+        wget_path = wget_output_path(self) if probe else None
         # TODO: banish this awful duplication from the codebase and import these
         # from their respective extractor files
         canonical = {
             'index_path': 'index.html',
             'favicon_path': 'favicon.ico',
             'google_favicon_path': FAVICON_CONFIG.FAVICON_PROVIDER.format(self.domain),
-            'wget_path': wget_output_path(self),
+            'wget_path': wget_path,
             'warc_path': 'warc/',
             'singlefile_path': 'singlefile.html',
             'readability_path': 'readability/content.html',
@@ -452,7 +465,7 @@ class Link:
             # they're just downloaded once and aren't archived separately multiple times, 
             # so the wget, screenshot, & pdf urls should all point to the same file
 
-            static_path = wget_output_path(self)
+            static_path = wget_path
             canonical.update({
                 'title': self.basename,
                 'wget_path': static_path,
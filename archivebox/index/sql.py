@@ -4,15 +4,23 @@ import re
 
 from io import StringIO
 from pathlib import Path
-from typing import List, Tuple, Iterator
+from typing import List, Tuple, Iterator, Dict, Set
 from django.db.models import QuerySet
 from django.db import transaction
+from django.utils import timezone
 
-from archivebox.misc.util import enforce_types, parse_date
+from archivebox.misc.util import enforce_types, parse_date, chunked
 from archivebox.config import DATA_DIR, GENERAL_CONFIG
 
 from .schema import Link
 
+
+# number of links written per transaction by write_sql_main_index (keeps each url__in/timestamp__in under sqlite's 999 param limit)
+SQL_INDEX_CHUNK_SIZE = 500
+
+# how many following timestamps to check at once when a new snapshot's timestamp collides with an existing one
+TIMESTAMP_LOOKAHEAD = 32
+
 ### Main Links Index
 
 @enforce_types
@@ -93,11 +101,175 @@ def write_link_to_sql_index(link: Link, created_by_id: int | None=None):
 
 @enforce_types
 def write_sql_main_index(links: List[Link], out_dir: Path=DATA_DIR, created_by_id: int | None=None) -> None:
+    """write many links to the sql index in batches, equivalent to calling write_link_to_sql_index() on each one"""
+    from abid_utils.models import get_or_create_system_user_pk
+
+    created_by_id = created_by_id or get_or_create_system_user_pk()
+
+    # shared between chunks so timestamps allocated earlier in the import are never handed out twice
+    taken_timestamps: Set[str] = set()
+    checked_timestamps: Set[str] = set()
+
+    for chunk in chunked(links, SQL_INDEX_CHUNK_SIZE):
+        with transaction.atomic():
+            bulk_write_links_to_sql_index(chunk, created_by_id, taken_timestamps, checked_timestamps)
+
+
+def split_tags(tags_str: str | None) -> List[str]:
+    return [
+        tag for tag in dict.fromkeys(
+            tag.strip() for tag in re.split(GENERAL_CONFIG.TAG_SEPARATOR_PATTERN, tags_str or '')
+        )
+        if tag
+    ]
+
+
+def allocate_timestamp(timestamp: str, taken: Set[str], checked: Set[str]) -> str:
+    """
+    bump timestamp by +1s until it doesn't collide with any existing Snapshot (same rule as write_link_to_sql_index),
+    checking the db for the next few candidates at once instead of running one query per increment
+    """
+    from core.models import Snapshot
+
+    while True:
+        if timestamp not in checked:
+            lookahead = [timestamp, *(str(float(timestamp) + i) for i in range(1, TIMESTAMP_LOOKAHEAD))]
+            taken.update(Snapshot.objects.filter(timestamp__in=lookahead).values_list('timestamp', flat=True))
+            checked.update(lookahead)
+        if timestamp not in taken:
+            taken.add(timestamp)
+            return timestamp
+        timestamp = str(float(timestamp) + 1.0)
+
+
+def bulk_write_links_to_sql_index(links: List[Link], created_by_id: int, taken_timestamps: Set[str], checked_timestamps: Set[str]) -> None:
+    """write one chunk of links using a handful of set-based queries + bulk_create, should be called inside a transaction"""
+    from core.models import Snapshot, ArchiveResult, Tag, SnapshotTag
+
+    # bulk_create skips Model.save(), so new rows need their ABIDs issued manually
+    def new_row(Model, **fields):
+        obj = Model(**fields)
+        obj.abid = str(obj.issue_new_abid())
+        return obj
+
+    # 1. resolve which urls already have snapshots
+    urls = list(dict.fromkeys(link.url for link in links))
+    snapshots: Dict[str, Snapshot] = {
+        snapshot.url: snapshot
+        for snapshot in (
+            Snapshot.objects
+                .filter(url__in=urls)
+                .prefetch_related(None)
+                .only('id', 'url', 'timestamp', 'created_at', 'created_by_id')
+        )
+    }
+    existing_ids = {snapshot.pk for snapshot in snapshots.values()}
+    checked_timestamps.update(snapshot.timestamp for snapshot in snapshots.values())
+    taken_timestamps.update(snapshot.timestamp for snapshot in snapshots.values())
+
+    # 2. create any missing snapshots, allocating their unique timestamps in memory
+    candidates = [link.timestamp for link in links if link.url not in snapshots]
+    for timestamps in chunked(candidates, SQL_INDEX_CHUNK_SIZE):
+        unchecked = [ts for ts in timestamps if ts not in checked_timestamps]
+        taken_timestamps.update(Snapshot.objects.filter(timestamp__in=unchecked).values_list('timestamp', flat=True))
+        checked_timestamps.update(unchecked)
+
+    new_snapshots = []
+    for link in links:
+        if link.url in snapshots:
+            continue
+        info = {k: v for k, v in link._asdict().items() if k in Snapshot.keys}
+        info.pop('tags')
+        info['timestamp'] = allocate_timestamp(info['timestamp'], taken_timestamps, checked_timestamps)
+        snapshot = new_row(Snapshot, **info, created_by_id=created_by_id)
+        snapshot.bookmarked_at = snapshot.bookmarked_at or snapshot.created_at
+        snapshots[link.url] = snapshot
+        new_snapshots.append(snapshot)
+    Snapshot.objects.bulk_create(new_snapshots)
+
+    # 3. replace each snapshot's tags (later links win if a url appears more than once, same as save_tags())
+    tags_by_snapshot: Dict[str, List[str]] = {}
     for link in links:
-        # with transaction.atomic():
-            # write_link_to_sql_index(link)
-        write_link_to_sql_index(link, created_by_id=created_by_id)
-            
+        tags_by_snapshot[snapshots[link.url].pk] = split_tags(link.tags)
+
+    tag_names = list(dict.fromkeys(name for names in tags_by_snapshot.values() for name in names))
+    tag_ids: Dict[str, str] = {}
+    for names in chunked(tag_names, SQL_INDEX_CHUNK_SIZE):
+        tag_ids.update(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+
+    missing_tags = [name for name in tag_names if name not in tag_ids]
+    if missing_tags:
+        # same slug collision rule as Tag.save(): append _1, _2, ... until it's unique
+        slugs = set(Tag.objects.values_list('slug', flat=True))
+        new_tags = []
+        for name in missing_tags:
+            tag = Tag(name=name, created_by_id=created_by_id)
+            i = None
+            while tag.slugify(name, i) in slugs:
+                i = 1 if i is None else i + 1
+            tag.slug = tag.slugify(name, i)
+            tag.abid = str(tag.issue_new_abid())
+            slugs.add(tag.slug)
+            tag_ids[name] = tag.pk
+            new_tags.append(tag)
+        Tag.objects.bulk_create(new_tags)
+
+    for snapshot_ids in chunked(existing_ids, SQL_INDEX_CHUNK_SIZE):
+        SnapshotTag.objects.filter(snapshot_id__in=snapshot_ids).delete()
+    SnapshotTag.objects.bulk_create([
+        SnapshotTag(snapshot_id=snapshot_id, tag_id=tag_ids[name])
+        for snapshot_id, names in tags_by_snapshot.items()
+        for name in names
+    ])
+
+    # 4. write the archive results from each link's history
+    existing_results: Dict[tuple, str] = {}
+    for snapshot_ids in chunked(existing_ids, SQL_INDEX_CHUNK_SIZE):
+        existing_results.update(
+            ((snapshot_id, extractor, start_ts), result_id)
+            for snapshot_id, extractor, start_ts, result_id in (
+                ArchiveResult.objects
+                    .filter(snapshot_id__in=snapshot_ids)
+                    .values_list('snapshot_id', 'extractor', 'start_ts', 'id')
+            )
+        )
+
+    new_results: Dict[tuple, ArchiveResult] = {}
+    updated_results: Dict[tuple, ArchiveResult] = {}
+    for link in links:
+        snapshot = snapshots[link.url]
+        for extractor, entries in link.history.items():
+            for entry in entries:
+                # entries loaded from json are dicts (get_or_create), ArchiveResult objects are fresh results (update_or_create)
+                is_dict = isinstance(entry, dict)
+                info = entry if is_dict else vars(entry)
+                key = (snapshot.pk, extractor, parse_date(info['start_ts']))
+                fields = {
+                    'end_ts': parse_date(info['end_ts']),
+                    'cmd': info['cmd'],
+                    'output': info['output'],
+                    'cmd_version': info.get('cmd_version') or 'unknown',
+                    'pwd': info['pwd'],
+                    'status': info['status'],
+                    'created_by_id': snapshot.created_by_id,
+                }
+                if key in existing_results:
+                    if not is_dict:
+                        updated_results[key] = ArchiveResult(id=existing_results[key], modified_at=timezone.now(), **fields)
+                elif key in new_results:
+                    if not is_dict:
+                        for attr, value in fields.items():
+                            setattr(new_results[key], attr, value)
+                else:
+                    new_results[key] = new_row(ArchiveResult, snapshot=snapshot, extractor=extractor, start_ts=key[2], **fields)
+
+    ArchiveResult.objects.bulk_create(list(new_results.values()))
+    if updated_results:
+        ArchiveResult.objects.bulk_update(
+            list(updated_results.values()),
+            fields=['end_ts', 'cmd', 'output', 'cmd_version', 'pwd', 'status', 'created_by_id', 'modified_at'],
+        )
+
 
 @enforce_types
 def write_sql_link_details(link: Link, out_dir: Path=DATA_DIR, created_by_id: int | None=None) -> None:
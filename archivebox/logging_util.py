@@ -6,6 +6,7 @@ import sys
 import stat
 import time
 import argparse
+import threading
 
 from math import log
 from multiprocessing import Process
@@ -132,7 +133,8 @@ class TimedProgress:
 
     def __init__(self, seconds, prefix=''):
 
-        self.SHOW_PROGRESS = SHELL_CONFIG.SHOW_PROGRESS
+        # only the main thread draws progress bars, parallel archiving workers would draw over each other
+        self.SHOW_PROGRESS = SHELL_CONFIG.SHOW_PROGRESS and threading.current_thread() is threading.main_thread()
         self.ANSI = SHELL_CONFIG.ANSI
         
         if self.SHOW_PROGRESS:
@@ -326,6 +328,15 @@ def log_archiving_paused(num_links: int, idx: int, timestamp: str):
     print('    Continue archiving where you left off by running:')
     print('        archivebox update --resume={}'.format(timestamp))
 
+def log_archiving_throughput(num_finished: int, num_links: int, snapshots_per_min: float, num_running: int):
+    print('[bright_black]    [{now}] {finished}/{total} snapshots done, {running} in progress ({rate:.1f} snapshots/min)[/]'.format(
+        now=datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        finished=num_finished,
+        total=num_links or '?',
+        running=num_running,
+        rate=snapshots_per_min,
+    ))
+
 def log_archiving_finished(num_links: int):
 
     from core.models import Snapshot
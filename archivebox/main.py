@@ -28,16 +28,19 @@ from .parsers import (
     save_file_as_source,
     parse_links_memory,
 )
-from archivebox.misc.util import enforce_types                         # type: ignore
+from archivebox.misc.util import enforce_types, chunked                # type: ignore
 from archivebox.misc.system import get_dir_size, dedupe_cron_jobs, CRON_COMMENT
 from archivebox.misc.system import run as run_shell
 from .index.schema import Link
 from .index import (
     load_main_index,
     parse_links_from_source,
+    stream_links_from_source,
     dedupe_links,
     write_main_index,
+    IMPORT_BATCH_SIZE,
     snapshot_filter,
+    indexed_values,
     get_indexed_folders,
     get_archived_folders,
     get_unarchived_folders,
@@ -51,6 +54,7 @@ from .index import (
     fix_invalid_folder_locations,
     write_link_details,
 )
+from .index.scan import scan_archive_folders, classify_folders, load_folder_links, load_folder_details
 from .index.json import (
     parse_json_main_index,
     parse_json_links_details,
@@ -270,6 +274,7 @@ def init(force: bool=False, quick: bool=False, install: bool=False, out_dir: Pat
     """Initialize a new ArchiveBox collection in the current directory"""
     
     from core.models import Snapshot
+    from core.manifest import get_snapshots_without_manifest, update_output_manifests
 
     out_dir.mkdir(exist_ok=True)
     is_empty = not len(set(os.listdir(out_dir)) - CONSTANTS.ALLOWED_IN_DATA_DIR)
@@ -345,38 +350,61 @@ def init(force: bool=False, quick: bool=False, install: bool=False, out_dir: Pat
         print('    > Skipping full snapshot directory check (quick mode)')
     else:
         try:
+            # Scan every data folder using a pool of worker processes, progress is saved to the folder_status
+            # cache as it goes so an interrupted init only has to rescan the folders it hadn't reached yet
+            folders = scan_archive_folders(out_dir=out_dir)
+            print('    √ Scanned {} archive data directories.'.format(len(folders)))
+
             # Links in data folders that dont match their timestamp
-            fixed, cant_fix = fix_invalid_folder_locations(out_dir=out_dir)
+            fixed, cant_fix = fix_invalid_folder_locations(out_dir=out_dir, folders=[
+                str(ARCHIVE_DIR / folder.name)
+                for folder in folders.values()
+                    if folder.index_status == 'valid' and folder.timestamp != folder.name
+            ])
             if fixed:
                 print('    {lightyellow}√ Fixed {} data directory locations that didn\'t match their link timestamps.{reset}'.format(len(fixed), **SHELL_CONFIG.ANSI))
+                folders = scan_archive_folders(out_dir=out_dir)
             if cant_fix:
                 print('    {lightyellow}! Could not fix {} data directory locations due to conflicts with existing folders.{reset}'.format(len(cant_fix), **SHELL_CONFIG.ANSI))
 
             # Links in JSON index but not in main index
+            indexed_urls = indexed_values(all_links, 'url')
             orphaned_json_links = {
                 link.url: link
                 for link in parse_json_main_index(out_dir)
-                if not all_links.filter(url=link.url).exists()
+                if link.url not in indexed_urls
             }
             if orphaned_json_links:
                 pending_links.update(orphaned_json_links)
                 print('    {lightyellow}√ Added {} orphaned links from existing JSON index...{reset}'.format(len(orphaned_json_links), **SHELL_CONFIG.ANSI))
 
-            # Links in data dir indexes but not in main index
+            # Links in data dir indexes but not in main index (only the orphaned ones need to be fully loaded)
             orphaned_data_dir_links = {
                 link.url: link
-                for link in parse_json_links_details(out_dir)
-                if not all_links.filter(url=link.url).exists()
+                for link in load_folder_details([
+                    str(ARCHIVE_DIR / folder.name)
+                    for folder in folders.values()
+                        if folder.index_status == 'valid' and folder.url not in indexed_urls
+                ])
             }
             if orphaned_data_dir_links:
                 pending_links.update(orphaned_data_dir_links)
                 print('    {lightyellow}√ Added {} orphaned links from existing archive directories.{reset}'.format(len(orphaned_data_dir_links), **SHELL_CONFIG.ANSI))
 
+            # written in batches, each one committed as it goes, so links added before a Ctrl+C aren't orphans next time
+            for batch in chunked(pending_links.values(), IMPORT_BATCH_SIZE):
+                write_main_index(batch, out_dir=out_dir)
+
+            # Snapshots archived before output manifests existed (or with one from an older version)
+            without_manifest = get_snapshots_without_manifest(Snapshot.objects.all())
+            if without_manifest.exists():
+                print('    - Building output manifests for {} snapshots...'.format(without_manifest.count()))
+                updated = update_output_manifests(without_manifest.iterator(chunk_size=IMPORT_BATCH_SIZE))
+                print('    √ Stored the output manifests of {} snapshots.'.format(updated))
+
             # Links in invalid/duplicate data dirs
-            invalid_folders = {
-                folder: link
-                for folder, link in get_invalid_folders(all_links, out_dir=out_dir).items()
-            }
+            snapshots = Snapshot.objects.all()
+            invalid_folders = dict(load_folder_links(snapshots, 'invalid', classify_folders(snapshots, out_dir=out_dir)['invalid']))
             if invalid_folders:
                 print('    {lightyellow}! Skipped adding {} invalid link data directories.{reset}'.format(len(invalid_folders), **SHELL_CONFIG.ANSI))
                 print('        X ' + '\n        X '.join(f'./{Path(folder).relative_to(DATA_DIR)} {link}' for folder, link in invalid_folders.items()))
@@ -388,13 +416,12 @@ def init(force: bool=False, quick: bool=False, install: bool=False, out_dir: Pat
         except (KeyboardInterrupt, SystemExit):
             stderr()
             stderr('[x] Stopped checking archive directories due to Ctrl-C/SIGTERM', color='red')
-            stderr('    Your archive data is safe, but you should re-run `archivebox init` to finish the process later.')
+            stderr('    Your archive data is safe, and progress so far has been saved.')
+            stderr('    Re-run `archivebox init` to resume where it left off.')
             stderr()
             stderr('    {lightred}Hint:{reset} In the future you can run a quick init without checking dirs like so:'.format(**SHELL_CONFIG.ANSI))
             stderr('        archivebox init --quick')
             raise SystemExit(1)
-        
-        write_main_index(list(pending_links.values()), out_dir=out_dir)
 
     print('\n{green}----------------------------------------------------------------------{reset}'.format(**SHELL_CONFIG.ANSI))
 
@@ -460,24 +487,25 @@ def status(out_dir: Path=DATA_DIR) -> None:
     size = printable_filesize(num_bytes)
     print(f'    Size: {size} across {num_files} files in {num_dirs} directories')
     print(SHELL_CONFIG.ANSI['black'])
-    num_indexed = len(get_indexed_folders(links, out_dir=out_dir))
-    num_archived = len(get_archived_folders(links, out_dir=out_dir))
-    num_unarchived = len(get_unarchived_folders(links, out_dir=out_dir))
+    folders = classify_folders(links, out_dir=out_dir)
+    num_indexed = len(folders['indexed'])
+    num_archived = len(folders['archived'])
+    num_unarchived = len(folders['unarchived'])
     print(f'    > indexed: {num_indexed}'.ljust(36), f'({get_indexed_folders.__doc__})')
     print(f'      > archived: {num_archived}'.ljust(36), f'({get_archived_folders.__doc__})')
     print(f'      > unarchived: {num_unarchived}'.ljust(36), f'({get_unarchived_folders.__doc__})')
     
-    num_present = len(get_present_folders(links, out_dir=out_dir))
-    num_valid = len(get_valid_folders(links, out_dir=out_dir))
+    num_present = len(folders['present'])
+    num_valid = len(folders['valid'])
     print()
     print(f'    > present: {num_present}'.ljust(36), f'({get_present_folders.__doc__})')
     print(f'      > valid: {num_valid}'.ljust(36), f'({get_valid_folders.__doc__})')
     
-    duplicate = get_duplicate_folders(links, out_dir=out_dir)
-    orphaned = get_orphaned_folders(links, out_dir=out_dir)
-    corrupted = get_corrupted_folders(links, out_dir=out_dir)
-    unrecognized = get_unrecognized_folders(links, out_dir=out_dir)
-    num_invalid = len({**duplicate, **orphaned, **corrupted, **unrecognized})
+    duplicate = folders['duplicate']
+    orphaned = folders['orphaned']
+    corrupted = folders['corrupted']
+    unrecognized = folders['unrecognized']
+    num_invalid = len(folders['invalid'])
     print(f'      > invalid: {num_invalid}'.ljust(36), f'({get_invalid_folders.__doc__})')
     print(f'        > duplicate: {len(duplicate)}'.ljust(36), f'({get_duplicate_folders.__doc__})')
     print(f'        > orphaned: {len(orphaned)}'.ljust(36), f'({get_orphaned_folders.__doc__})')
@@ -498,6 +526,22 @@ def status(out_dir: Path=DATA_DIR) -> None:
         print('    {lightred}Hint:{reset} You may need to manually remove or fix some invalid data directories, afterwards make sure to run:'.format(**SHELL_CONFIG.ANSI))
         print('        archivebox init')
     
+    if SEARCH_BACKEND_CONFIG.USE_INDEXING_BACKEND:
+        from .search.indexing import get_indexing_lag, SEARCH_QUEUE_DB
+
+        print()
+        print('{green}[*] Scanning search indexing queue...{reset}'.format(**SHELL_CONFIG.ANSI))
+        print(SHELL_CONFIG.ANSI['lightyellow'], f'   {SEARCH_QUEUE_DB}', SHELL_CONFIG.ANSI['reset'])
+        lag = get_indexing_lag()
+        print(f'    > pending: {lag["pending"]}'.ljust(36), f'(waiting to be indexed by the {SEARCH_BACKEND_CONFIG.SEARCH_BACKEND_ENGINE} backend)')
+        print(f'    > failed: {lag["failed"]}'.ljust(36), f'(gave up after {SEARCH_BACKEND_CONFIG.SEARCH_INDEX_RETRIES} retries)')
+        print(f'    > lag: {lag["lag"]:.0f}s'.ljust(36), '(how long the oldest pending snapshot has been waiting)')
+        if lag['last_error']:
+            print(f'    Last error: {lag["last_error"]}'[:SHELL_CONFIG.TERM_WIDTH])
+        if lag['failed']:
+            print('    {lightred}Hint:{reset} To re-index the snapshots that failed, run:'.format(**SHELL_CONFIG.ANSI))
+            print('        archivebox update --index-only')
+
     print()
     print('{green}[*] Scanning recent archive changes and user logins:{reset}'.format(**SHELL_CONFIG.ANSI))
     print(SHELL_CONFIG.ANSI['lightyellow'], f'   {CONSTANTS.LOGS_DIR}/*', SHELL_CONFIG.ANSI['reset'])
@@ -561,6 +605,7 @@ def add(urls: Union[str, List[str]],
         init: bool=False,
         extractors: str="",
         parser: str="auto",
+        stream: bool=False,
         created_by_id: int | None=None,
         out_dir: Path=DATA_DIR) -> List[Link]:
     """Add a new URL or list of URLs to your archive"""
@@ -593,6 +638,45 @@ def add(urls: Union[str, List[str]],
         # save verbatim args to sources
         write_ahead_log = save_text_as_source('\n'.join(urls), filename='{ts}-import.txt', out_dir=out_dir)
     
+    if stream:
+        # parse, dedupe, index, and archive the input in fixed-size batches so memory use stays flat for huge imports
+        assert depth == 0, 'Streaming imports dont support crawling (depth must be 0)'
+        tags = [
+            Tag.objects.get_or_create(name=name.strip(), defaults={'created_by_id': created_by_id})[0]
+            for name in tag.split(',')
+            if name.strip()
+        ]
+        archive_kwargs = {
+            "out_dir": out_dir,
+            "created_by_id": created_by_id,
+            "methods": ['index_only'] if index_only else (extractors or None),
+        }
+        for imported_links in stream_links_from_source(write_ahead_log, root_url=None, parser=parser):
+            new_links = dedupe_links(all_links, imported_links)
+            write_main_index(links=new_links, out_dir=out_dir, created_by_id=created_by_id)
+
+            if tags:
+                for snapshot in Snapshot.objects.filter(url__in=[link.url for link in imported_links]):
+                    snapshot.tags.add(*tags)
+                    snapshot.tags_str(nocache=True)
+                    snapshot.save()
+
+            if index_only:
+                archive_links(imported_links if overwrite else new_links, overwrite=overwrite, **archive_kwargs)
+            elif update:
+                archive_links(imported_links, overwrite=overwrite, **archive_kwargs)
+            elif update_all:
+                pass  # the whole library gets archived once the import is finished
+            elif overwrite:
+                archive_links(imported_links, overwrite=True, **archive_kwargs)
+            elif new_links:
+                archive_links(new_links, overwrite=False, **archive_kwargs)
+
+        if update_all and not (index_only or update):
+            archive_links(load_main_index(out_dir=out_dir), overwrite=overwrite, **archive_kwargs)
+
+        # the imported links aren't held in memory during a streaming import, see the index for the results
+        return []
 
     new_links += parse_links_from_source(write_ahead_log, root_url=None, parser=parser)
 
@@ -751,6 +835,9 @@ def remove(filter_str: Optional[str]=None,
 def update(resume: Optional[float]=None,
            only_new: bool=ARCHIVING_CONFIG.ONLY_NEW,
            index_only: bool=False,
+           rebuild_index: bool=False,
+           check_index: bool=False,
+           repair_index: bool=False,
            overwrite: bool=False,
            filter_patterns_str: Optional[str]=None,
            filter_patterns: Optional[List[str]]=None,
@@ -762,7 +849,7 @@ def update(resume: Optional[float]=None,
            out_dir: Path=DATA_DIR) -> List[Link]:
     """Import any new links from subscriptions and retry any previously failed/skipped links"""
 
-    from core.models import ArchiveResult
+    from core.models import Snapshot, ArchiveResult
     from .search import index_links
     # from .queues.supervisor_util import start_cli_workers
     
@@ -782,6 +869,24 @@ def update(resume: Optional[float]=None,
         before=before,
         after=after,
     )
+    if check_index or repair_index:
+        from .search.check import check_search_index, repair_search_index
+
+        print(f'    - Comparing {matching_snapshots.count()} snapshots with the search index...')
+        check = check_search_index(matching_snapshots)
+        print(f'    √ Checked {check.checked} snapshots in {check.seconds:.2f}s ({check.checked / max(check.seconds, 0.001):.0f} snapshots/sec)')
+        print(f'    > missing: {len(check.missing)}'.ljust(36), '(have indexable outputs but are not in the search index)')
+        print(f'    > stale: {len(check.stale)}'.ljust(36), '(outputs modified since they were last indexed)')
+        print(f'    > orphaned: {len(check.orphaned)}'.ljust(36), '(in the search index but deleted or without indexable outputs)')
+        if check.unverified:
+            print(f'    > unverified: {check.unverified}'.ljust(36), '(indexed before index times were recorded, update --index-only records them)')
+        if repair_index:
+            repair_search_index(check)
+        elif check.missing or check.stale or check.orphaned:
+            print('    {lightred}Hint:{reset} To reindex only the snapshots that differ, run:'.format(**SHELL_CONFIG.ANSI))
+            print('        archivebox update --repair-index')
+        return []
+
     print(f'    - Checking {matching_snapshots.count()} snapshot folders for existing data with {status=}...')
     matching_folders = list_folders(
         links=matching_snapshots,
@@ -793,9 +898,13 @@ def update(resume: Optional[float]=None,
     all_links = sorted(all_links, key=lambda link: (ArchiveResult.objects.filter(snapshot__url=link.url).count(), link.timestamp))
 
     if index_only:
+        from core.manifest import update_output_manifests
+
         for link in all_links:
             write_link_details(link, out_dir=out_dir, skip_sql_index=True)
-        index_links(all_links, out_dir=out_dir)
+        index_links(all_links, out_dir=out_dir, rebuild=rebuild_index)
+        for batch in chunked((link.url for link in all_links), IMPORT_BATCH_SIZE):
+            update_output_manifests(Snapshot.objects.filter(url__in=batch))
         return all_links
         
     # Step 2: Run the archive methods for each link
@@ -912,24 +1021,17 @@ def list_folders(links: List[Link],
     
     check_data_folder()
 
-    STATUS_FUNCTIONS = {
-        "indexed": get_indexed_folders,
-        "archived": get_archived_folders,
-        "unarchived": get_unarchived_folders,
-        "present": get_present_folders,
-        "valid": get_valid_folders,
-        "invalid": get_invalid_folders,
-        "duplicate": get_duplicate_folders,
-        "orphaned": get_orphaned_folders,
-        "corrupted": get_corrupted_folders,
-        "unrecognized": get_unrecognized_folders,
-    }
+    if status == 'indexed':
+        # doesn't need to look at the data folders at all
+        return get_indexed_folders(links, out_dir=out_dir)
 
-    try:
-        return STATUS_FUNCTIONS[status](links, out_dir=out_dir)
-    except KeyError:
+    # classify every folder in one (cached) pass, then only load Links for the ones being listed
+    folders = classify_folders(links, out_dir=out_dir)
+    if status not in folders:
         raise ValueError('Status not recognized.')
 
+    return dict(load_folder_links(links, status, folders[status]))
+
 @enforce_types
 def install(out_dir: Path=DATA_DIR) -> None:
     """Automatically install all ArchiveBox dependencies and extras"""
@@ -0,0 +1,259 @@
+__package__ = 'archivebox.misc'
+
+"""
+Writes .br/.gz copies ("siblings") of a snapshot's compressible outputs (html, css, js, txt, json, svg...), so
+serve_static_with_byterange_support can send browsers that accept them the precompressed file instead of compressing
+it on every request. A sibling is only used while its mtime matches the original's, so outputs that are re-archived
+are served uncompressed until the next pass catches up.
+
+The siblings live under <snapshot>/.precompressed/ rather than right next to the outputs, so they can never clobber
+(or be mistaken for) .gz/.br files that were archived as-is, e.g. by wget.
+"""
+
+import os
+import gzip
+import time
+import shutil
+import mimetypes
+
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from archivebox.config import ARCHIVING_CONFIG
+from archivebox.misc.logging import stderr
+from archivebox.misc.system import get_dir_size
+
+
+PRECOMPRESSED_DIR_NAME = '.precompressed'
+
+# content coding -> sibling file extension, in order of preference when the client accepts several equally
+ENCODING_EXTENSIONS: Dict[str, str] = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+FORMAT_ENCODINGS = {'br': 'br', 'gz': 'gzip'}
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/ld+json',
+    'application/manifest+json',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'application/x-javascript',
+    'image/svg+xml',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+}
+
+# siblings that don't save at least this much of the original's size aren't worth the disk space
+MIN_COMPRESSION_RATIO = 0.9
+
+BROTLI_QUALITY = 11
+GZIP_LEVEL = 9
+CHUNK_SIZE = 1024 * 1024
+
+
+class PrecompressStats(NamedTuple):
+    files: int                  # outputs that have up-to-date siblings after the pass
+    original_bytes: int         # size of those outputs
+    compressed_bytes: int       # space taken by all their siblings, i.e. the disk cost of precompressing the snapshot
+    written: int                # siblings (re)written by this pass
+    removed: int                # stale or orphaned siblings deleted by this pass
+    seconds: float
+
+
+def is_compressible(path: Path) -> bool:
+    mimetype, encoding = mimetypes.guess_type(str(path))
+    if encoding or not mimetype:
+        # already compressed (.gz, .br, .bz2...) or unknown
+        return False
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def get_sibling(snapshot_dir: Path, relpath: str, encoding: str) -> Path:
+    return Path(snapshot_dir) / PRECOMPRESSED_DIR_NAME / (relpath + ENCODING_EXTENSIONS[encoding])
+
+
+def get_enabled_encodings() -> List[str]:
+    encodings = [FORMAT_ENCODINGS[fmt] for fmt in ARCHIVING_CONFIG.PRECOMPRESS_FORMATS if fmt in FORMAT_ENCODINGS]
+    if 'br' in encodings and brotli is None:
+        encodings.remove('br')
+    return encodings
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """{content coding: qvalue} from an Accept-Encoding header, '*' stands for any coding not listed"""
+    accepted = {}
+    for item in (header or '').split(','):
+        coding, *params = item.strip().split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        qvalue = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        accepted[coding] = qvalue
+    return accepted
+
+
+def get_precompressed_variant(document_root: Path, relpath: str, statobj: os.stat_result, accept_encoding: Optional[str]) -> Optional[Tuple[Path, os.stat_result, str]]:
+    """
+    (sibling path, its stat, its content coding) of the best up-to-date sibling of the file at relpath in
+    document_root that the client accepts, or None to send the original
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    candidates = sorted(
+        (encoding for encoding in ENCODING_EXTENSIONS if accepted.get(encoding, accepted.get('*', 0)) > 0),
+        key=lambda encoding: -accepted.get(encoding, accepted.get('*', 0)),
+    )
+    for encoding in candidates:
+        sibling = get_sibling(document_root, relpath, encoding)
+        try:
+            sibling_stat = sibling.stat()
+        except OSError:
+            continue
+        if sibling_stat.st_mtime_ns == statobj.st_mtime_ns:
+            return sibling, sibling_stat, encoding
+    return None
+
+
+def compress_file(path: Path, sibling: Path, encoding: str, statobj: os.stat_result) -> bool:
+    """
+    write the compressed copy of path to a temp file first, so the sibling is never seen half-written. statobj is the
+    original's stat from before it was read: if the original changed while it was being compressed, the copy is
+    discarded and False returned, as it'd otherwise get the new mtime with the old contents.
+    """
+    sibling.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = sibling.with_name(f'.{sibling.name}.tmp')
+    try:
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            if encoding == 'gzip':
+                with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz, CHUNK_SIZE)
+            else:
+                compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    dst.write(compressor.process(chunk))
+                dst.write(compressor.finish())
+        current_stat = path.stat()
+        if (current_stat.st_mtime_ns, current_stat.st_size) != (statobj.st_mtime_ns, statobj.st_size):
+            return False
+        os.utime(tmp_path, ns=(statobj.st_atime_ns, statobj.st_mtime_ns))
+        os.replace(tmp_path, sibling)
+        return True
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def iter_outputs(snapshot_dir: Path) -> Iterable[Tuple[Path, str]]:
+    """(path, path relative to the snapshot dir) of every file in it, except the siblings"""
+    for root, dirs, files in os.walk(snapshot_dir):
+        if Path(root) == Path(snapshot_dir):
+            dirs[:] = [name for name in dirs if name != PRECOMPRESSED_DIR_NAME]
+        for name in files:
+            path = Path(root) / name
+            if not path.is_symlink():
+                yield path, path.relative_to(snapshot_dir).as_posix()
+
+
+def remove_other_siblings(snapshot_dir: Path, keep: Set[Path]) -> int:
+    """delete the siblings that aren't in keep (their original is gone, too small, doesn't compress well...)"""
+    removed = 0
+    for root, dirs, files in os.walk(Path(snapshot_dir) / PRECOMPRESSED_DIR_NAME, topdown=False):
+        for name in files:
+            path = Path(root) / name
+            if path not in keep:
+                path.unlink(missing_ok=True)
+                removed += 1
+        try:
+            os.rmdir(root)
+        except OSError:
+            # not empty
+            pass
+    return removed
+
+
+def precompress_snapshot(snapshot_dir: Path) -> PrecompressStats:
+    """
+    bring the siblings of all of a snapshot's compressible outputs up to date: write the missing and stale ones,
+    and remove the ones whose original is gone, too small, or turned out not to compress well
+    """
+    start = time.monotonic()
+    snapshot_dir = Path(snapshot_dir)
+    encodings = get_enabled_encodings()
+    keep: Set[Path] = set()
+    files, original_bytes, compressed_bytes, written = 0, 0, 0, 0
+
+    for path, relpath in iter_outputs(snapshot_dir):
+        if not is_compressible(path):
+            continue
+        statobj = path.stat()
+        if statobj.st_size < ARCHIVING_CONFIG.PRECOMPRESS_MIN_SIZE:
+            continue
+
+        sibling_sizes = []
+        for encoding in encodings:
+            sibling = get_sibling(snapshot_dir, relpath, encoding)
+            try:
+                sibling_stat = sibling.stat()
+                up_to_date = sibling_stat.st_mtime_ns == statobj.st_mtime_ns
+            except FileNotFoundError:
+                up_to_date = False
+            if not up_to_date:
+                try:
+                    if not compress_file(path, sibling, encoding, statobj):
+                        # changed while we were compressing it, the next pass will catch up
+                        continue
+                except OSError as err:
+                    stderr(f'[!] Failed to precompress {path}: {err}', color='lightyellow')
+                    continue
+                written += 1
+                sibling_stat = sibling.stat()
+            if sibling_stat.st_size > statobj.st_size * MIN_COMPRESSION_RATIO:
+                # e.g. html that's mostly inlined base64 images, sending it compressed isn't worth the disk space
+                continue
+            keep.add(sibling)
+            sibling_sizes.append(sibling_stat.st_size)
+
+        if sibling_sizes:
+            files += 1
+            original_bytes += statobj.st_size
+            compressed_bytes += sum(sibling_sizes)
+
+    return PrecompressStats(
+        files=files,
+        original_bytes=original_bytes,
+        compressed_bytes=compressed_bytes,
+        written=written,
+        removed=remove_other_siblings(snapshot_dir, keep),
+        seconds=time.monotonic() - start,
+    )
+
+
+def get_precompressed_size(snapshot_dir: Path) -> int:
+    """bytes of disk used by the .br/.gz siblings of a snapshot's outputs"""
+    return get_dir_size(Path(snapshot_dir) / PRECOMPRESSED_DIR_NAME)[0]
+
+
+def queue_precompress(snapshot_dir: Path) -> None:
+    """precompress a snapshot's outputs in the background on the precompress queue, if PRECOMPRESS_OUTPUTS is enabled"""
+    if not ARCHIVING_CONFIG.PRECOMPRESS_OUTPUTS:
+        return
+    try:
+        from queues.tasks import bg_precompress_snapshot
+        bg_precompress_snapshot(str(snapshot_dir))
+    except Exception as err:
+        stderr(f'[!] Failed to schedule precompressing {snapshot_dir}: {err}', color='lightyellow')
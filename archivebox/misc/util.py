@@ -5,7 +5,7 @@ import requests
 import json as pyjson
 import http.cookiejar
 
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Iterable, Iterator, TypeVar
 from pathlib import Path
 from inspect import signature
 from functools import wraps
@@ -317,6 +317,20 @@ def dedupe(options: List[str]) -> List[str]:
     return list(deduped.values())
 
 
+T = TypeVar('T')
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split any iterable into lists of at most size items (e.g. to stay under sqlite's max query params)"""
+    chunk: List[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 
 class ExtendedEncoder(pyjson.JSONEncoder):
     """
@@ -7,9 +7,11 @@ For examples of supported import formats see tests/.
 
 __package__ = 'archivebox.parsers'
 
+import shutil
+
 from io import StringIO
 
-from typing import IO, Tuple, List, Optional
+from typing import IO, Tuple, List, Optional, Iterator
 from datetime import datetime, timezone
 from pathlib import Path 
 
@@ -41,6 +43,8 @@ from . import generic_html
 from . import generic_txt
 from . import url_list
 
+from .sniff import SNIFF_PREFIX_CHARS, sniff_parser_candidates
+
 
 PARSERS = {
     # Specialized parsers
@@ -102,6 +106,34 @@ def parse_links(source_file: str, root_url: Optional[str]=None, parser: str="aut
     return links, parser
 
 
+@enforce_types
+def parse_links_streaming(source_file: str, root_url: Optional[str]=None, parser: str="auto") -> Tuple[Iterator[Link], str]:
+    """like parse_links(), but picks a single parser up front and yields Links lazily as the file is read,
+       so huge imports dont have to be held in memory or parsed once per parser
+    """
+
+    if parser == "auto":
+        with open(source_file, 'r', encoding='utf-8') as file:
+            parser = sniff_parser(file)
+
+    parser_name, parser_func = PARSERS[parser]
+
+    def iter_links() -> Iterator[Link]:
+        with open(source_file, 'r', encoding='utf-8') as file:
+            yield from parser_func(file, root_url=root_url)
+
+    return iter_links(), parser_name
+
+
+def sniff_parser(to_parse: IO[str]) -> str:
+    """pick the single most likely parser for an input based on its first few KB"""
+
+    to_parse.seek(0)
+    prefix = to_parse.read(SNIFF_PREFIX_CHARS)
+    to_parse.seek(0)
+    return sniff_parser_candidates(prefix)[0]
+
+
 def run_parser_functions(to_parse: IO[str], timer, root_url: Optional[str]=None, parser: str="auto") -> Tuple[List[Link], Optional[str]]:
     most_links: List[Link] = []
     best_parser_name = None
@@ -117,7 +149,26 @@ def run_parser_functions(to_parse: IO[str], timer, root_url: Optional[str]=None,
         timer.end()
         return parsed_links, parser_name
 
+    # try the few parsers that look likely to work based on the start of the input, in order of confidence
+    to_parse.seek(0)
+    candidates = sniff_parser_candidates(to_parse.read(SNIFF_PREFIX_CHARS))
+    for parser_id in candidates:
+        parser_name, parser_func = PARSERS[parser_id]
+        try:
+            parsed_links = list(parser_func(to_parse, root_url=root_url))
+        except Exception as err:                                                # noqa
+            # To debug why a certain parser was not used due to python error or format incompatibility, uncomment this line:
+            # print('[!] Parser {} failed: {} {}'.format(parser_name, err.__class__.__name__, err))
+            continue
+
+        if parsed_links:
+            timer.end()
+            return parsed_links, parser_name
+
+    # none of them worked, fall back to trying every other parser and keeping the one that finds the most links
     for parser_id in PARSERS:
+        if parser_id in candidates:
+            continue
         parser_name, parser_func = PARSERS[parser_id]
         try:
             parsed_links = list(parser_func(to_parse, root_url=root_url))
@@ -146,16 +197,18 @@ def save_text_as_source(raw_text: str, filename: str='{ts}-stdin.txt', out_dir:
     ts = str(datetime.now(timezone.utc).timestamp()).split('.', 1)[0]
     source_path = str(CONSTANTS.SOURCES_DIR / filename.format(ts=ts))
 
-    referenced_texts = ''
+    atomic_write(source_path, raw_text + '\n')
 
-    for entry in raw_text.split():
-        try:
-            if Path(entry).exists():
-                referenced_texts += Path(entry).read_text()
-        except Exception as err:
-            print(err)
+    # append any referenced files in chunks instead of reading them into memory (they can be multi-GB exports)
+    with open(source_path, 'a') as source:
+        for entry in raw_text.split():
+            try:
+                if Path(entry).exists():
+                    with open(entry, 'r') as referenced:
+                        shutil.copyfileobj(referenced, source)
+            except Exception as err:
+                print(err)
 
-    atomic_write(source_path, raw_text + '\n' + referenced_texts)
     log_source_saved(source_file=source_path)
     return source_path
 
@@ -21,9 +21,8 @@ def parse_generic_jsonl_export(json_file: IO[str], **_kwargs) -> Iterable[Link]:
 
     json_file.seek(0)
 
-    links = [ parse_line(line) for line in json_file ]
-
-    for link in links:
+    for line in json_file:
+        link = parse_line(line)
         if link:
             yield jsonObjectToLink(link,json_file.name)
 
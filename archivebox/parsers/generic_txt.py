@@ -18,7 +18,7 @@ def parse_generic_txt_export(text_file: IO[str], **_kwargs) -> Iterable[Link]:
     """Parse links from a text file, ignoring other text"""
 
     text_file.seek(0)
-    for line in text_file.readlines():
+    for line in text_file:
         if not line.strip():
             continue
 
@@ -0,0 +1,82 @@
+"""
+Guess the format of an import file from cheap signals in its first few KB,
+instead of running every parser over the whole input and keeping the one with the most links.
+"""
+
+__package__ = 'archivebox.parsers'
+
+import re
+import json
+
+from typing import List
+
+
+# how much of the start of an import file to look at when guessing its format
+SNIFF_PREFIX_CHARS = 64 * 1024
+
+API_PREFIXES = {
+    'pocket://': 'pocket_api',
+    'readwise-reader://': 'readwise_reader_api',
+}
+
+NETSCAPE_RE = re.compile(r'<!DOCTYPE NETSCAPE-Bookmark-file|<DT><A HREF="[^"]+" ADD_DATE="', re.IGNORECASE)
+POCKET_HTML_RE = re.compile(r'<li><a href="[^"]+" time_added="\d+"', re.IGNORECASE)
+XML_ROOT_RE = re.compile(r'<(rss|feed|rdf:RDF)[\s>]', re.IGNORECASE)
+HTML_RE = re.compile(r'<!DOCTYPE html|<html[\s>]|<body[\s>]|<a\s[^>]*href=', re.IGNORECASE)
+
+
+def sniff_parser_candidates(prefix: str) -> List[str]:
+    """
+    Get the keys of the parsers likely to be able to read an input, best guess first, given its first few KB.
+    Confidently detected formats get one specific parser followed by generic fallbacks,
+    anything ambiguous gets a small set of generic parsers.
+    """
+
+    text = prefix.lstrip('\ufeff').lstrip()
+
+    # `archivebox add path/to/file` saves the path on the first line followed by the file contents
+    lines = text.split('\n', 1)
+    if len(lines) == 2 and not lines[0].lstrip().startswith(('<', '[', '{')) and lines[1].lstrip().startswith(('<', '[', '{')):
+        text = lines[1].lstrip()
+
+    # pocket://username, readwise-reader://username
+    for api_prefix, parser_key in API_PREFIXES.items():
+        if re.search(rf'^\s*{re.escape(api_prefix)}', prefix, re.MULTILINE):
+            return [parser_key]
+
+    # [{...}, {...}] or {...}\n{...}
+    if text.startswith('['):
+        return ['json', 'jsonl', 'txt']
+    if text.startswith('{'):
+        first_line = text.split('\n', 1)[0].strip()
+        try:
+            json.loads(first_line)
+            return ['jsonl', 'json', 'txt']
+        except json.JSONDecodeError:
+            return ['json', 'jsonl', 'txt']
+
+    # <?xml ...?><rss>, <feed>, <rdf:RDF>
+    xml_root = XML_ROOT_RE.search(text[:4096]) if text.startswith('<') else None
+    if xml_root:
+        lowered = text.lower()
+        if xml_root.group(1).lower() == 'feed':
+            if 'wallabag' in lowered:
+                return ['wallabag_atom', 'rss', 'txt']
+            if 'shaarli' in lowered:
+                return ['shaarli_rss', 'rss', 'txt']
+            return ['rss', 'txt']
+        if 'pinboard.in' in lowered:
+            return ['pinboard_rss', 'rss', 'txt']
+        if 'medium.com' in lowered:
+            return ['medium_rss', 'rss', 'txt']
+        return ['rss', 'txt']
+
+    if NETSCAPE_RE.search(text):
+        return ['netscape_html', 'html', 'txt']
+    if POCKET_HTML_RE.search(text):
+        return ['pocket_html', 'html', 'txt']
+    if HTML_RE.search(text):
+        return ['html', 'txt']
+
+    # plain text with urls somewhere in it
+    return ['txt']
@@ -112,6 +112,12 @@ class ChromeConfig(BaseConfigSet):
     CHROME_USER_DATA_DIR: Path | None       = Field(default=None)
     CHROME_PROFILE_NAME: str                = Field(default='Default')
 
+    # Persistent Browser Pool (shared by screenshot, pdf, dom, and singlefile instead of launching chrome per extractor)
+    CHROME_POOL_ENABLED: bool               = Field(default=False)
+    CHROME_POOL_SIZE: int                   = Field(default=1)
+    CHROME_POOL_MAX_PAGES: int              = Field(default=50)      # restart each browser after it has loaded this many pages
+    CHROME_POOL_MAX_MEMORY_MB: int          = Field(default=2048)    # restart a browser once chrome + its child procs use more than this
+
     # Extractor Toggles
     SAVE_SCREENSHOT: bool                   = Field(default=True, alias='FETCH_SCREENSHOT')
     SAVE_DOM: bool                          = Field(default=True, alias='FETCH_DOM')
@@ -0,0 +1,336 @@
+__package__ = 'archivebox.plugins_extractor.chrome'
+
+import json
+import time
+import base64
+import shutil
+import atexit
+import tempfile
+import threading
+import subprocess
+
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+import psutil
+
+WEBSOCKETS_LIB = None
+try:
+    from websockets.sync import client as websockets_client
+    WEBSOCKETS_LIB = websockets_client
+except ImportError:
+    WEBSOCKETS_LIB = None
+
+from .apps import CHROME_CONFIG, CHROME_BINARY
+
+
+# outputs produced from a single page load, named after the extractors that consume them
+CAPTURE_OUTPUTS = ('screenshot', 'pdf', 'dom')
+
+# these only make sense for one-shot `chrome --screenshot/--print-to-pdf/--dump-dom` runs, not a long-lived browser
+ONESHOT_ONLY_ARGS = ('--virtual-time-budget', '--timeout')
+
+
+class ChromeError(Exception):
+    pass
+
+
+class CDPConnection:
+    """Minimal blocking Chrome DevTools Protocol client for a single browser or page websocket"""
+
+    def __init__(self, ws_url: str, timeout: float=10):
+        self.ws = WEBSOCKETS_LIB.connect(ws_url, open_timeout=timeout, max_size=None, compression=None)
+        self.last_id = 0
+        self.events: List[dict] = []
+
+    def close(self) -> None:
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def _recv(self, deadline: float) -> dict:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('Timed out waiting for response from Chrome')
+        return json.loads(self.ws.recv(timeout=remaining))
+
+    def send(self, method: str, timeout: float=10, **params) -> Dict[str, Any]:
+        self.last_id += 1
+        msg_id = self.last_id
+        self.ws.send(json.dumps({'id': msg_id, 'method': method, 'params': params}))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            msg = self._recv(deadline)
+            if msg.get('id') == msg_id:
+                if 'error' in msg:
+                    raise ChromeError(f'{method} failed: {msg["error"].get("message")}')
+                return msg.get('result') or {}
+            if 'method' in msg:
+                self.events.append(msg)
+
+    def wait_for_event(self, method: str, timeout: float=10) -> Dict[str, Any]:
+        deadline = time.monotonic() + timeout
+        while True:
+            for idx, event in enumerate(self.events):
+                if event['method'] == method:
+                    del self.events[idx]
+                    return event.get('params') or {}
+            msg = self._recv(deadline)
+            if 'method' in msg:
+                self.events.append(msg)
+
+
+class ChromeBrowser:
+    """One long-lived headless chrome process, controlled over CDP, that loads each page in a new tab"""
+
+    def __init__(self):
+        chrome_bin = CHROME_BINARY.load()
+        assert chrome_bin.abspath and chrome_bin.version
+
+        self.abspath = str(chrome_bin.abspath)
+        self.version = str(chrome_bin.version)
+        self.num_pages = 0
+
+        # chrome refuses to share a profile between processes, so each browser gets its own unless the user set one
+        self.tmp_profile_dir = None
+        user_data_dir = CHROME_CONFIG.CHROME_USER_DATA_DIR
+        if not user_data_dir:
+            self.tmp_profile_dir = tempfile.mkdtemp(prefix='archivebox_chrome_')
+            user_data_dir = Path(self.tmp_profile_dir)
+        self.user_data_dir = Path(user_data_dir)
+
+        self.args = [
+            arg for arg in CHROME_CONFIG.chrome_args(CHROME_TIMEOUT=0)
+            if not arg.startswith(ONESHOT_ONLY_ARGS)
+        ]
+        if self.tmp_profile_dir:
+            self.args.append(f'--user-data-dir={self.user_data_dir}')
+
+        port_file = self.user_data_dir / 'DevToolsActivePort'
+        port_file.unlink(missing_ok=True)
+
+        self.process = subprocess.Popen(
+            [self.abspath, *self.args, '--remote-debugging-port=0', 'about:blank'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+        # chrome writes the port it picked + the browser websocket path to DevToolsActivePort once it's ready
+        deadline = time.monotonic() + 30
+        while not (port_file.exists() and len(port_file.read_text().split()) >= 2):
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.close()
+                raise ChromeError('Chrome exited or timed out before starting its remote debugging server')
+            time.sleep(0.1)
+
+        port, ws_path = port_file.read_text().split()[:2]
+        self.host = f'127.0.0.1:{port}'
+        self.http_url = f'http://{self.host}'
+        self.cdp = CDPConnection(f'ws://{self.host}{ws_path}')
+
+    @property
+    def memory_mb(self) -> float:
+        """total RSS of the chrome process and all its renderer/gpu/utility children"""
+        try:
+            proc = psutil.Process(self.process.pid)
+            procs = [proc, *proc.children(recursive=True)]
+            return sum(p.memory_info().rss for p in procs) / (1024 * 1024)
+        except psutil.Error:
+            return 0.0
+
+    def is_healthy(self) -> bool:
+        if self.process.poll() is not None:
+            return False
+        try:
+            self.cdp.send('Browser.getVersion', timeout=5)
+        except Exception:
+            return False
+        return True
+
+    def needs_recycling(self) -> bool:
+        return (
+            self.num_pages >= CHROME_CONFIG.CHROME_POOL_MAX_PAGES
+            or self.memory_mb > CHROME_CONFIG.CHROME_POOL_MAX_MEMORY_MB
+        )
+
+    @contextmanager
+    def new_tab(self, timeout: float) -> Iterator[CDPConnection]:
+        target_id = self.cdp.send('Target.createTarget', url='about:blank')['targetId']
+        self.num_pages += 1
+        page = None
+        try:
+            page = CDPConnection(f'ws://{self.host}/devtools/page/{target_id}', timeout=timeout)
+            yield page
+        finally:
+            if page:
+                page.close()
+            try:
+                self.cdp.send('Target.closeTarget', targetId=target_id)
+            except Exception:
+                pass
+
+    def capture(self, url: str, outputs: List[str], timeout: float) -> Dict[str, bytes | str]:
+        """load the url once in a new tab and produce each of the requested outputs from that single page load"""
+        results: Dict[str, bytes | str] = {}
+        width, height = CHROME_CONFIG.CHROME_RESOLUTION.split(',')
+
+        with self.new_tab(timeout=timeout) as page:
+            page.send('Page.enable', timeout=timeout)
+            page.send('Emulation.setDeviceMetricsOverride', width=int(width), height=int(height), deviceScaleFactor=1, mobile=False)
+            page.send('Page.navigate', url=url, timeout=timeout)
+            page.wait_for_event('Page.loadEventFired', timeout=timeout)
+
+            if 'dom' in outputs:
+                res = page.send('Runtime.evaluate', expression='document.documentElement.outerHTML', returnByValue=True, timeout=timeout)
+                results['dom'] = res['result'].get('value') or ''
+            if 'screenshot' in outputs:
+                res = page.send('Page.captureScreenshot', format='png', timeout=timeout)
+                results['screenshot'] = base64.b64decode(res['data'])
+            if 'pdf' in outputs:
+                res = page.send('Page.printToPDF', printBackground=True, timeout=timeout)
+                results['pdf'] = base64.b64decode(res['data'])
+
+        return results
+
+    def close(self) -> None:
+        if getattr(self, 'cdp', None):
+            self.cdp.close()
+        try:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+        if self.tmp_profile_dir:
+            shutil.rmtree(self.tmp_profile_dir, ignore_errors=True)
+        CHROME_BINARY.chrome_cleanup_lockfile()
+
+
+class ChromePool:
+    """
+    Pool of long-lived ChromeBrowsers shared by the screenshot, pdf, dom, and singlefile extractors.
+
+    Browsers are started lazily (up to CHROME_POOL_SIZE), health-checked before each use, and recycled
+    after CHROME_POOL_MAX_PAGES page loads or once they use more than CHROME_POOL_MAX_MEMORY_MB.
+
+    Screenshot, PDF, and DOM are all produced from one page load: whichever of those extractors runs first
+    loads the page and captures all three, the others pick up their output from a small in-memory cache.
+    archive_link discards a snapshot's leftover captures before and after each run, so a later run
+    (e.g. with --overwrite) always loads the page again instead of getting an old capture back.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.idle: List[ChromeBrowser] = []
+        self.num_browsers = 0
+
+        # keyed by (out_dir, url)
+        self.captures: OrderedDict[Tuple[str, str], Dict[str, bytes | str]] = OrderedDict()
+        self.capture_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+        atexit.register(self.close)
+
+    @property
+    def size(self) -> int:
+        if CHROME_CONFIG.CHROME_USER_DATA_DIR:
+            # all the browsers would have to share the same profile dir, which chrome doesn't allow
+            return 1
+        return max(CHROME_CONFIG.CHROME_POOL_SIZE, 1)
+
+    @property
+    def is_available(self) -> bool:
+        return CHROME_CONFIG.USE_CHROME and CHROME_CONFIG.CHROME_POOL_ENABLED and WEBSOCKETS_LIB is not None
+
+    @contextmanager
+    def browser(self) -> Iterator[ChromeBrowser]:
+        """check out a healthy browser from the pool for the duration of one job"""
+        with self.available:
+            while not self.idle and self.num_browsers >= self.size:
+                self.available.wait()
+            browser = self.idle.pop() if self.idle else None
+            if browser is None:
+                self.num_browsers += 1
+
+        try:
+            if browser is not None and not browser.is_healthy():
+                browser.close()
+                browser = None
+            browser = browser or ChromeBrowser()
+        except BaseException:
+            with self.available:
+                self.num_browsers -= 1
+                self.available.notify()
+            raise
+
+        try:
+            yield browser
+        finally:
+            if not browser.is_healthy() or browser.needs_recycling():
+                browser.close()
+                with self.available:
+                    self.num_browsers -= 1
+                    self.available.notify()
+            else:
+                with self.available:
+                    self.idle.append(browser)
+                    self.available.notify()
+
+    def get_output(self, output: str, url: str, out_dir: Path, timeout: float) -> bytes | str:
+        """get one of the CAPTURE_OUTPUTS for a url, loading the page and capturing all of them on the first call"""
+        assert output in CAPTURE_OUTPUTS, f'{output} must be one of {CAPTURE_OUTPUTS}'
+        key = (str(out_dir), url)
+
+        with self.lock:
+            capture_lock = self.capture_locks.setdefault(key, threading.Lock())
+
+        # if the pdf/dom extractors run at the same time as screenshot, let them wait for its page load
+        with capture_lock:
+            with self.lock:
+                cached = self.captures.get(key)
+                if cached and output in cached:
+                    result = cached.pop(output)
+                    if not cached:
+                        self.captures.pop(key, None)
+                        self.capture_locks.pop(key, None)
+                    return result
+
+            wanted = [
+                name for name in CAPTURE_OUTPUTS
+                if name == output or getattr(CHROME_CONFIG, f'SAVE_{name.upper()}')
+            ]
+            with self.browser() as browser:
+                results = browser.capture(url, wanted, timeout=timeout)
+
+            result = results.pop(output)
+            with self.lock:
+                if results:
+                    self.captures[key] = results
+                    # dont hold onto outputs forever if their extractors never end up running
+                    while len(self.captures) > self.size * 4:
+                        evicted_key, _ = self.captures.popitem(last=False)
+                        self.capture_locks.pop(evicted_key, None)
+                else:
+                    self.capture_locks.pop(key, None)
+            return result
+
+    def discard_captures(self, out_dir: Path) -> None:
+        """forget the captures made for out_dir that no extractor picked up (yet)"""
+        with self.lock:
+            for key in [key for key in self.captures if key[0] == str(out_dir)]:
+                self.captures.pop(key, None)
+                self.capture_locks.pop(key, None)
+
+    def close(self) -> None:
+        with self.available:
+            while self.idle:
+                self.idle.pop().close()
+                self.num_browsers -= 1
+            self.captures.clear()
+
+
+CHROME_POOL = ChromePool()
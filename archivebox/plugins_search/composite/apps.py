@@ -0,0 +1,155 @@
+__package__ = 'archivebox.plugins_search.composite'
+
+from functools import cache
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Iterable
+
+# Depends on other PyPI/vendor packages:
+from pydantic import InstanceOf, Field
+
+# Depends on other Django apps:
+from abx.archivebox.base_plugin import BasePlugin
+from abx.archivebox.base_configset import BaseConfigSet
+from abx.archivebox.base_hook import BaseHook
+from abx.archivebox.base_searchbackend import BaseSearchBackend, SearchHit
+
+# Depends on Other Plugins:
+from archivebox.config import SEARCH_BACKEND_CONFIG
+from archivebox.misc.util import chunked
+from archivebox.misc.logging import stderr
+
+from .fanout import FanOut, FanOutResult, merge_ranked
+
+###################### Config ##########################
+
+class CompositeConfig(BaseConfigSet):
+    SEARCH_COMPOSITE_BACKENDS: List[str]        = Field(default=['sqlite', 'ripgrep'])  # backends to query together when SEARCH_BACKEND_ENGINE=composite, in order of preference
+    SEARCH_COMPOSITE_TIMEOUT: float             = Field(default=2.0)    # seconds to wait for each backend before returning the results of the others without it
+    SEARCH_COMPOSITE_TIMEOUTS: Dict[str, float] = Field(default={})     # per-backend overrides of SEARCH_COMPOSITE_TIMEOUT, e.g. {"ripgrep": 5}
+    SEARCH_COMPOSITE_WORKERS: int               = Field(default=8)      # threads shared by all the concurrent backend queries
+
+COMPOSITE_CONFIG = CompositeConfig()
+
+
+FAN_OUT = FanOut(max_workers=COMPOSITE_CONFIG.SEARCH_COMPOSITE_WORKERS)
+
+
+@cache
+def get_member_backends() -> Dict[str, BaseSearchBackend]:
+    import abx.archivebox.use
+
+    available = {backend.name: backend for backend in abx.archivebox.use.get_SEARCHBACKENDS().values()}
+    members = {}
+    for name in COMPOSITE_CONFIG.SEARCH_COMPOSITE_BACKENDS:
+        if name == 'composite' or name not in available:
+            stderr(f'[!] SEARCH_COMPOSITE_BACKENDS: ignoring unknown search backend {name}', color='lightyellow')
+            continue
+        members[name] = available[name]
+    return members
+
+
+def call_in_thread(func: Callable[[], Any]) -> Callable[[], Any]:
+    def wrapped():
+        from django.db import connections
+        try:
+            return func()
+        finally:
+            # backends that query the main db open a new connection in each thread, close it again
+            connections.close_all()
+    return wrapped
+
+
+def query_members(method: Callable[[BaseSearchBackend], Any]) -> FanOutResult:
+    """call method(backend) on every member backend at once, waiting at most each one's timeout for it"""
+    from archivebox.search.cache import dont_cache_result
+
+    members = get_member_backends()
+    timeouts = {
+        name: COMPOSITE_CONFIG.SEARCH_COMPOSITE_TIMEOUTS.get(name, COMPOSITE_CONFIG.SEARCH_COMPOSITE_TIMEOUT)
+        for name in members
+    }
+    fanout = FAN_OUT.call({name: call_in_thread(lambda backend=backend: method(backend)) for name, backend in members.items()}, timeouts)
+
+    if fanout.timed_out:
+        stderr(f'[!] Search backends took too long, returning partial results without: {", ".join(fanout.timed_out)}', color='lightyellow')
+    for name, err in fanout.errors.items():
+        stderr(f'[!] Search backend {name} threw an exception, returning partial results without it: {err}', color='lightyellow')
+    if members and not fanout.results and fanout.errors:
+        # every backend failed, there's nothing partial to return
+        raise next(iter(fanout.errors.values()))
+    if fanout.partial:
+        # ask again next time instead of serving the incomplete results from the cache
+        dont_cache_result()
+    return fanout
+
+
+class CompositeSearchBackend(BaseSearchBackend):
+    name: str = 'composite'
+    docs_url: str = 'https://github.com/ArchiveBox/ArchiveBox/wiki/Configuration#search_backend_engine'
+
+    @staticmethod
+    def index(snapshot_id: str, texts: List[str]):
+        for backend in get_member_backends().values():
+            backend.index(snapshot_id=snapshot_id, texts=texts)
+
+    def index_many(self, items: Iterable[Tuple[str, List[str]]]):
+        # every member needs to see every item, so hand them the same batch one after the other
+        members = get_member_backends().values()
+        for chunk in chunked(items, SEARCH_BACKEND_CONFIG.SEARCH_INDEX_BATCH_SIZE):
+            for backend in members:
+                backend.index_many(chunk)
+
+    @staticmethod
+    def flush(snapshot_ids: Iterable[str]):
+        snapshot_ids = list(snapshot_ids)
+        for backend in get_member_backends().values():
+            backend.flush(snapshot_ids)
+
+    @staticmethod
+    def optimize():
+        for backend in get_member_backends().values():
+            backend.optimize()
+
+    @staticmethod
+    def search(text: str) -> List[str]:
+        fanout = query_members(lambda backend: [str(snapshot_id) for snapshot_id in backend.search(text)])
+        return merge_ranked(list(fanout.results.values()))
+
+    def search_ranked(self, text: str, limit: int, offset: int=0) -> List[SearchHit]:
+        # each backend's top offset+limit is enough to rank the merged top offset+limit
+        fanout = query_members(lambda backend: backend.search_ranked(text, limit=offset + limit, offset=0))
+        hits = merge_ranked(list(fanout.results.values()), key=lambda hit: hit.snapshot_id)[offset:offset + limit]
+
+        snippets: Dict[str, str] = {}
+        for backend_hits in fanout.results.values():
+            for hit in backend_hits:
+                if hit.snippet:
+                    snippets.setdefault(hit.snapshot_id, hit.snippet)
+        return [hit._replace(snippet=hit.snippet or snippets.get(hit.snapshot_id)) for hit in hits]
+
+    def count(self, text: str) -> int:
+        return len(self.search(text))
+
+    def list_ids(self) -> Optional[Set[str]]:
+        # a snapshot only counts as indexed if it's in every member that can tell
+        member_ids = [ids for ids in (backend.list_ids() for backend in get_member_backends().values()) if ids is not None]
+        return set.intersection(*member_ids) if member_ids else None
+
+COMPOSITE_SEARCH_BACKEND = CompositeSearchBackend()
+
+
+
+
+class CompositeSearchPlugin(BasePlugin):
+    app_label: str ='composite'
+    verbose_name: str = 'Composite Search'
+
+    hooks: List[InstanceOf[BaseHook]] = [
+        COMPOSITE_CONFIG,
+        COMPOSITE_SEARCH_BACKEND,
+    ]
+
+
+
+PLUGIN = CompositeSearchPlugin()
+# PLUGIN.register(settings)
+DJANGO_APP = PLUGIN.AppConfig
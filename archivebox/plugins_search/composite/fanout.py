@@ -0,0 +1,77 @@
+__package__ = 'archivebox.plugins_search.composite'
+
+"""
+Runs the same call against several search backends at once and merges what they return, without waiting
+longer than each backend's timeout, so one slow or broken backend only costs its share of the results.
+"""
+
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+# how much the rank of a hit counts in reciprocal rank fusion, higher values flatten the difference between ranks
+RRF_K = 60
+
+
+class FanOutResult(NamedTuple):
+    results: Dict[str, Any]             # backend name -> what it returned, for the ones that finished in time
+    timed_out: List[str]                # backends that were still running when their timeout ran out
+    errors: Dict[str, BaseException]    # backends that raised an exception
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.timed_out or self.errors)
+
+
+class FanOut:
+    """
+    A shared pool of threads to call several backends concurrently. A backend that misses its timeout
+    keeps running in the background (python threads can't be killed), but nothing waits for it.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='search_fanout')
+            return self.executor
+
+    def call(self, calls: Dict[str, Callable[[], Any]], timeouts: Dict[str, float]) -> FanOutResult:
+        executor = self.get_executor()
+        start = time.monotonic()
+        futures: Dict[str, Future] = {name: executor.submit(func) for name, func in calls.items()}
+
+        results, timed_out, errors = {}, [], {}
+        for name, future in futures.items():
+            remaining = start + timeouts[name] - time.monotonic()
+            try:
+                results[name] = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                future.cancel()
+                timed_out.append(name)
+            except Exception as err:
+                errors[name] = err
+        return FanOutResult(results=results, timed_out=timed_out, errors=errors)
+
+
+def merge_ranked(rankings: Sequence[Sequence[Any]], key: Callable[[Any], str]=lambda hit: hit) -> List[Any]:
+    """
+    merge several best-first lists of hits into one with reciprocal rank fusion: a hit's score is the sum
+    of 1 / (RRF_K + rank) over every list it appears in, so hits that several backends agree on rise to the
+    top, and ties keep the order of the lists they came from. The first copy of each hit is kept.
+    """
+    scores: Dict[str, float] = {}
+    first_seen: Dict[str, Any] = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits):
+            hit_key = key(hit)
+            scores[hit_key] = scores.get(hit_key, 0.0) + 1 / (RRF_K + rank + 1)
+            first_seen.setdefault(hit_key, hit)
+    order = {hit_key: position for position, hit_key in enumerate(first_seen)}
+    return [first_seen[hit_key] for hit_key in sorted(first_seen, key=lambda hit_key: (-scores[hit_key], order[hit_key]))]
@@ -0,0 +1,107 @@
+__package__ = 'archivebox.plugins_search.invindex'
+
+import threading
+from pathlib import Path
+from typing import List, Set, Tuple, Iterable, Optional
+
+# Depends on other PyPI/vendor packages:
+from pydantic import InstanceOf, Field
+
+# Depends on other Django apps:
+from abx.archivebox.base_plugin import BasePlugin
+from abx.archivebox.base_configset import BaseConfigSet
+from abx.archivebox.base_hook import BaseHook
+from abx.archivebox.base_searchbackend import BaseSearchBackend, SearchHit
+
+# Depends on Other Plugins:
+from archivebox.config import CONSTANTS
+from archivebox.misc.util import chunked
+
+from .index import InvertedIndex
+
+
+###################### Config ##########################
+
+class InvindexConfig(BaseConfigSet):
+    INVINDEX_DIR: Path                  = Field(default=CONSTANTS.DATA_DIR / 'search_index')
+    INVINDEX_MAX_TEXT_LENGTH: int       = Field(default=10_000_000)    # chars of text indexed per snapshot, the rest is ignored
+    INVINDEX_BATCH_SIZE: int            = Field(default=500)           # snapshots written per segment by index_many
+    INVINDEX_MAX_SEGMENTS: int          = Field(default=10)            # merge segments together once there are more than this many
+    INVINDEX_MERGE_FACTOR: int          = Field(default=4)             # number of segments merged together at a time
+    INVINDEX_MAX_PREFIX_TERMS: int      = Field(default=1000)          # max distinct words a prefix* query expands to
+
+INVINDEX_CONFIG = InvindexConfig()
+
+
+_INDEX: Optional[InvertedIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+def _get_index() -> InvertedIndex:
+    # Keep one index open per process so segments stay mmap'ed between searches
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None or _INDEX.index_dir != Path(INVINDEX_CONFIG.INVINDEX_DIR):
+            _INDEX = InvertedIndex(
+                INVINDEX_CONFIG.INVINDEX_DIR,
+                max_segments=INVINDEX_CONFIG.INVINDEX_MAX_SEGMENTS,
+                merge_factor=INVINDEX_CONFIG.INVINDEX_MERGE_FACTOR,
+                max_prefix_terms=INVINDEX_CONFIG.INVINDEX_MAX_PREFIX_TERMS,
+            )
+        return _INDEX
+
+
+class InvindexSearchBackend(BaseSearchBackend):
+    name: str = 'invindex'
+    docs_url: str = 'https://github.com/ArchiveBox/ArchiveBox/wiki/Configuration#search_backend_engine'
+
+    @staticmethod
+    def index(snapshot_id: str, texts: List[str]):
+        INVINDEX_SEARCH_BACKEND.index_many([(snapshot_id, texts)])
+
+    def index_many(self, items: Iterable[Tuple[str, List[str]]]):
+        max_length = INVINDEX_CONFIG.INVINDEX_MAX_TEXT_LENGTH
+        for chunk in chunked(items, INVINDEX_CONFIG.INVINDEX_BATCH_SIZE):
+            _get_index().index_many(
+                (str(snapshot_id), ' '.join(texts)[:max_length])
+                for snapshot_id, texts in chunk
+            )
+
+    @staticmethod
+    def flush(snapshot_ids: Iterable[str]):
+        _get_index().flush(snapshot_ids)
+
+    @staticmethod
+    def search(text: str) -> List[str]:
+        return _get_index().search(text)
+
+    def search_ranked(self, text: str, limit: int, offset: int=0) -> List[SearchHit]:
+        return [SearchHit(snapshot_id=snapshot_id) for snapshot_id in _get_index().search(text, limit=limit, offset=offset)]
+
+    def count(self, text: str) -> int:
+        return _get_index().count(text)
+
+    def list_ids(self) -> Set[str]:
+        return _get_index().snapshot_ids()
+
+    @staticmethod
+    def optimize():
+        _get_index().optimize()
+
+INVINDEX_SEARCH_BACKEND = InvindexSearchBackend()
+
+
+
+class InvindexSearchPlugin(BasePlugin):
+    app_label: str ='invindex'
+    verbose_name: str = 'Embedded Inverted Index'
+
+    hooks: List[InstanceOf[BaseHook]] = [
+        INVINDEX_CONFIG,
+        INVINDEX_SEARCH_BACKEND,
+    ]
+
+
+
+PLUGIN = InvindexSearchPlugin()
+# PLUGIN.register(settings)
+DJANGO_APP = PLUGIN.AppConfig
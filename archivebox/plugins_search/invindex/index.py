@@ -0,0 +1,547 @@
+__package__ = 'archivebox.plugins_search.invindex'
+
+"""
+A small embedded full-text inverted index, stored as immutable on-disk segments.
+
+    <index_dir>/
+        manifest.json         list of live segments, atomically replaced whenever segments are added or merged
+        write.lock            held while writing so only one process adds/merges segments at a time
+        000001.terms          sorted term dictionary (mmap'ed and binary searched, never loaded into memory)
+        000001.post           posting lists: varint delta-encoded docnums, term frequencies and positions
+        000001.docs           snapshot_id and length of each document in the segment
+        000001.del            docnums deleted since the segment was written (replaced or flushed snapshots)
+
+Every index_many() call writes one new segment, and once there are more than max_segments the smallest
+ones are merged together (dropping deleted documents), so writes stay cheap and the segment count stays bounded.
+
+Queries are ANDed terms, "quoted phrases", and prefix* terms, ranked by bm25.
+"""
+
+import os
+import re
+import json
+import mmap
+import heapq
+import fcntl
+import struct
+import threading
+import unicodedata
+
+from math import log
+from pathlib import Path
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+
+TERMS_MAGIC = b'ABXT'
+FORMAT_VERSION = 1
+
+TERMS_HEADER = struct.Struct('<4sIII')       # magic, version, num_terms, num_docs
+TERM_OFFSET = struct.Struct('<Q')            # offset of each term's entry, relative to the start of the entries
+TERM_LENGTH = struct.Struct('<H')            # length of the utf-8 term that starts each entry
+TERM_INFO = struct.Struct('<IQI')            # doc_freq, postings offset, postings length, after the term
+
+MAX_TERM_LENGTH = 64                         # longer tokens are almost always base64/hashes/minified junk
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r'\w+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def normalize(text: str) -> str:
+    """lowercase and strip accents, so é matches e"""
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(normalize(text)) if len(token) <= MAX_TERM_LENGTH]
+
+
+### Varint encoding for posting lists
+
+def encode_varints(numbers: Iterable[int], out: bytearray) -> None:
+    for number in numbers:
+        while number >= 0x80:
+            out.append((number & 0x7F) | 0x80)
+            number >>= 7
+        out.append(number)
+
+def decode_varints(data) -> Iterator[int]:
+    number, shift = 0, 0
+    for byte in data:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield number
+            number, shift = 0, 0
+
+def encode_postings(postings: Iterable[Tuple[int, List[int]]]) -> bytes:
+    """[(docnum, [positions...]), ...] sorted by docnum -> docnum delta, tf, position deltas..."""
+    out = bytearray()
+    last_docnum = 0
+    for docnum, positions in postings:
+        encode_varints((docnum - last_docnum, len(positions)), out)
+        last_position = 0
+        for position in positions:
+            encode_varints((position - last_position,), out)
+            last_position = position
+        last_docnum = docnum
+    return bytes(out)
+
+def decode_postings(data) -> Iterator[Tuple[int, List[int]]]:
+    numbers = decode_varints(data)
+    docnum = 0
+    for docnum_delta in numbers:
+        docnum += docnum_delta
+        positions, position = [], 0
+        for _ in range(next(numbers)):
+            position += next(numbers)
+            positions.append(position)
+        yield docnum, positions
+
+
+### Segments
+
+class Segment:
+    """one immutable, memory-mapped segment of the index"""
+
+    def __init__(self, index_dir: Path, name: str):
+        self.name = name
+        self.path = index_dir / name
+
+        with open(f'{self.path}.docs', 'r', encoding='utf-8') as f:
+            docs = json.load(f)
+        self.snapshot_ids: List[str] = docs['snapshot_ids']
+        self.lengths: List[int] = docs['lengths']
+        self.docnums: Dict[str, int] = {snapshot_id: docnum for docnum, snapshot_id in enumerate(self.snapshot_ids)}
+
+        self.deleted: Set[int] = set()
+        self.deleted_mtime: Optional[float] = None
+        self.reload_deleted()
+
+        self._terms_file = open(f'{self.path}.terms', 'rb')
+        self._post_file = open(f'{self.path}.post', 'rb')
+        self.terms = mmap.mmap(self._terms_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.postings_data = mmap.mmap(self._post_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f'{self.path}.post') else b''
+
+        magic, version, self.num_terms, num_docs = TERMS_HEADER.unpack_from(self.terms, 0)
+        assert magic == TERMS_MAGIC and version == FORMAT_VERSION, f'Unrecognized search index segment format: {self.path}.terms'
+        assert num_docs == len(self.snapshot_ids), f'Search index segment {self.name} is corrupted'
+        self.entries_start = TERMS_HEADER.size + self.num_terms * TERM_OFFSET.size
+
+    def close(self) -> None:
+        for handle in (self.terms, self.postings_data, self._terms_file, self._post_file):
+            if hasattr(handle, 'close'):
+                handle.close()
+
+    @property
+    def num_live_docs(self) -> int:
+        return len(self.snapshot_ids) - len(self.deleted)
+
+    def reload_deleted(self) -> None:
+        try:
+            mtime = os.path.getmtime(f'{self.path}.del')
+        except FileNotFoundError:
+            self.deleted, self.deleted_mtime = set(), None
+            return
+        if mtime != self.deleted_mtime:
+            with open(f'{self.path}.del', 'r', encoding='utf-8') as f:
+                self.deleted = set(json.load(f))
+            self.deleted_mtime = mtime
+
+    def save_deleted(self) -> None:
+        atomic_write_json(Path(f'{self.path}.del'), sorted(self.deleted))
+        self.deleted_mtime = os.path.getmtime(f'{self.path}.del')
+
+    def _entry(self, idx: int) -> Tuple[str, int, int, int]:
+        offset = self.entries_start + TERM_OFFSET.unpack_from(self.terms, TERMS_HEADER.size + idx * TERM_OFFSET.size)[0]
+        (term_length,) = TERM_LENGTH.unpack_from(self.terms, offset)
+        term_start = offset + TERM_LENGTH.size
+        term = self.terms[term_start:term_start + term_length].decode('utf-8')
+        doc_freq, post_offset, post_length = TERM_INFO.unpack_from(self.terms, term_start + term_length)
+        return term, doc_freq, post_offset, post_length
+
+    def _lower_bound(self, term: str) -> int:
+        """index of the first term >= the given term"""
+        low, high = 0, self.num_terms
+        while low < high:
+            mid = (low + high) // 2
+            if self._entry(mid)[0] < term:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def lookup(self, term: str) -> Optional[Tuple[int, int, int]]:
+        """(doc_freq, postings offset, postings length) for a term, or None if it's not in this segment"""
+        idx = self._lower_bound(term)
+        if idx < self.num_terms:
+            found, doc_freq, post_offset, post_length = self._entry(idx)
+            if found == term:
+                return doc_freq, post_offset, post_length
+        return None
+
+    def doc_freq(self, term: str) -> int:
+        entry = self.lookup(term)
+        return entry[0] if entry else 0
+
+    def postings(self, term: str) -> Dict[int, List[int]]:
+        """{docnum: positions} for every live document containing the term"""
+        entry = self.lookup(term)
+        if not entry:
+            return {}
+        _doc_freq, post_offset, post_length = entry
+        return {
+            docnum: positions
+            for docnum, positions in decode_postings(self.postings_data[post_offset:post_offset + post_length])
+                if docnum not in self.deleted
+        }
+
+    def terms_with_prefix(self, prefix: str, limit: int) -> List[str]:
+        terms = []
+        for idx in range(self._lower_bound(prefix), self.num_terms):
+            term = self._entry(idx)[0]
+            if not term.startswith(prefix) or len(terms) >= limit:
+                break
+            terms.append(term)
+        return terms
+
+    def iter_terms(self, tag: int=0) -> Iterator[Tuple[str, int, bytes]]:
+        """every (term, tag, encoded postings) in the segment in sorted order, tagged so merged streams can tell segments apart"""
+        for idx in range(self.num_terms):
+            term, _doc_freq, post_offset, post_length = self._entry(idx)
+            yield term, tag, self.postings_data[post_offset:post_offset + post_length]
+
+
+def write_segment(index_dir: Path, name: str, snapshot_ids: List[str], lengths: List[int], terms: Iterable[Tuple[str, int, bytes]]) -> None:
+    """write a new segment from (term, doc_freq, encoded postings) tuples in sorted term order"""
+
+    offsets, entries = [], bytearray()
+    with open(index_dir / f'{name}.post.tmp', 'wb') as post_file:
+        post_offset = 0
+        for term, doc_freq, postings in terms:
+            term_bytes = term.encode('utf-8')
+            offsets.append(len(entries))
+            entries += TERM_LENGTH.pack(len(term_bytes)) + term_bytes + TERM_INFO.pack(doc_freq, post_offset, len(postings))
+            post_file.write(postings)
+            post_offset += len(postings)
+
+    with open(index_dir / f'{name}.terms.tmp', 'wb') as terms_file:
+        terms_file.write(TERMS_HEADER.pack(TERMS_MAGIC, FORMAT_VERSION, len(offsets), len(snapshot_ids)))
+        terms_file.write(b''.join(TERM_OFFSET.pack(offset) for offset in offsets))
+        terms_file.write(entries)
+
+    atomic_write_json(index_dir / f'{name}.docs', {'snapshot_ids': snapshot_ids, 'lengths': lengths})
+    os.replace(index_dir / f'{name}.post.tmp', index_dir / f'{name}.post')
+    os.replace(index_dir / f'{name}.terms.tmp', index_dir / f'{name}.terms')
+
+
+def atomic_write_json(path: Path, data) -> None:
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+### Index
+
+class InvertedIndex:
+    """
+    An on-disk index made of immutable segments, safe to read from many processes/threads at once.
+    Writes (index_many, flush, merge) take an exclusive lock on the index dir.
+    """
+
+    def __init__(self, index_dir: Path, max_segments: int=10, merge_factor: int=4, max_prefix_terms: int=1000):
+        self.index_dir = Path(index_dir)
+        self.max_segments = max(max_segments, 1)
+        self.merge_factor = max(merge_factor, 2)
+        self.max_prefix_terms = max_prefix_terms
+
+        self._segments: Dict[str, Segment] = {}
+        self._manifest_mtime: Optional[float] = None
+        self._manifest: dict = {'segments': [], 'next_segment': 1}
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+
+    ## Reading
+
+    def _load_manifest(self) -> dict:
+        manifest_path = self.index_dir / 'manifest.json'
+        try:
+            mtime = manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self._manifest
+        if mtime != self._manifest_mtime:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def segments(self) -> List[Segment]:
+        """the current live segments, (re)opening any that changed since the last call"""
+        with self._lock:
+            names = self._load_manifest()['segments']
+            for name in set(self._segments) - set(names):
+                self._segments.pop(name).close()
+            for name in names:
+                if name not in self._segments:
+                    self._segments[name] = Segment(self.index_dir, name)
+                else:
+                    self._segments[name].reload_deleted()
+            return [self._segments[name] for name in names]
+
+    def count(self, query: str) -> int:
+        return len(self._match(query))
+
+    def snapshot_ids(self) -> Set[str]:
+        """every snapshot currently in the index"""
+        return {
+            snapshot_id
+            for segment in self.segments()
+            for docnum, snapshot_id in enumerate(segment.snapshot_ids)
+            if docnum not in segment.deleted
+        }
+
+    def search(self, query: str, limit: Optional[int]=None, offset: int=0) -> List[str]:
+        """snapshot_ids matching the query, best match first"""
+        scores = self._match(query)
+        ranked = sorted(scores, key=lambda snapshot_id: -scores[snapshot_id])
+        return ranked[offset:] if limit is None else ranked[offset:offset + limit]
+
+    def _match(self, query: str) -> Dict[str, float]:
+        """{snapshot_id: bm25 score} for every document matching all the clauses in the query"""
+        clauses = parse_query(query)
+        if not clauses:
+            return {}
+
+        segments = self.segments()
+        num_docs = sum(segment.num_live_docs for segment in segments) or 1
+        avg_length = (sum(sum(segment.lengths) for segment in segments) / max(sum(len(segment.lengths) for segment in segments), 1)) or 1
+
+        doc_freqs: Dict[str, int] = {}
+        def idf(term: str) -> float:
+            if term not in doc_freqs:
+                doc_freqs[term] = sum(segment.doc_freq(term) for segment in segments)
+            return log(1 + (num_docs - doc_freqs[term] + 0.5) / (doc_freqs[term] + 0.5))
+
+        results: Dict[str, float] = {}
+        for segment in segments:
+            def bm25(term_idf: float, tf: int, docnum: int) -> float:
+                norm = 1 - BM25_B + BM25_B * segment.lengths[docnum] / avg_length
+                return term_idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+            matched: Optional[Dict[int, float]] = None
+            for kind, tokens in clauses:
+                clause_scores: Dict[int, float] = defaultdict(float)
+                if kind == 'term':
+                    term_idf = idf(tokens[0])
+                    for docnum, positions in segment.postings(tokens[0]).items():
+                        clause_scores[docnum] += bm25(term_idf, len(positions), docnum)
+                elif kind == 'prefix':
+                    for term in segment.terms_with_prefix(tokens[0], self.max_prefix_terms):
+                        term_idf = idf(term)
+                        for docnum, positions in segment.postings(term).items():
+                            clause_scores[docnum] += bm25(term_idf, len(positions), docnum)
+                elif kind == 'phrase':
+                    phrase_idf = sum(idf(token) for token in tokens)
+                    for docnum, tf in phrase_matches(segment, tokens).items():
+                        clause_scores[docnum] += bm25(phrase_idf, tf, docnum)
+
+                if matched is None:
+                    matched = dict(clause_scores)
+                else:
+                    matched = {docnum: score + clause_scores[docnum] for docnum, score in matched.items() if docnum in clause_scores}
+                if not matched:
+                    break
+
+            for docnum, score in (matched or {}).items():
+                results[segment.snapshot_ids[docnum]] = score
+        return results
+
+    ## Writing
+
+    @contextmanager
+    def write_lock(self) -> Iterator[None]:
+        with self._lock:
+            if self._lock_depth:
+                # already held by this thread (e.g. index_many -> maybe_merge -> merge), flock isn't re-entrant across fds
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.index_dir / 'write.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_manifest(self, manifest: dict) -> None:
+        atomic_write_json(self.index_dir / 'manifest.json', manifest)
+
+    def _delete(self, segments: List[Segment], snapshot_ids: Set[str]) -> None:
+        for segment in segments:
+            docnums = {segment.docnums[snapshot_id] for snapshot_id in snapshot_ids if snapshot_id in segment.docnums}
+            if docnums - segment.deleted:
+                segment.deleted |= docnums
+                segment.save_deleted()
+
+    def index_many(self, docs: Iterable[Tuple[str, str]]) -> None:
+        """add or replace the text of many snapshots at once, as a single new segment"""
+        docs = {str(snapshot_id): text for snapshot_id, text in docs}
+        if not docs:
+            return
+
+        postings: Dict[str, List[Tuple[int, List[int]]]] = defaultdict(list)
+        snapshot_ids, lengths = [], []
+        for docnum, (snapshot_id, text) in enumerate(docs.items()):
+            tokens = tokenize(text)
+            positions: Dict[str, List[int]] = defaultdict(list)
+            for position, token in enumerate(tokens):
+                positions[token].append(position)
+            for token, token_positions in positions.items():
+                postings[token].append((docnum, token_positions))
+            snapshot_ids.append(snapshot_id)
+            lengths.append(len(tokens))
+
+        with self.write_lock():
+            manifest = dict(self._load_manifest())
+            self._delete(self.segments(), set(snapshot_ids))
+
+            name = f'{manifest["next_segment"]:06d}'
+            write_segment(self.index_dir, name, snapshot_ids, lengths, (
+                (term, len(postings[term]), encode_postings(postings[term]))
+                for term in sorted(postings)
+            ))
+            self._save_manifest({'segments': [*manifest['segments'], name], 'next_segment': manifest['next_segment'] + 1})
+            self.maybe_merge()
+
+    def flush(self, snapshot_ids: Iterable[str]) -> None:
+        """remove snapshots from the index (their space is reclaimed the next time their segment is merged)"""
+        with self.write_lock():
+            self._delete(self.segments(), {str(snapshot_id) for snapshot_id in snapshot_ids})
+
+    def maybe_merge(self) -> None:
+        """merge the smallest segments together until there are no more than max_segments"""
+        with self.write_lock():
+            segments = self.segments()
+            while len(segments) > self.max_segments:
+                smallest = sorted(segments, key=lambda segment: segment.num_live_docs)[:self.merge_factor]
+                self.merge(smallest)
+                segments = self.segments()
+
+    def optimize(self) -> None:
+        """merge every segment into one, dropping all deleted documents"""
+        with self.write_lock():
+            segments = self.segments()
+            if len(segments) > 1 or any(segment.deleted for segment in segments):
+                self.merge(segments)
+
+    def merge(self, to_merge: List[Segment]) -> None:
+        """replace the given segments with a single new one containing only their live documents"""
+        with self.write_lock():
+            manifest = dict(self._load_manifest())
+
+            # renumber the live docs in each segment, in order, so docnums stay sorted in the merged postings
+            remaps: List[Dict[int, int]] = []
+            snapshot_ids, lengths = [], []
+            for segment in to_merge:
+                remap = {}
+                for docnum, snapshot_id in enumerate(segment.snapshot_ids):
+                    if docnum not in segment.deleted:
+                        remap[docnum] = len(snapshot_ids)
+                        snapshot_ids.append(snapshot_id)
+                        lengths.append(segment.lengths[docnum])
+                remaps.append(remap)
+
+            def merged_terms() -> Iterator[Tuple[str, int, bytes]]:
+                streams = [segment.iter_terms(tag=idx) for idx, segment in enumerate(to_merge)]
+                current_term, current_postings = None, []
+                for term, idx, postings in heapq.merge(*streams):
+                    if term != current_term:
+                        if current_postings:
+                            yield current_term, len(current_postings), encode_postings(current_postings)
+                        current_term, current_postings = term, []
+                    current_postings.extend(
+                        (remaps[idx][docnum], positions)
+                        for docnum, positions in decode_postings(postings)
+                            if docnum in remaps[idx]
+                    )
+                if current_postings:
+                    yield current_term, len(current_postings), encode_postings(current_postings)
+
+            name = f'{manifest["next_segment"]:06d}'
+            write_segment(self.index_dir, name, snapshot_ids, lengths, merged_terms())
+
+            merged_names = {segment.name for segment in to_merge}
+            remaining = [existing for existing in manifest['segments'] if existing not in merged_names]
+            self._save_manifest({'segments': [*remaining, name], 'next_segment': manifest['next_segment'] + 1})
+
+            # readers that already have the old segments mmap'ed can keep using them until they reload
+            for old_name in merged_names:
+                for ext in ('terms', 'post', 'docs', 'del'):
+                    try:
+                        os.remove(self.index_dir / f'{old_name}.{ext}')
+                    except FileNotFoundError:
+                        pass
+
+
+### Queries
+
+def parse_query(query: str) -> List[Tuple[str, List[str]]]:
+    """
+    split a query into clauses that must all match:
+        foo             ('term', ['foo'])
+        foo*            ('prefix', ['foo'])
+        "foo bar"       ('phrase', ['foo', 'bar'])
+        foo-bar         ('phrase', ['foo', 'bar'])  (like FTS5, punctuation between words makes a phrase)
+    """
+    clauses = []
+    for quoted, word in QUERY_RE.findall(query):
+        is_prefix = not quoted and word.endswith('*')
+        tokens = tokenize(quoted or word)
+        if not tokens:
+            continue
+        if is_prefix:
+            *exact_tokens, prefix = tokens
+            if exact_tokens:
+                clauses.append(('phrase', exact_tokens) if len(exact_tokens) > 1 else ('term', exact_tokens))
+            clauses.append(('prefix', [prefix]))
+        elif len(tokens) > 1:
+            clauses.append(('phrase', tokens))
+        else:
+            clauses.append(('term', tokens))
+    return clauses
+
+def phrase_matches(segment: Segment, tokens: List[str]) -> Dict[int, int]:
+    """{docnum: number of times the phrase appears} for documents containing the tokens next to each other"""
+    token_postings = [segment.postings(token) for token in tokens]
+    if not all(token_postings):
+        return {}
+
+    matches = {}
+    rarest_first = sorted(range(len(tokens)), key=lambda i: len(token_postings[i]))
+    docnums = set(token_postings[rarest_first[0]])
+    for i in rarest_first[1:]:
+        docnums &= token_postings[i].keys()
+
+    for docnum in docnums:
+        following = [set(postings[docnum]) for postings in token_postings[1:]]
+        tf = sum(
+            1 for start in token_postings[0][docnum]
+                if all(start + offset + 1 in positions for offset, positions in enumerate(following))
+        )
+        if tf:
+            matches[docnum] = tf
+    return matches
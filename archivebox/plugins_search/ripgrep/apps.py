@@ -1,9 +1,8 @@
 __package__ = 'archivebox.plugins_search.ripgrep'
 
-import re
+import os
 from pathlib import Path
-from subprocess import run
-from typing import List, Dict, Iterable
+from typing import List, Dict, Set, Tuple, Iterable
 # from typing_extensions import Self
 
 # Depends on other PyPI/vendor packages:
@@ -15,10 +14,11 @@ from abx.archivebox.base_plugin import BasePlugin
 from abx.archivebox.base_configset import BaseConfigSet
 from abx.archivebox.base_binary import BaseBinary, env, apt, brew
 from abx.archivebox.base_hook import BaseHook
-from abx.archivebox.base_searchbackend import BaseSearchBackend
+from abx.archivebox.base_searchbackend import BaseSearchBackend, SearchHit
 
 # Depends on Other Plugins:
-from archivebox.config import CONSTANTS, SEARCH_BACKEND_CONFIG
+from archivebox.config import CONSTANTS
+from archivebox.misc.util import chunked
 
 ###################### Config ##########################
 
@@ -35,6 +35,8 @@ class RipgrepConfig(BaseConfigSet):
         '--regexp',
     ])
     RIPGREP_SEARCH_DIR: Path = CONSTANTS.ARCHIVE_DIR
+    RIPGREP_MANIFEST: Path = CONSTANTS.CACHE_DIR / 'ripgrep_manifest.sqlite3'  # text-bearing output files to search, kept up to date by index()/flush()
+    RIPGREP_SHARDS: int = Field(default=os.cpu_count() or 1)                  # number of rg processes to split each search across
 
 RIPGREP_CONFIG = RipgrepConfig()
 
@@ -51,45 +53,39 @@ class RipgrepBinary(BaseBinary):
 
 RIPGREP_BINARY = RipgrepBinary()
 
-# regex to match archive/<ts>/... snapshot dir names
-TIMESTAMP_REGEX =  re.compile(r'\/([\d]+\.[\d]+)\/')
-
 class RipgrepSearchBackend(BaseSearchBackend):
     name: str = 'ripgrep'
     docs_url: str = 'https://github.com/BurntSushi/ripgrep'
     
     @staticmethod
     def index(snapshot_id: str, texts: List[str]):
-        return
+        # ripgrep searches the output files directly, so just record which files to search
+        from .manifest import update_manifest
+        update_manifest([snapshot_id])
+
+    def index_many(self, items: Iterable[Tuple[str, List[str]]]):
+        from .manifest import update_manifest
+        for chunk in chunked(items, 500):
+            update_manifest(snapshot_id for snapshot_id, _texts in chunk)
 
     @staticmethod
     def flush(snapshot_ids: Iterable[str]):
-        return
+        from .manifest import remove_from_manifest
+        remove_from_manifest(snapshot_ids)
 
     @staticmethod
     def search(text: str) -> List[str]:
-        from core.models import Snapshot
-        
-        ripgrep_binary = RIPGREP_BINARY.load()
-        if not ripgrep_binary.version:
-            raise Exception("ripgrep binary not found, install ripgrep to use this search backend")
-    
-        cmd = [
-            ripgrep_binary.abspath, 
-            *RIPGREP_CONFIG.RIPGREP_ARGS_DEFAULT,
-            text,
-            str(RIPGREP_CONFIG.RIPGREP_SEARCH_DIR),
-        ]
-        proc = run(cmd, timeout=SEARCH_BACKEND_CONFIG.SEARCH_BACKEND_TIMEOUT, capture_output=True, text=True)
-        timestamps = set()
-        for path in proc.stdout.splitlines():
-            ts = TIMESTAMP_REGEX.findall(path)
-            if ts:
-                timestamps.add(ts[0])
-        
-        snap_ids = [str(id) for id in Snapshot.objects.filter(timestamp__in=timestamps).values_list('pk', flat=True)]
-    
-        return snap_ids
+        from .manifest import search_snapshot_ids
+        return list(search_snapshot_ids(text))
+
+    def search_ranked(self, text: str, limit: int, offset: int=0) -> List[SearchHit]:
+        # ripgrep has no ranking, pages are streamed from the rg shards (or sliced from the full result once it's cached)
+        from .manifest import search_page
+        return [SearchHit(snapshot_id=snapshot_id) for snapshot_id in search_page(text, limit, offset)]
+
+    def list_ids(self) -> Set[str]:
+        from .manifest import get_manifest_snapshot_ids
+        return get_manifest_snapshot_ids()
 
 RIPGREP_SEARCH_BACKEND = RipgrepSearchBackend()
 
@@ -0,0 +1,244 @@
+__package__ = 'archivebox.plugins_search.ripgrep'
+
+import time
+import queue
+import sqlite3
+import threading
+import subprocess
+
+from pathlib import Path
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from archivebox.config import SEARCH_BACKEND_CONFIG
+from archivebox.misc.util import chunked
+from archivebox.search.cache import SEARCH_CACHE, bump_search_generation
+
+from .apps import RIPGREP_CONFIG, RIPGREP_BINARY
+
+
+# rg is given explicit file paths instead of a dir to walk, keep each command line well under ARG_MAX
+MAX_ARGS_LENGTH = 100_000
+
+
+### Manifest of text-bearing output files
+
+def get_manifest_db() -> sqlite3.Connection:
+    RIPGREP_CONFIG.RIPGREP_MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(RIPGREP_CONFIG.RIPGREP_MANIFEST, timeout=30)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS ripgrep_manifest (
+            path TEXT PRIMARY KEY,
+            snapshot_id TEXT NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS ripgrep_manifest_snapshot_id ON ripgrep_manifest(snapshot_id)')
+    db.execute('CREATE TABLE IF NOT EXISTS ripgrep_manifest_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    return db
+
+
+def indexable_output_paths(results: Iterable[Tuple[str, str, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    (snapshot_id, path) of the text file produced by each (snapshot_id, pwd, output) indexable ArchiveResult,
+    readability/mercury output a folder with a content.txt inside, the rest output a single html/txt file
+    """
+    for snapshot_id, pwd, output in results:
+        if not output:
+            continue
+        path = Path(pwd) / output
+        if path.is_dir():
+            path = path / 'content.txt'
+        if path.is_file():
+            yield str(snapshot_id), str(path)
+
+
+def get_indexable_results(snapshot_ids: Optional[Iterable[str]]=None) -> Iterator[Tuple[str, str, str]]:
+    from core.models import ArchiveResult
+
+    results = ArchiveResult.objects.indexable(sorted=False)
+    if snapshot_ids is None:
+        yield from results.values_list('snapshot_id', 'pwd', 'output').iterator(chunk_size=2000)
+        return
+    for chunk in chunked(snapshot_ids, 500):
+        yield from results.filter(snapshot_id__in=chunk).values_list('snapshot_id', 'pwd', 'output')
+
+
+def update_manifest(snapshot_ids: Iterable[str]) -> None:
+    """(re)record the indexable output files of the given snapshots"""
+    snapshot_ids = [str(snapshot_id) for snapshot_id in snapshot_ids]
+    rows = list(indexable_output_paths(get_indexable_results(snapshot_ids)))
+    db = get_manifest_db()
+    try:
+        with db:
+            db.executemany('DELETE FROM ripgrep_manifest WHERE snapshot_id = ?', [(snapshot_id,) for snapshot_id in snapshot_ids])
+            db.executemany('INSERT OR REPLACE INTO ripgrep_manifest (snapshot_id, path) VALUES (?, ?)', rows)
+    finally:
+        db.close()
+    # cached search results may include files that are gone or miss new ones
+    bump_search_generation()
+
+def remove_from_manifest(snapshot_ids: Iterable[str]) -> None:
+    db = get_manifest_db()
+    try:
+        with db:
+            db.executemany('DELETE FROM ripgrep_manifest WHERE snapshot_id = ?', [(str(snapshot_id),) for snapshot_id in snapshot_ids])
+    finally:
+        db.close()
+    bump_search_generation()
+
+def rebuild_manifest() -> None:
+    """record the indexable output files of every snapshot from scratch"""
+    db = get_manifest_db()
+    try:
+        with db:
+            db.execute('DELETE FROM ripgrep_manifest')
+            for rows in chunked(indexable_output_paths(get_indexable_results()), 2000):
+                db.executemany('INSERT OR REPLACE INTO ripgrep_manifest (snapshot_id, path) VALUES (?, ?)', rows)
+            db.execute("INSERT OR REPLACE INTO ripgrep_manifest_meta VALUES ('built', 1)")
+    finally:
+        db.close()
+    bump_search_generation()
+
+
+def ensure_manifest() -> None:
+    """build the manifest if it's never been built"""
+    db = get_manifest_db()
+    try:
+        built = db.execute("SELECT value FROM ripgrep_manifest_meta WHERE key = 'built'").fetchone()
+    finally:
+        db.close()
+    if not built:
+        rebuild_manifest()
+
+def load_manifest() -> Dict[str, str]:
+    """{path: snapshot_id}, building the manifest first if it's never been built"""
+    ensure_manifest()
+    db = get_manifest_db()
+    try:
+        return dict(db.execute('SELECT path, snapshot_id FROM ripgrep_manifest'))
+    finally:
+        db.close()
+
+def get_manifest_snapshot_ids() -> Set[str]:
+    ensure_manifest()
+    db = get_manifest_db()
+    try:
+        return {snapshot_id for snapshot_id, in db.execute('SELECT DISTINCT snapshot_id FROM ripgrep_manifest')}
+    finally:
+        db.close()
+
+
+### Searching
+
+def shard_paths(paths: List[str], num_shards: int) -> Iterator[List[str]]:
+    """split the manifest into num_shards interleaved shards, then split those further so no rg command line gets too long"""
+    for shard in range(max(num_shards, 1)):
+        batch, batch_length = [], 0
+        for path in paths[shard::max(num_shards, 1)]:
+            if batch and batch_length + len(path) + 1 > MAX_ARGS_LENGTH:
+                yield batch
+                batch, batch_length = [], 0
+            batch.append(path)
+            batch_length += len(path) + 1
+        if batch:
+            yield batch
+
+
+def iter_matching_paths(text: str, paths: List[str]) -> Iterator[str]:
+    """run rg over the given files in parallel shards, yielding each matching path as soon as any shard prints it"""
+
+    ripgrep_binary = RIPGREP_BINARY.load()
+    if not ripgrep_binary.version:
+        raise Exception("ripgrep binary not found, install ripgrep to use this search backend")
+
+    shards = list(shard_paths(paths, RIPGREP_CONFIG.RIPGREP_SHARDS))
+    matches: 'queue.Queue[Optional[str]]' = queue.Queue()
+    procs: List[subprocess.Popen] = []
+    procs_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def run_shard(shard: List[str]) -> None:
+        try:
+            with procs_lock:
+                if stopped.is_set():
+                    return
+                proc = subprocess.Popen(
+                    [str(ripgrep_binary.abspath), *RIPGREP_CONFIG.RIPGREP_ARGS_DEFAULT, text, '--', *shard],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                )
+                procs.append(proc)
+            with proc:
+                for line in proc.stdout:
+                    matches.put(line.rstrip('\n'))
+        finally:
+            matches.put(None)   # this shard is done
+
+    deadline = time.monotonic() + SEARCH_BACKEND_CONFIG.SEARCH_BACKEND_TIMEOUT
+    pool = ThreadPoolExecutor(max_workers=max(RIPGREP_CONFIG.RIPGREP_SHARDS, 1))
+    try:
+        for shard in shards:
+            pool.submit(run_shard, shard)
+        remaining = len(shards)
+        while remaining:
+            try:
+                path = matches.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f'ripgrep search took longer than SEARCH_BACKEND_TIMEOUT={SEARCH_BACKEND_CONFIG.SEARCH_BACKEND_TIMEOUT}s')
+            if path is None:
+                remaining -= 1
+            else:
+                yield path
+    finally:
+        # stop any shards that are still running if the caller stopped reading early or we timed out
+        with procs_lock:
+            stopped.set()
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_snapshot_ids(text: str) -> Iterator[str]:
+    """the snapshot_id of each match as soon as any rg shard finds it (in no particular order), stop reading to stop rg"""
+    manifest = load_manifest()
+    seen: Set[str] = set()
+    matching_paths = iter_matching_paths(text, list(manifest))
+    try:
+        for path in matching_paths:
+            snapshot_id = manifest.get(path)
+            if snapshot_id and snapshot_id not in seen:
+                seen.add(snapshot_id)
+                yield snapshot_id
+    finally:
+        matching_paths.close()
+
+
+def search_snapshot_ids(text: str) -> List[str]:
+    """
+    the snapshot_id of every match, sorted so that the pages search_page() slices from it always line up, no matter
+    in which order the rg shards finished (cached in SEARCH_CACHE until the manifest or the search index changes)
+    """
+    # built before looking in the cache, building it invalidates the cache
+    ensure_manifest()
+    return SEARCH_CACHE.get_or_call(('ripgrep', 'snapshot_ids', text), lambda: sorted(iter_snapshot_ids(text)))
+
+
+def search_page(text: str, limit: int, offset: int=0) -> List[str]:
+    """
+    limit snapshot_ids from offset, sliced from the sorted full result if it's already cached (e.g. by count()),
+    otherwise the first offset + limit matches the rg shards find, without waiting for the rest of them
+    """
+    ensure_manifest()
+    snapshot_ids = SEARCH_CACHE.get(('ripgrep', 'snapshot_ids', text))
+    if snapshot_ids is not None:
+        return snapshot_ids[offset:offset + limit]
+
+    matches = iter_snapshot_ids(text)
+    try:
+        return list(islice(matches, offset, offset + limit))
+    finally:
+        matches.close()
@@ -1,10 +1,12 @@
 __package__ = 'archivebox.plugins_search.sonic'
 
-import sys
-from typing import List, Dict, Generator, cast
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Tuple, Iterable
 
 # Depends on other PyPI/vendor packages:
-from pydantic import InstanceOf, Field, model_validator
+from pydantic import InstanceOf, Field
 from pydantic_pkgr import BinProvider, BinProviderName, ProviderLookupDict, BinName
 
 # Depends on other Django apps:
@@ -12,17 +14,12 @@ from abx.archivebox.base_plugin import BasePlugin
 from abx.archivebox.base_configset import BaseConfigSet
 from abx.archivebox.base_binary import BaseBinary, env, brew
 from abx.archivebox.base_hook import BaseHook
-from abx.archivebox.base_searchbackend import BaseSearchBackend
+from abx.archivebox.base_searchbackend import BaseSearchBackend, SearchHit
 
 # Depends on Other Plugins:
 from archivebox.config import SEARCH_BACKEND_CONFIG
 
-SONIC_LIB = None
-try:
-    import sonic
-    SONIC_LIB = sonic
-except ImportError:
-    SONIC_LIB = None
+from .channel import SonicChannel, SonicChannelPool, split_text
 
 ###################### Config ##########################
 
@@ -38,15 +35,8 @@ class SonicConfig(BaseConfigSet):
     SONIC_MAX_CHUNK_LENGTH: int     = Field(default=2000)
     SONIC_MAX_TEXT_LENGTH: int      = Field(default=100000000)
     SONIC_MAX_RETRIES: int          = Field(default=5)
-
-    @model_validator(mode='after')
-    def validate_sonic_port(self):
-        if SEARCH_BACKEND_CONFIG.SEARCH_BACKEND_ENGINE == 'sonic' and SONIC_LIB is None:
-            sys.stderr.write('[X] Error: Sonic search backend is enabled but sonic-client lib is not installed. You may need to run: pip install archivebox[sonic]\n')
-            # dont hard exit here. in case the user is just running "archivebox version" or "archivebox help", we still want those to work despite broken ldap
-            # sys.exit(1)
-            SEARCH_BACKEND_CONFIG.update_in_place(SEARCH_BACKEND_ENGINE='ripgrep')
-        return self
+    SONIC_POOL_SIZE: int            = Field(default=4)      # channels kept open to sonic for each of ingest and search
+    SONIC_PIPELINE_DEPTH: int       = Field(default=64)     # PUSH commands sent down a channel before waiting for their replies
 
 SONIC_CONFIG = SonicConfig()
 
@@ -63,51 +53,100 @@ class SonicBinary(BaseBinary):
     
     # TODO: add version checking over protocol? for when sonic backend is on remote server and binary is not installed locally
     # def on_get_version(self):
-    #     with sonic.IngestClient(SONIC_CONFIG.SONIC_HOST, str(SONIC_CONFIG.SONIC_PORT), SONIC_CONFIG.SONIC_PASSWORD) as ingestcl:
-    #         return SemVer.parse(str(ingestcl.protocol))
+    #     return SONIC_INGEST_POOL.call(lambda channel: ...)
 
 SONIC_BINARY = SonicBinary()
 
 
 
+_POOLS: Dict[str, SonicChannelPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(mode: str) -> SonicChannelPool:
+    # one pool per mode ('ingest' or 'search') per process, the channels stay open between calls
+    with _POOLS_LOCK:
+        if mode not in _POOLS:
+            if not _POOLS:
+                atexit.register(close_pools)
+            _POOLS[mode] = SonicChannelPool(
+                SONIC_CONFIG.SONIC_HOST,
+                SONIC_CONFIG.SONIC_PORT,
+                SONIC_CONFIG.SONIC_PASSWORD,
+                mode=mode,
+                size=SONIC_CONFIG.SONIC_POOL_SIZE,
+                timeout=SEARCH_BACKEND_CONFIG.SEARCH_BACKEND_TIMEOUT,
+            )
+        return _POOLS[mode]
+
+def close_pools():
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
+
+
+def _index_snapshot(snapshot_id: str, texts: List[str]):
+    error_count = 0
+    for text in texts:
+        text = text[:SONIC_CONFIG.SONIC_MAX_TEXT_LENGTH]
+
+        def push_text(channel: SonicChannel) -> int:
+            chunks = split_text(text, min(SONIC_CONFIG.SONIC_MAX_CHUNK_LENGTH, channel.max_text_chars))
+            return channel.push_many(SONIC_CONFIG.SONIC_COLLECTION, SONIC_CONFIG.SONIC_BUCKET, snapshot_id, chunks, depth=SONIC_CONFIG.SONIC_PIPELINE_DEPTH)
+
+        while True:
+            try:
+                get_pool('ingest').call(push_text)
+                break
+            except Exception as err:
+                print(f'[!] Sonic search backend threw an error while indexing: {err.__class__.__name__} {err}')
+                error_count += 1
+                if error_count > SONIC_CONFIG.SONIC_MAX_RETRIES:
+                    raise
+
+
 class SonicSearchBackend(BaseSearchBackend):
     name: str = 'sonic'
     docs_url: str = 'https://github.com/valeriansaliou/sonic'
     
     @staticmethod
     def index(snapshot_id: str, texts: List[str]):
-        error_count = 0
-        with sonic.IngestClient(SONIC_CONFIG.SONIC_HOST, str(SONIC_CONFIG.SONIC_PORT), SONIC_CONFIG.SONIC_PASSWORD) as ingestcl:
-            for text in texts:
-                chunks = (
-                    text[i:i+SONIC_CONFIG.SONIC_MAX_CHUNK_LENGTH]
-                    for i in range(
-                        0,
-                        min(len(text), SONIC_CONFIG.SONIC_MAX_TEXT_LENGTH),
-                        SONIC_CONFIG.SONIC_MAX_CHUNK_LENGTH,
-                    )
-                )
-                try:
-                    for chunk in chunks:
-                        ingestcl.push(SONIC_CONFIG.SONIC_COLLECTION, SONIC_CONFIG.SONIC_BUCKET, snapshot_id, str(chunk))
-                except Exception as err:
-                    print(f'[!] Sonic search backend threw an error while indexing: {err.__class__.__name__} {err}')
-                    error_count += 1
-                    if error_count > SONIC_CONFIG.SONIC_MAX_RETRIES:
-                        raise
+        _index_snapshot(str(snapshot_id), texts)
+
+    def index_many(self, items: Iterable[Tuple[str, List[str]]]):
+        # index several snapshots at once, one per pooled channel, but only read the next snapshot's
+        # texts once there's room for it, so a full reindex never holds more than a few texts in memory
+        workers = SONIC_CONFIG.SONIC_POOL_SIZE
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            for snapshot_id, texts in items:
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(executor.submit(_index_snapshot, str(snapshot_id), texts))
+            for future in in_flight:
+                future.result()
 
     @staticmethod
-    def flush(snapshot_ids: Generator[str, None, None]):
-        with sonic.IngestClient(SONIC_CONFIG.SONIC_HOST, str(SONIC_CONFIG.SONIC_PORT), SONIC_CONFIG.SONIC_PASSWORD) as ingestcl:
-            for id in snapshot_ids:
-                ingestcl.flush_object(SONIC_CONFIG.SONIC_COLLECTION, SONIC_CONFIG.SONIC_BUCKET, str(id))
-    
+    def flush(snapshot_ids: Iterable[str]):
+        snapshot_ids = [str(snapshot_id) for snapshot_id in snapshot_ids]
+        get_pool('ingest').call(
+            lambda channel: channel.flush_objects(SONIC_CONFIG.SONIC_COLLECTION, SONIC_CONFIG.SONIC_BUCKET, snapshot_ids)
+        )
 
     @staticmethod
     def search(text: str) -> List[str]:
-        with sonic.SearchClient(SONIC_CONFIG.SONIC_HOST, SONIC_CONFIG.SONIC_PORT, SONIC_CONFIG.SONIC_PASSWORD) as querycl:
-            snap_ids = cast(List[str], querycl.query(SONIC_CONFIG.SONIC_COLLECTION, SONIC_CONFIG.SONIC_BUCKET, text))
-        return [str(id) for id in snap_ids]
+        return get_pool('search').call(
+            lambda channel: channel.query(SONIC_CONFIG.SONIC_COLLECTION, SONIC_CONFIG.SONIC_BUCKET, text)
+        )
+
+    def search_ranked(self, text: str, limit: int, offset: int=0) -> List[SearchHit]:
+        # sonic already returns results in order of relevance, and can page through them itself
+        snap_ids = get_pool('search').call(
+            lambda channel: channel.query(SONIC_CONFIG.SONIC_COLLECTION, SONIC_CONFIG.SONIC_BUCKET, text, limit=limit, offset=offset)
+        )
+        return [SearchHit(snapshot_id=str(id)) for id in snap_ids]
     
     
 SONIC_SEARCH_BACKEND = SonicSearchBackend()
@@ -0,0 +1,233 @@
+__package__ = 'archivebox.plugins_search.sonic'
+
+"""
+A minimal client for the Sonic Channel protocol (https://github.com/valeriansaliou/sonic/blob/master/PROTOCOL.md)
+that keeps a pool of open channels and can pipeline many PUSH commands down one channel without waiting for
+each reply, which sonic-client's one-command-at-a-time clients can't do.
+"""
+
+import re
+import time
+import socket
+import threading
+
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+# room left in each command line for the command name, collection, bucket and object around the text
+COMMAND_OVERHEAD_BYTES = 512
+
+STARTED_BUFFER_RE = re.compile(r'buffer\((\d+)\)')
+
+
+class SonicError(Exception):
+    """the server replied ERR to a command"""
+
+
+def quote_text(text: str) -> str:
+    # sonic only understands \" inside quoted text, newlines/backslashes would break the command line
+    return '"{}"'.format(' '.join(text.replace('\\', ' ').replace('"', '\\"').split()))
+
+
+def split_text(text: str, max_chars: int) -> Iterator[str]:
+    """split text into chunks of at most max_chars, breaking at whitespace where possible so words aren't cut in half"""
+    start = 0
+    while start < len(text):
+        end = next_start = start + max_chars
+        if end < len(text):
+            space = text.rfind(' ', start, end + 1)
+            if space > start:
+                end, next_start = space, space + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        start = next_start
+
+
+class SonicChannel:
+    """one TCP connection to sonic, started in either 'ingest' or 'search' mode"""
+
+    def __init__(self, host: str, port: int, password: str, mode: str, timeout: float=10):
+        self.mode = mode
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.sock.makefile('rwb')
+        self.reused = False
+        self.broken = False
+        self.last_used = time.monotonic()
+
+        self._read_line('CONNECTED')
+        self._write_line(f'START {mode} {password}')
+        started = self._read_line('STARTED')
+        buffer = STARTED_BUFFER_RE.search(started)
+        self.buffer_size = int(buffer.group(1)) if buffer else 20_000
+
+    def close(self) -> None:
+        try:
+            self._write_line('QUIT')
+            self.file.flush()
+        except OSError:
+            pass
+        for handle in (self.file, self.sock):
+            try:
+                handle.close()
+            except OSError:
+                pass
+
+    def _write_line(self, line: str, flush: bool=True) -> None:
+        self.file.write(line.encode('utf-8') + b'\r\n')
+        if flush:
+            self.file.flush()
+
+    def _read_line(self, expected: Optional[str]=None) -> str:
+        raw = self.file.readline()
+        if not raw:
+            raise ConnectionError('sonic closed the connection')
+        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+        if line.startswith('ERR '):
+            raise SonicError(line[4:])
+        if expected and not line.startswith(expected):
+            # the replies are out of step with the commands, so this channel can't be used any more
+            raise ConnectionError(f'expected {expected} from sonic but got: {line}')
+        return line
+
+    @property
+    def max_text_chars(self) -> int:
+        # worst case every character takes 4 bytes as utf-8
+        return max((self.buffer_size - COMMAND_OVERHEAD_BYTES) // 4, 1)
+
+    def ping(self) -> None:
+        self._write_line('PING')
+        self._read_line('PONG')
+
+    def push_many(self, collection: str, bucket: str, object: str, chunks: Iterable[str], depth: int=64) -> int:
+        """
+        PUSH each chunk of text without waiting for each OK, keeping at most depth replies outstanding
+        so neither side's socket buffers fill up, returns the number of chunks pushed
+        """
+        pending, pushed, error = 0, 0, None
+        for chunk in chunks:
+            self._write_line(f'PUSH {collection} {bucket} {object} {quote_text(chunk)}', flush=False)
+            pending += 1
+            pushed += 1
+            if pending >= depth:
+                self.file.flush()
+                try:
+                    self._read_line('OK')
+                except SonicError as err:
+                    error = error or err
+                pending -= 1
+        self.file.flush()
+        for _ in range(pending):
+            try:
+                self._read_line('OK')
+            except SonicError as err:
+                error = error or err
+        if error:
+            raise error
+        return pushed
+
+    def flush_object(self, collection: str, bucket: str, object: str) -> int:
+        self._write_line(f'FLUSHO {collection} {bucket} {object}')
+        return int(self._read_line('RESULT').split()[1])
+
+    def flush_objects(self, collection: str, bucket: str, objects: Iterable[str]) -> None:
+        """pipelined FLUSHO for many objects at once"""
+        objects = list(objects)
+        for object in objects:
+            self._write_line(f'FLUSHO {collection} {bucket} {object}', flush=False)
+        self.file.flush()
+        error = None
+        for _ in objects:
+            try:
+                self._read_line('RESULT')
+            except SonicError as err:
+                error = error or err
+        if error:
+            raise error
+
+    def query(self, collection: str, bucket: str, terms: str, limit: Optional[int]=None, offset: Optional[int]=None) -> List[str]:
+        command = f'QUERY {collection} {bucket} {quote_text(terms)}'
+        if limit is not None:
+            command += f' LIMIT({limit})'
+        if offset:
+            command += f' OFFSET({offset})'
+        self._write_line(command)
+        marker = self._read_line('PENDING').split()[1]
+        event = self._read_line(f'EVENT QUERY {marker}').split()
+        return event[3:]
+
+
+class SonicChannelPool:
+    """up to size open channels in one mode, shared between threads and reused across calls"""
+
+    def __init__(self, host: str, port: int, password: str, mode: str, size: int=4, timeout: float=10):
+        self.host, self.port, self.password, self.mode = host, port, password, mode
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self._idle: List[SonicChannel] = []
+        self._open = 0
+        self._lock = threading.Condition()
+
+    @contextmanager
+    def channel(self) -> Iterator[SonicChannel]:
+        with self._lock:
+            while not self._idle and self._open >= self.size:
+                self._lock.wait()
+            if self._idle:
+                channel = self._idle.pop()
+                channel.reused = True
+            else:
+                self._open += 1
+                channel = None
+
+        if channel is None:
+            try:
+                channel = SonicChannel(self.host, self.port, self.password, self.mode, timeout=self.timeout)
+            except BaseException:
+                with self._lock:
+                    self._open -= 1
+                    self._lock.notify()
+                raise
+
+        try:
+            yield channel
+        except SonicError:
+            # every reply was read before raising, the channel is still in a good state
+            raise
+        except BaseException:
+            # a channel that failed mid-command may have unread replies left on it, never reuse it
+            channel.broken = True
+            raise
+        finally:
+            channel.last_used = time.monotonic()
+            with self._lock:
+                if channel.broken:
+                    self._open -= 1
+                    channel.close()
+                else:
+                    self._idle.append(channel)
+                self._lock.notify()
+
+    def call(self, func: Callable[[SonicChannel], T]) -> T:
+        """run func with a channel from the pool, retrying once on a fresh channel if a reused one turns out to be dead"""
+        while True:
+            with self.channel() as channel:
+                try:
+                    return func(channel)
+                except OSError:
+                    # sonic closes channels that have been idle for longer than its tcp_timeout
+                    if not channel.reused:
+                        raise
+                    channel.broken = True
+            # drop every other idle channel too, they're probably just as stale
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for channel in self._idle:
+                channel.close()
+            self._open -= len(self._idle)
+            self._idle = []
+            self._lock.notify_all()
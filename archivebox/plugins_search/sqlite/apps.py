@@ -3,7 +3,9 @@ __package__ = 'archivebox.plugins_search.sqlite'
 import sys
 import codecs
 import sqlite3
-from typing import List, Iterable, Callable
+import threading
+from contextlib import contextmanager
+from typing import List, Set, Tuple, Iterable, Iterator, Callable
 
 from django.core.exceptions import ImproperlyConfigured
 
@@ -14,10 +16,11 @@ from pydantic import InstanceOf, Field, model_validator
 from abx.archivebox.base_plugin import BasePlugin
 from abx.archivebox.base_configset import BaseConfigSet
 from abx.archivebox.base_hook import BaseHook
-from abx.archivebox.base_searchbackend import BaseSearchBackend
+from abx.archivebox.base_searchbackend import BaseSearchBackend, SearchHit
 
 # Depends on Other Plugins:
 from archivebox.config import SEARCH_BACKEND_CONFIG
+from archivebox.misc.util import chunked
 
 
 
@@ -33,6 +36,7 @@ class SqliteftsConfig(BaseConfigSet):
     SQLITEFTS_TABLE: str                = Field(default='snapshot_fts')
     SQLITEFTS_ID_TABLE: str             = Field(default='snapshot_id_fts')
     SQLITEFTS_COLUMN: str               = Field(default='texts')
+    SQLITEFTS_BATCH_SIZE: int           = Field(default=500)    # snapshots written per transaction by index_many (stays under sqlite's 999 query params)
     
     @model_validator(mode='after')
     def validate_fts_separate_database(self):
@@ -47,7 +51,7 @@ class SqliteftsConfig(BaseConfigSet):
         # has to be called to get a context manager, but sqlite3.Connection
         # is a context manager without being called.
         if self.SQLITEFTS_SEPARATE_DATABASE:
-            return lambda: sqlite3.connect(self.SQLITEFTS_DB)
+            return _get_separate_db_connection
         else:
             from django.db import connection as database
             return database.cursor
@@ -69,8 +73,7 @@ class SqliteftsConfig(BaseConfigSet):
             limit_id = sqlite3.SQLITE_LIMIT_LENGTH
             
             if self.SQLITEFTS_SEPARATE_DATABASE:
-                cursor = self.get_connection()
-                return cursor.connection.getlimit(limit_id)
+                return _get_separate_db_connection().getlimit(limit_id)
             else:
                 with database.temporary_connection() as cursor:  # type: ignore[attr-defined]
                     return cursor.connection.getlimit(limit_id)
@@ -80,6 +83,32 @@ class SqliteftsConfig(BaseConfigSet):
 SQLITEFTS_CONFIG = SqliteftsConfig()
 
 
+_CONNECTIONS = threading.local()
+
+def _get_separate_db_connection() -> sqlite3.Connection:
+    # Reuse one long-lived connection per thread instead of reconnecting on
+    # every call, sqlite3 connections can't be shared between threads.
+    # (the connection's context manager commits/rolls back but doesn't close it)
+    connections = getattr(_CONNECTIONS, 'connections', None)
+    if connections is None:
+        connections = _CONNECTIONS.connections = {}
+    if SQLITEFTS_CONFIG.SQLITEFTS_DB not in connections:
+        connections[SQLITEFTS_CONFIG.SQLITEFTS_DB] = sqlite3.connect(SQLITEFTS_CONFIG.SQLITEFTS_DB)
+    return connections[SQLITEFTS_CONFIG.SQLITEFTS_DB]
+
+@contextmanager
+def _get_transaction() -> Iterator:
+    # Yield a cursor whose statements are all committed together at the end
+    if SQLITEFTS_CONFIG.SQLITEFTS_SEPARATE_DATABASE:
+        connection = _get_separate_db_connection()
+        with connection:
+            yield connection.cursor()
+    else:
+        from django.db import connection as database, transaction
+        with transaction.atomic(), database.cursor() as cursor:
+            yield cursor
+
+
 
 def _escape_sqlite3(value: str, *, quote: str, errors='strict') -> str:
     assert isinstance(quote, str), "quote is not a str"
@@ -164,49 +193,58 @@ def _handle_query_exception(exc: Exception):
 
 
 
+def _index_rows(rows: dict):
+    table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_TABLE)
+    column = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_COLUMN)
+    id_table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_ID_TABLE)
+    bind = SQLITEFTS_CONFIG.SQLITE_BIND
+
+    with _get_transaction() as cursor:
+        # If there is already an FTS index rowid to snapshot_id mapping,
+        # then don't insert a new one, silently ignoring the operation.
+        # {id_table}.rowid is AUTOINCREMENT, so will generate an unused
+        # rowid for the index if it is an unindexed snapshot_id.
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {id_table}(snapshot_id) VALUES({bind})",
+            [(snapshot_id,) for snapshot_id in rows])
+        # Fetch the FTS index rowids for all the given snapshot_ids
+        cursor.execute(
+            f"SELECT snapshot_id, rowid FROM {id_table} WHERE snapshot_id IN ({', '.join([bind] * len(rows))})",
+            list(rows))
+        rowids = dict(cursor.fetchall())
+        # (Re-)index the content
+        cursor.executemany(
+            "INSERT OR REPLACE INTO"
+            f" {table}(rowid, {column}) VALUES ({bind}, {bind})",
+            [(rowids[snapshot_id], text) for snapshot_id, text in rows.items()])
+
+
 class SqliteftsSearchBackend(BaseSearchBackend):
     name: str = 'sqlite'
     docs_url: str = 'https://www.sqlite.org/fts5.html'
     
     @staticmethod
     def index(snapshot_id: str, texts: List[str]):
-        text = ' '.join(texts)[:SQLITEFTS_CONFIG.SQLITE_LIMIT_LENGTH]
+        SQLITEFTS_SEARCH_BACKEND.index_many([(snapshot_id, texts)])
 
-        table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_TABLE)
-        column = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_COLUMN)
-        id_table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_ID_TABLE)
+    def index_many(self, items: Iterable[Tuple[str, List[str]]]):
+        max_length = SQLITEFTS_CONFIG.SQLITE_LIMIT_LENGTH
 
-        with SQLITEFTS_CONFIG.get_connection() as cursor:
+        for chunk in chunked(items, SQLITEFTS_CONFIG.SQLITEFTS_BATCH_SIZE):
+            rows = {str(snapshot_id): ' '.join(texts)[:max_length] for snapshot_id, texts in chunk}
             retries = 2
             while retries > 0:
                 retries -= 1
                 try:
-                    # If there is already an FTS index rowid to snapshot_id mapping,
-                    # then don't insert a new one, silently ignoring the operation.
-                    # {id_table}.rowid is AUTOINCREMENT, so will generate an unused
-                    # rowid for the index if it is an unindexed snapshot_id.
-                    cursor.execute(
-                        f"INSERT OR IGNORE INTO {id_table}(snapshot_id) VALUES({SQLITEFTS_CONFIG.SQLITE_BIND})",
-                        [snapshot_id])
-                    # Fetch the FTS index rowid for the given snapshot_id
-                    id_res = cursor.execute(
-                        f"SELECT rowid FROM {id_table} WHERE snapshot_id = {SQLITEFTS_CONFIG.SQLITE_BIND}",
-                        [snapshot_id])
-                    rowid = id_res.fetchone()[0]
-                    # (Re-)index the content
-                    cursor.execute(
-                        "INSERT OR REPLACE INTO"
-                        f" {table}(rowid, {column}) VALUES ({SQLITEFTS_CONFIG.SQLITE_BIND}, {SQLITEFTS_CONFIG.SQLITE_BIND})",
-                        [rowid, text])
-                    # All statements succeeded; return
-                    return
+                    _index_rows(rows)
+                    break
                 except Exception as e:
                     if str(e).startswith("no such table:") and retries > 0:
                         _create_tables()
                     else:
                         raise
-
-        raise RuntimeError("Failed to create tables for SQLite FTS5 search")
+            else:
+                raise RuntimeError("Failed to create tables for SQLite FTS5 search")
 
     @staticmethod
     def search(text: str) -> List[str]:
@@ -227,6 +265,54 @@ class SqliteftsSearchBackend(BaseSearchBackend):
             snap_ids = [row[0] for row in res.fetchall()]
         return snap_ids
 
+    def search_ranked(self, text: str, limit: int, offset: int=0) -> List[SearchHit]:
+        table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_TABLE)
+        id_table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_ID_TABLE)
+        bind = SQLITEFTS_CONFIG.SQLITE_BIND
+
+        with SQLITEFTS_CONFIG.get_connection() as cursor:
+            try:
+                # rank is bm25() by default. The table is contentless, so
+                # snippet()/highlight() aren't available here.
+                res = cursor.execute(
+                    f"SELECT snapshot_id FROM {table}"
+                    f" INNER JOIN {id_table}"
+                    f" ON {id_table}.rowid = {table}.rowid"
+                    f" WHERE {table} MATCH {bind}"
+                    f" ORDER BY {table}.rank"
+                    f" LIMIT {bind} OFFSET {bind}",
+                    [text, limit, offset])
+            except Exception as e:
+                _handle_query_exception(e)
+
+            return [SearchHit(snapshot_id=row[0]) for row in res.fetchall()]
+
+    def count(self, text: str) -> int:
+        table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_TABLE)
+
+        with SQLITEFTS_CONFIG.get_connection() as cursor:
+            try:
+                res = cursor.execute(
+                    f"SELECT count(*) FROM {table} WHERE {table} MATCH {SQLITEFTS_CONFIG.SQLITE_BIND}",
+                    [text])
+            except Exception as e:
+                _handle_query_exception(e)
+
+            return res.fetchone()[0]
+
+    def list_ids(self) -> Set[str]:
+        id_table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_ID_TABLE)
+
+        with SQLITEFTS_CONFIG.get_connection() as cursor:
+            try:
+                res = cursor.execute(f"SELECT snapshot_id FROM {id_table}")
+            except Exception as e:
+                if str(e).startswith("no such table:"):
+                    return set()
+                raise
+
+            return {str(snapshot_id) for snapshot_id, in res.fetchall()}
+
     @staticmethod
     def flush(snapshot_ids: Iterable[str]):
         snapshot_ids = list(snapshot_ids)  # type: ignore[assignment]
@@ -237,7 +323,20 @@ class SqliteftsSearchBackend(BaseSearchBackend):
             try:
                 cursor.executemany(
                     f"DELETE FROM {id_table} WHERE snapshot_id={SQLITEFTS_CONFIG.SQLITE_BIND}",
-                    [snapshot_ids])
+                    [(snapshot_id,) for snapshot_id in snapshot_ids])
+            except Exception as e:
+                _handle_query_exception(e)
+
+    @staticmethod
+    def optimize():
+        table = _escape_sqlite3_identifier(SQLITEFTS_CONFIG.SQLITEFTS_TABLE)
+
+        with _get_transaction() as cursor:
+            try:
+                # Merge the b-tree segments left behind by many small
+                # inserts, then fully optimize the index into one segment
+                cursor.execute(f"INSERT INTO {table}({table}, rank) VALUES('merge', 500)")
+                cursor.execute(f"INSERT INTO {table}({table}) VALUES('optimize')")
             except Exception as e:
                 _handle_query_exception(e)
     
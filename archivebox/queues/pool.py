@@ -0,0 +1,132 @@
+__package__ = 'archivebox.queues'
+
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Deque, Iterable, Iterator, Optional
+
+import psutil
+
+from archivebox.config import ARCHIVING_CONFIG
+
+from ..index.schema import Link
+from ..logging_util import log_archiving_throughput
+
+
+class ArchivingPool:
+    """
+    Archive many Links at the same time using a pool of worker threads.
+
+    Each Link is archived start-to-finish by a single worker with archive_link(), so the order
+    extractors run in within a snapshot is unchanged (e.g. title/readability/htmltotext still run
+    after wget/singlefile/dom). Only whole snapshots run concurrently. The work is mostly waiting
+    on subprocesses and network IO, so threads are enough here.
+
+    New snapshots are only started while:
+        - fewer than ARCHIVING_WORKERS snapshots are running
+        - fewer than ARCHIVING_MAX_PER_DOMAIN snapshots of the same domain are running
+        - system CPU and memory usage are below ARCHIVING_MAX_CPU_PERCENT and ARCHIVING_MAX_MEMORY_PERCENT
+    """
+
+    POLL_INTERVAL: float = 0.5        # seconds to wait between checks when we're unable to start a new snapshot
+
+    def __init__(self,
+                 max_workers: Optional[int]=None,
+                 max_per_domain: Optional[int]=None,
+                 max_cpu_percent: Optional[int]=None,
+                 max_memory_percent: Optional[int]=None):
+        self.max_workers = max(max_workers or ARCHIVING_CONFIG.ARCHIVING_WORKERS, 1)
+        self.max_per_domain = max(max_per_domain or ARCHIVING_CONFIG.ARCHIVING_MAX_PER_DOMAIN, 1)
+        # 0 is a valid limit here, only fall back to the config when no limit was passed
+        self.max_cpu_percent = ARCHIVING_CONFIG.ARCHIVING_MAX_CPU_PERCENT if max_cpu_percent is None else max_cpu_percent
+        self.max_memory_percent = ARCHIVING_CONFIG.ARCHIVING_MAX_MEMORY_PERCENT if max_memory_percent is None else max_memory_percent
+
+        self.running: Dict[Future, Link] = {}
+        self.running_per_domain: Dict[str, int] = {}
+        self.num_finished: int = 0
+        self.start_ts: float = time.monotonic()
+
+        # the first call to cpu_percent() always returns 0.0, call it once so later calls measure since now
+        psutil.cpu_percent(interval=None)
+
+    @property
+    def snapshots_per_min(self) -> float:
+        elapsed = time.monotonic() - self.start_ts
+        return (self.num_finished / elapsed) * 60 if elapsed > 0 else 0.0
+
+    @property
+    def oldest_running(self) -> Optional[Link]:
+        """the earliest-started Link that is still in progress, used to tell the user where to --resume from"""
+        return next(iter(self.running.values()), None)
+
+    def has_resource_budget(self) -> bool:
+        if psutil.cpu_percent(interval=None) > self.max_cpu_percent:
+            return False
+        if psutil.virtual_memory().percent > self.max_memory_percent:
+            return False
+        return True
+
+    def pop_startable(self, pending: Deque[Link]) -> Optional[Link]:
+        """get the next pending Link whose domain is not already at its concurrency cap (preserving order otherwise)"""
+        for idx, link in enumerate(pending):
+            if self.running_per_domain.get(link.domain, 0) < self.max_per_domain:
+                del pending[idx]
+                return link
+        return None
+
+    def run(self, links: Iterable[Link], archive_func: Callable[[Link], Link], num_links: int=0) -> int:
+        """call archive_func(link) for every link using the pool, returns the number of links archived"""
+
+        links_iter: Iterator[Link] = iter(links)
+        pending: Deque[Link] = deque()
+        exhausted = False
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='archivebox_worker')
+        try:
+            while True:
+                # keep a small lookahead buffer so we can skip past links whose domain is saturated
+                while not exhausted and len(pending) < self.max_workers * 4:
+                    try:
+                        pending.append(next(links_iter))
+                    except StopIteration:
+                        exhausted = True
+
+                if not pending and not self.running:
+                    break
+
+                # always allow at least one snapshot to run, even if other processes are using up the CPU/memory budget
+                can_start = len(self.running) < self.max_workers and (not self.running or self.has_resource_budget())
+                link = self.pop_startable(pending) if can_start else None
+                if link is not None:
+                    self.running_per_domain[link.domain] = self.running_per_domain.get(link.domain, 0) + 1
+                    self.running[executor.submit(self._archive_one, archive_func, link)] = link
+                    continue
+
+                if not self.running:
+                    time.sleep(self.POLL_INTERVAL)
+                    continue
+
+                done, _ = wait(self.running, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    link = self.running.pop(future)
+                    self.running_per_domain[link.domain] -= 1
+                    future.result()                # re-raise any exception from the worker thread
+                    self.num_finished += 1
+                    log_archiving_throughput(self.num_finished, num_links, self.snapshots_per_min, len(self.running))
+        except BaseException:
+            # dont start anything new, but let the snapshots that are in-progress finish writing their index
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+        return self.num_finished
+
+    @staticmethod
+    def _archive_one(archive_func: Callable[[Link], Link], link: Link) -> Link:
+        from django.db import connections
+        try:
+            return archive_func(link)
+        finally:
+            # each worker thread gets its own DB connections, close them so they dont pile up
+            connections.close_all()
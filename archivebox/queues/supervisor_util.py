@@ -286,6 +286,22 @@ def start_server_workers(host='0.0.0.0', port='8000'):
             "stdout_logfile": "logs/worker_system_tasks.log",
             "redirect_stderr": "true",
         },
+        {
+            "name": "worker_search_indexing",
+            "command": "archivebox manage djangohuey --queue search_indexing -w 1 -k thread --disable-health-check",
+            "autostart": "true",
+            "autorestart": "true",
+            "stdout_logfile": "logs/worker_search_indexing.log",
+            "redirect_stderr": "true",
+        },
+        {
+            "name": "worker_precompress",
+            "command": "archivebox manage djangohuey --queue precompress -w 1 -k thread --disable-health-check",
+            "autostart": "true",
+            "autorestart": "true",
+            "stdout_logfile": "logs/worker_precompress.log",
+            "redirect_stderr": "true",
+        },
     ]
     fg_worker = {
         "name": "worker_daphne",
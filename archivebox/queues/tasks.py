@@ -1,6 +1,9 @@
 __package__ = 'archivebox.queues'
 
-from django_huey import db_task, task
+from pathlib import Path
+
+from huey import crontab
+from django_huey import db_task, task, db_periodic_task
 
 from huey_monitor.models import TaskModel
 from huey_monitor.tqdm import ProcessInfo
@@ -86,3 +89,46 @@ def bg_archive_snapshot(snapshot, overwrite=False, methods=None, task=None, pare
     process_info.update(n=1)
     return result
 
+
+@db_task(queue="search_indexing")
+def bg_index_pending_snapshots():
+    # no huey retries: failed batches stay in the queue with their own backoff, and get retried by the periodic task
+    from ..search import index_pending_snapshots
+
+    return index_pending_snapshots()
+
+
+@db_periodic_task(crontab(minute='*'), queue="search_indexing")
+def bg_index_pending_snapshots_periodic():
+    # picks up snapshots due for a retry, and ones queued while no search_indexing worker was running
+    from ..search import index_pending_snapshots
+    from ..search.indexing import get_indexing_lag
+
+    index_pending_snapshots()
+    lag = get_indexing_lag()
+    if lag['pending'] or lag['failed']:
+        print(f'[!] Search indexing is {lag["lag"]:.0f}s behind: {lag["pending"]} snapshots pending, {lag["failed"]} failed (last error: {lag["last_error"]})')
+
+
+@db_task(queue="precompress")
+def bg_precompress_snapshot(snapshot_dir):
+    from core.models import Snapshot
+    from core.manifest import update_output_manifest
+    from ..misc.precompress import precompress_snapshot
+    from ..logging_util import printable_filesize
+
+    stats = precompress_snapshot(snapshot_dir)
+    print(
+        f'[√] Precompressed {stats.files} outputs ({printable_filesize(stats.original_bytes)}) in {snapshot_dir}: '
+        f'+{printable_filesize(stats.compressed_bytes)} on disk, {stats.written} written, {stats.removed} removed in {stats.seconds:.1f}s'
+    )
+
+    # the snapshot's size changed, so its output manifest needs updating
+    snapshot = Snapshot.objects.filter(timestamp=Path(snapshot_dir).name).first()
+    if snapshot:
+        try:
+            update_output_manifest(snapshot)
+        except Exception as err:
+            # e.g. the db is locked by archive_link, which stores the manifest itself when it's done
+            print(f'[!] Failed to store the output manifest of {snapshot_dir}: {err}')
+    return stats._asdict()
@@ -1,59 +1,41 @@
 __package__ = 'archivebox.search'
 
+import re
+import time
 from pathlib import Path
-from typing import List, Union
+from typing import Iterable, Iterator, List, Tuple, Union, Optional
 
-from django.db.models import QuerySet
+from django.db.models import QuerySet, Case, When, IntegerField
 from django.conf import settings
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 import abx.archivebox.use
+from abx.archivebox.base_searchbackend import SearchHit
 
 from archivebox.index.schema import Link
-from archivebox.misc.util import enforce_types
+from archivebox.misc.util import enforce_types, chunked
 from archivebox.misc.logging import stderr
 from archivebox.config import SEARCH_BACKEND_CONFIG
 
+from .cache import SEARCH_CACHE, bump_search_generation
+from .indexing import queue_snapshots, claim_batch, mark_indexed, mark_failed, remove_from_queue
+from .text import get_indexable_text, content_hash, get_indexed_hashes, save_indexed_hashes, forget_indexed_hashes
+
 
 def log_index_started(url):
     print('[green][*] Indexing url: {} in the search index[/]'.format(url))
     print( )
 
-def get_file_result_content(res, extra_path, use_pwd=False):
-    if use_pwd: 
-        fpath = f'{res.pwd}/{res.output}'
-    else:
-        fpath = f'{res.output}'
-    
-    if extra_path:
-        fpath = f'{fpath}/{extra_path}'
-
-    with open(fpath, 'r', encoding='utf-8') as file:
-        data = file.read()
-    if data:
-        return [data]
-    return []
-
-
-# This should be abstracted by a plugin interface for extractors
 @enforce_types
-def get_indexable_content(results: QuerySet):
-    if not results:
-        return []
-    # Only use the first method available
-    res, method = results.first(), results.first().extractor
-    if method not in ('readability', 'singlefile', 'dom', 'wget'):
-        return []
-    # This should come from a plugin interface
-
-    # TODO: banish this duplication and get these from the extractor file
-    if method == 'readability':
-        return get_file_result_content(res, 'content.txt', use_pwd=True)
-    elif method == 'singlefile':
-        return get_file_result_content(res, '', use_pwd=True)
-    elif method == 'dom':
-        return get_file_result_content(res, '', use_pwd=True)
-    elif method == 'wget':
-        return get_file_result_content(res, '', use_pwd=True)
+def get_indexable_content(results: QuerySet) -> List[str]:
+    """
+    the text of the best available output for the search backend, streamed from disk with html converted
+    to text, data: URIs removed and the length capped (see search.text), results should be sorted by
+    indexing precedence as ArchiveResult.objects.indexable() does
+    """
+    text = get_indexable_text(results)
+    return [text] if text else []
 
 
 def import_backend():
@@ -62,56 +44,268 @@ def import_backend():
             return backend
     raise Exception(f'Could not load {SEARCH_BACKEND_CONFIG.SEARCH_BACKEND_ENGINE} as search backend')
 
-@enforce_types
-def write_search_index(link: Link, texts: Union[List[str], None]=None, out_dir: Path=settings.DATA_DIR, skip_text_index: bool=False) -> None:
+def queue_search_index(snapshot_pks: Iterable[str]) -> None:
+    """
+    queue snapshots to be (re-)indexed in the background by the search_indexing queue, instead of writing to the
+    search backend in the middle of archiving, queueing the same snapshot again before it's indexed is a no-op
+    """
     if not SEARCH_BACKEND_CONFIG.USE_INDEXING_BACKEND:
         return
 
-    if not skip_text_index and texts:
-        from core.models import Snapshot
-
-        snap = Snapshot.objects.filter(url=link.url).first()
-        backend = import_backend()
-        if snap:
-            try:
-                backend.index(snapshot_id=str(snap.pk), texts=texts)
-            except Exception as err:
-                stderr()
-                stderr(
-                    f'[X] The search backend threw an exception={err}:',
-                color='red',
-                )
+    if queue_snapshots(snapshot_pks):
+        # nothing was waiting to be indexed, so no batch is scheduled yet to pick these up
+        try:
+            from queues.tasks import bg_index_pending_snapshots
+            bg_index_pending_snapshots.schedule(delay=SEARCH_BACKEND_CONFIG.SEARCH_INDEX_DELAY)
+        except Exception as err:
+            # they stay queued, and get picked up by the next batch or the periodic task instead
+            stderr(f'[!] Failed to schedule background search indexing: {err}', color='lightyellow')
 
 @enforce_types
-def query_search_index(query: str, out_dir: Path=settings.DATA_DIR) -> QuerySet:
+def index_pending_snapshots(batch_size: Optional[int]=None) -> int:
+    """
+    index every snapshot waiting in the search_indexing queue, batch_size at a time with the backend's
+    index_many(), and return how many were indexed. If the backend fails, the batch is left in the queue
+    to be retried later (with exponential backoff) and the exception is raised.
+    """
+    if not SEARCH_BACKEND_CONFIG.USE_INDEXING_BACKEND:
+        return 0
+
     from core.models import Snapshot
 
-    if SEARCH_BACKEND_CONFIG.USE_SEARCHING_BACKEND:
-        backend = import_backend()
+    backend = import_backend()
+    batch_size = batch_size or SEARCH_BACKEND_CONFIG.SEARCH_INDEX_BATCH_SIZE
+    num_indexed = 0
+    while True:
+        claimed = claim_batch(batch_size)
+        if not claimed:
+            return num_indexed
         try:
-            snapshot_pks = backend.search(query)
+            started = time.time()
+            snapshots = list(Snapshot.objects.filter(pk__in=list(claimed)).prefetch_related(None))
+            indexed_hashes: List[tuple] = []
+            backend.index_many(iter_changed_texts(snapshots, backend, indexed_hashes))
+            bump_search_generation()
+            save_indexed_hashes(indexed_hashes, backend.name, indexed_at=started)
         except Exception as err:
-            stderr()
-            stderr(
-                    f'[X] The search backend threw an exception={err}:',
-                color='red',
-                )
+            mark_failed(claimed, f'{err.__class__.__name__}: {err}')
             raise
+        mark_indexed(claimed)
+        num_indexed += len(claimed)
+
+def index_queued_snapshots() -> None:
+    """index everything waiting in the search_indexing queue now, without waiting for a background worker to do it"""
+    try:
+        index_pending_snapshots()
+    except Exception as err:
+        stderr()
+        stderr(
+            f'[X] The search backend threw an exception={err}:',
+            color='red',
+        )
+        stderr('    The snapshots that failed to index will be retried later.')
+
+def search_rank(snapshot_pks: List[str]) -> Case:
+    """an expression to sort Snapshots in the order the search backend ranked them in, anything else sorts last"""
+    return Case(
+        *(When(pk=pk, then=rank) for rank, pk in enumerate(snapshot_pks)),
+        default=len(snapshot_pks),
+        output_field=IntegerField(),
+    )
+
+@enforce_types
+def query_search_pks(query: str, limit: Optional[int]=None) -> List[str]:
+    """get the pks of the Snapshots matching a full-text query (best match first, and only the top limit matches if limit is given)"""
+    if not SEARCH_BACKEND_CONFIG.USE_SEARCHING_BACKEND:
+        return []
+
+    backend = import_backend()
+    try:
+        if limit is None:
+            return SEARCH_CACHE.get_or_call(
+                (backend.name, 'search', query),
+                lambda: [str(pk) for pk in backend.search(query)],
+            )
+        return [hit.snapshot_id for hit in search_ranked_cached(backend, query, 0, limit)]
+    except Exception as err:
+        stderr()
+        stderr(
+                f'[X] The search backend threw an exception={err}:',
+            color='red',
+            )
+        raise
+
+@enforce_types
+def query_search_index(query: str, out_dir: Path=settings.DATA_DIR, limit: Optional[int]=None) -> QuerySet:
+    """get the Snapshots matching a full-text query, only the top limit matches in ranked order if limit is given"""
+    from core.models import Snapshot
+
+    snapshot_pks = query_search_pks(query, limit=limit)
+    qsearch = Snapshot.objects.filter(pk__in=snapshot_pks)
+    if limit is not None and snapshot_pks:
+        qsearch = qsearch.annotate(search_rank=search_rank(snapshot_pks)).order_by('search_rank')
+    return qsearch
+
+
+def search_ranked_cached(backend, query: str, start: int, stop: int) -> List[SearchHit]:
+    """
+    matches start..stop of a query, best match first. The backend is asked for whole windows of
+    SEARCH_RESULTS_LIMIT matches at a time, which are cached, so paging through results doesn't
+    re-run the same search for every page.
+    """
+    window = max(SEARCH_BACKEND_CONFIG.SEARCH_RESULTS_LIMIT, 1)
+    hits: List[SearchHit] = []
+    for window_start in range(start - start % window, stop, window):
+        hits += SEARCH_CACHE.get_or_call(
+            (backend.name, 'search_ranked', query, window, window_start),
+            lambda: backend.search_ranked(query, limit=window, offset=window_start),
+        )
+    first = start - start % window
+    return hits[start - first:stop - first]
+
+
+class SearchResults:
+    """
+    The Snapshots matching a full-text query, best match first.
+
+    Acts like a read-only sequence, only the slice that's accessed gets fetched from the search
+    backend and loaded from the db, so it can be handed to a Django Paginator, ListView or the API
+    pagination instead of a QuerySet without materializing every match.
+
+    If the snapshots passed in are filtered (e.g. by the API filters or the public index), the count
+    and pages only include the matches that pass the filters. That means checking every match against
+    them up front (one window of matches at a time), instead of only fetching the slice being accessed.
+
+    Each Snapshot in a slice has a .search_snippet with the matching text highlighted.
+    """
+
+    def __init__(self, query: str, snapshots: Optional[QuerySet]=None):
+        if snapshots is None:
+            from core.models import Snapshot
+            snapshots = Snapshot.objects.all()
+
+        self.query = query
+        self.snapshots = snapshots
+        self.backend = import_backend()
+        self._count: Optional[int] = None if SEARCH_BACKEND_CONFIG.USE_SEARCHING_BACKEND else 0
+        self._filtered_hits: Optional[List[SearchHit]] = None
+
+    @property
+    def is_filtered(self) -> bool:
+        return self.snapshots.query.has_filters()
+
+    def get_filtered_hits(self) -> List[SearchHit]:
+        """every match that's also in self.snapshots, best match first"""
+        if self._filtered_hits is None:
+            window = max(SEARCH_BACKEND_CONFIG.SEARCH_RESULTS_LIMIT, 1)
+            filtered_hits: List[SearchHit] = []
+            window_start = 0
+            while True:
+                hits = search_ranked_cached(self.backend, self.query, window_start, window_start + window)
+                allowed = {str(pk) for pk in self.snapshots.filter(pk__in=[hit.snapshot_id for hit in hits]).values_list('pk', flat=True)}
+                filtered_hits += [hit for hit in hits if hit.snapshot_id in allowed]
+                if len(hits) < window:
+                    break
+                window_start += window
+            self._filtered_hits = filtered_hits
+        return self._filtered_hits
+
+    def count(self) -> int:
+        if self._count is None:
+            if self.is_filtered:
+                self._count = len(self.get_filtered_hits())
+            else:
+                self._count = SEARCH_CACHE.get_or_call((self.backend.name, 'count', self.query), lambda: self.backend.count(self.query))
+        return self._count
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+
+        start, stop, step = key.indices(self.count())
+        assert step == 1, 'SearchResults does not support slicing with a step'
+        if stop <= start:
+            return []
+
+        if self.is_filtered:
+            hits = self.get_filtered_hits()[start:stop]
         else:
-            # TODO preserve ordering from backend
-            qsearch = Snapshot.objects.filter(pk__in=snapshot_pks)
-            return qsearch
-    
-    return Snapshot.objects.none()
+            hits = search_ranked_cached(self.backend, self.query, start, stop)
+        # matches for snapshots deleted since they were indexed are skipped, so a page may be short until they're flushed
+        snapshots = {str(snap.pk): snap for snap in self.snapshots.filter(pk__in=[hit.snapshot_id for hit in hits])}
+        results = []
+        for hit in hits:
+            snap = snapshots.get(hit.snapshot_id)
+            if snap:
+                snap.search_snippet = mark_safe(hit.snippet) if hit.snippet else get_search_snippet(snap, self.query)
+                results.append(snap)
+        return results
+
+    def __iter__(self):
+        for chunk_start in range(0, self.count(), 500):
+            yield from self[chunk_start:chunk_start + 500]
+
+
+SNIPPET_CONTEXT_CHARS = 80
+
+def get_search_snippet(snapshot, query: str) -> Optional[str]:
+    """find the first place the query terms appear in a snapshot's indexable content and return it with the terms highlighted in <mark>"""
+    from core.models import ArchiveResult
+
+    if not get_query_terms(query):
+        return None
+
+    try:
+        texts = get_indexable_content(ArchiveResult.objects.indexable().filter(snapshot=snapshot))
+    except Exception:
+        return None
+
+    for text in texts or ():
+        snippet = highlight_snippet(text, query)
+        if snippet:
+            return snippet
+    return None
+
+def get_query_terms(query: str) -> List[str]:
+    return [term for term in re.findall(r'\w+', query) if len(term) > 1]
+
+def highlight_snippet(text: str, query: str) -> Optional[str]:
+    """the text around the first match of any of the query terms (html tags removed and the rest escaped), with every term in it wrapped in <mark>"""
+    terms = get_query_terms(query)
+    if not terms:
+        return None
+
+    terms_re = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    text = re.sub(r'<[^>]*>', ' ', text)
+    match = terms_re.search(text)
+    if not match:
+        return None
+
+    start = max(match.start() - SNIPPET_CONTEXT_CHARS, 0)
+    excerpt = ' '.join(text[start:match.end() + SNIPPET_CONTEXT_CHARS].split())
+    highlighted, last_end = [], 0
+    for term_match in terms_re.finditer(excerpt):
+        highlighted.append(escape(excerpt[last_end:term_match.start()]))
+        highlighted.append(f'<mark>{escape(term_match.group(0))}</mark>')
+        last_end = term_match.end()
+    highlighted.append(escape(excerpt[last_end:]))
+    return mark_safe(('…' if start else '') + ''.join(highlighted) + '…')
+
 
 @enforce_types
 def flush_search_index(snapshots: QuerySet):
     if not SEARCH_BACKEND_CONFIG.USE_INDEXING_BACKEND or not snapshots:
         return
     backend = import_backend()
-    snapshot_pks = (str(pk) for pk in snapshots.values_list('pk', flat=True))
+    snapshot_pks = [str(pk) for pk in snapshots.values_list('pk', flat=True)]
     try:
         backend.flush(snapshot_pks)
+        bump_search_generation()
+        forget_indexed_hashes(snapshot_pks)
+        remove_from_queue(snapshot_pks)
     except Exception as err:
         stderr()
         stderr(
@@ -119,25 +313,85 @@ def flush_search_index(snapshots: QuerySet):
         color='red',
         )
 
+def iter_changed_texts(snapshots: List, backend, indexed_hashes: List[tuple], rebuild: bool=False) -> Iterator[Tuple[str, List[str]]]:
+    """
+    (snapshot_id, texts) for each of the snapshots whose indexable content changed since it was last indexed
+    (or all of them if rebuild=True), appending the (snapshot_id, content_hash) of every snapshot read to indexed_hashes
+    """
+    from core.models import ArchiveResult
+
+    known_hashes = {} if rebuild else get_indexed_hashes([str(snap.pk) for snap in snapshots], backend.name)
+    for snap in snapshots:
+        results = ArchiveResult.objects.indexable().filter(snapshot=snap)
+        try:
+            texts = get_indexable_content(results)
+        except Exception as err:
+            stderr()
+            stderr(
+                f'[X] An Exception ocurred reading the indexable content={err}:',
+                color='red',
+                ) 
+        else:
+            if not texts:
+                continue
+            digest = content_hash(texts)
+            # unchanged ones are recorded too, as up to date with their outputs as of now
+            indexed_hashes.append((str(snap.pk), digest))
+            if known_hashes.get(str(snap.pk)) == digest:
+                # unchanged since it was last indexed, skip it
+                continue
+            log_index_started(snap.url)
+            yield str(snap.pk), texts
+
 @enforce_types
-def index_links(links: Union[List[Link],None], out_dir: Path=settings.DATA_DIR):
-    if not links:
+def index_links(links: Union[List[Link],None], out_dir: Path=settings.DATA_DIR, rebuild: bool=False):
+    """
+    (re-)index the content of many links at once using the search backend's batched index_many()
+    if rebuild=True, existing entries are flushed first and the index is compacted afterwards
+    """
+    if not links or not SEARCH_BACKEND_CONFIG.USE_INDEXING_BACKEND:
         return
 
-    from core.models import Snapshot, ArchiveResult
-
-    for link in links:
-        snap = Snapshot.objects.filter(url=link.url).first()
-        if snap: 
-            results = ArchiveResult.objects.indexable().filter(snapshot=snap)
-            log_index_started(link.url)
-            try:
-                texts = get_indexable_content(results)
-            except Exception as err:
-                stderr()
-                stderr(
-                    f'[X] An Exception ocurred reading the indexable content={err}:',
-                    color='red',
-                    ) 
-            else:
-                write_search_index(link, texts, out_dir=out_dir)
+    from core.models import Snapshot
+
+    backend = import_backend()
+
+    def load_snapshots(chunk: List[Link]) -> dict:
+        snapshots = Snapshot.objects.filter(url__in=[link.url for link in chunk]).prefetch_related(None)
+        return {snap.url: snap for snap in snapshots}
+
+    indexed_hashes: List[tuple] = []
+    seen_pks: List[str] = []
+
+    def indexable_texts():
+        for chunk in chunked(links, 500):
+            snapshots = load_snapshots(chunk)
+            seen_pks.extend(str(snap.pk) for snap in snapshots.values())
+            yield from iter_changed_texts(
+                [snapshots[link.url] for link in chunk if link.url in snapshots],
+                backend,
+                indexed_hashes,
+                rebuild=rebuild,
+            )
+
+    started = time.time()
+    try:
+        if rebuild:
+            # clear the old entries first so snapshots that no longer have any indexable content don't linger
+            for chunk in chunked(links, 500):
+                snapshot_pks = [str(snap.pk) for snap in load_snapshots(chunk).values()]
+                backend.flush(snapshot_pks)
+                forget_indexed_hashes(snapshot_pks)
+        backend.index_many(indexable_texts())
+        bump_search_generation()
+        save_indexed_hashes(indexed_hashes, backend.name, indexed_at=started)
+        # anything that was waiting in the background indexing queue (or had failed to index there) is up to date now
+        remove_from_queue(seen_pks)
+        if rebuild:
+            backend.optimize()
+    except Exception as err:
+        stderr()
+        stderr(
+            f'[X] The search backend threw an exception={err}:',
+            color='red',
+        )
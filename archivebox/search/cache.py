@@ -0,0 +1,118 @@
+__package__ = 'archivebox.search'
+
+import os
+import time
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from archivebox.config import CONSTANTS, SEARCH_BACKEND_CONFIG
+
+
+# touched whenever any process writes to or flushes the search index, so every process's cache knows to drop stale results
+SEARCH_GENERATION_FILE = CONSTANTS.CACHE_DIR / 'search_generation'
+
+
+def get_search_generation() -> Optional[int]:
+    try:
+        return os.stat(SEARCH_GENERATION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+# set while a backend is answering a query if its answer is incomplete (e.g. one of several backends timed out)
+_partial_result = threading.local()
+
+def dont_cache_result() -> None:
+    """called by a backend while it's answering a query to keep its (incomplete) result out of the cache"""
+    _partial_result.flag = True
+
+def bump_search_generation() -> None:
+    previous, now = get_search_generation() or 0, time.time_ns()
+    SEARCH_GENERATION_FILE.parent.mkdir(parents=True, exist_ok=True)
+    SEARCH_GENERATION_FILE.touch()
+    # make sure the mtime changes even if the last bump was within the filesystem's timestamp resolution
+    os.utime(SEARCH_GENERATION_FILE, ns=(now, max(now, previous + 1)))
+
+
+class SearchCache:
+    """
+    Recently used search backend results, keyed by (backend, method, query, ...args).
+    Entries expire after ttl seconds, the least recently used ones are evicted past max_size,
+    and everything is dropped whenever the index changes (see bump_search_generation).
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.results: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self.generation: Optional[int] = None
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = 0
+
+    def _check_generation(self, generation: Optional[int]) -> None:
+        # called with self.lock held
+        if generation != self.generation:
+            if self.results:
+                self.invalidations += 1
+            self.results.clear()
+            self.generation = generation
+
+    def _get_fresh(self, key: Hashable, now: float) -> Optional[Tuple[float, Any]]:
+        # called with self.lock held
+        cached = self.results.get(key)
+        if cached and now - cached[0] < self.ttl:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return cached
+        return None
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        """the cached result for key if there is one, without computing it on a miss"""
+        if self.max_size <= 0:
+            return default
+
+        now = time.monotonic()
+        generation = get_search_generation()
+        with self.lock:
+            self._check_generation(generation)
+            cached = self._get_fresh(key, now)
+        return cached[1] if cached else default
+
+    def get_or_call(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        if self.max_size <= 0:
+            return func()
+
+        now = time.monotonic()
+        generation = get_search_generation()
+        with self.lock:
+            self._check_generation(generation)
+            cached = self._get_fresh(key, now)
+            if cached:
+                return cached[1]
+            self.misses += 1
+
+        _partial_result.flag = False
+        result = func()
+
+        with self.lock:
+            if generation == self.generation and not _partial_result.flag:
+                self.results[key] = (now, result)
+                self.results.move_to_end(key)
+                while len(self.results) > self.max_size:
+                    self.results.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.results),
+                'max_size': self.max_size,
+                'invalidations': self.invalidations,
+            }
+
+SEARCH_CACHE = SearchCache(max_size=SEARCH_BACKEND_CONFIG.SEARCH_CACHE_SIZE, ttl=SEARCH_BACKEND_CONFIG.SEARCH_CACHE_TTL)
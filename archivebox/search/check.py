@@ -0,0 +1,159 @@
+__package__ = 'archivebox.search'
+
+import os
+import time
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from django.db.models import QuerySet
+
+from archivebox.config import SEARCH_BACKEND_CONFIG
+from archivebox.misc.util import chunked
+
+from .text import TEXT_FOLDER_EXTRACTORS, get_indexable_text, get_indexed_times, content_hash, save_indexed_hashes, forget_indexed_hashes
+from .indexing import remove_from_queue
+from .cache import bump_search_generation
+
+
+class IndexCheck(NamedTuple):
+    checked: int                # snapshots compared with the search index
+    missing: List[str]          # have indexable outputs but aren't in the search index
+    stale: List[str]            # an indexable output was modified after the snapshot was last indexed
+    orphaned: List[str]         # in the search index, but deleted from the main index or without any indexable outputs left
+    unverified: int             # in the search index with no record of when, so they can't be checked for staleness
+    seconds: float
+
+
+def get_mtime(path: Path) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def compare_index(snapshot_outputs: Dict[str, List[Path]],
+                  indexed_ids: Set[str],
+                  indexed_times: Dict[str, Optional[float]],
+                  known_ids: Set[str],
+                  workers: int=4) -> IndexCheck:
+    """
+    compare the snapshots being checked ({snapshot_id: [paths of its indexable text outputs]}) with what's in the search
+    index, only stat()ing the output files (in parallel) to spot the ones modified since they were indexed, never reading them
+    """
+    start = time.monotonic()
+    all_paths = [path for paths in snapshot_outputs.values() for path in paths]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        mtimes = dict(zip(all_paths, executor.map(get_mtime, all_paths, chunksize=256)))
+
+    missing, stale, orphaned, unverified = [], [], [], 0
+    for snapshot_id, paths in snapshot_outputs.items():
+        output_mtimes = [mtimes[path] for path in paths if mtimes[path] is not None]
+        if snapshot_id not in indexed_ids:
+            if output_mtimes:
+                missing.append(snapshot_id)
+        elif not output_mtimes:
+            orphaned.append(snapshot_id)
+        elif indexed_times.get(snapshot_id) is None:
+            unverified += 1
+        elif max(output_mtimes) > indexed_times[snapshot_id]:
+            stale.append(snapshot_id)
+
+    orphaned += sorted(indexed_ids - known_ids)
+    return IndexCheck(
+        checked=len(snapshot_outputs),
+        missing=missing,
+        stale=stale,
+        orphaned=orphaned,
+        unverified=unverified,
+        seconds=time.monotonic() - start,
+    )
+
+
+def check_search_index(snapshots: QuerySet, workers: Optional[int]=None) -> IndexCheck:
+    """find the snapshots that are missing from the search index, stale in it, or shouldn't be in it anymore"""
+    from core.models import Snapshot, ArchiveResult
+    from . import import_backend
+
+    backend = import_backend()
+    indexed_times = get_indexed_times(backend.name)
+    indexed_ids = backend.list_ids()
+    if indexed_ids is None:
+        # the backend can't list what's in it, trust the record of what was sent to it instead
+        indexed_ids = set(indexed_times)
+
+    snapshot_outputs: Dict[str, List[Path]] = {str(pk): [] for pk in snapshots.values_list('pk', flat=True).iterator(chunk_size=2000)}
+    results = ArchiveResult.objects.indexable(sorted=False).filter(snapshot__in=snapshots)
+    for snapshot_id, extractor, pwd, output in results.values_list('snapshot_id', 'extractor', 'pwd', 'output').iterator(chunk_size=2000):
+        if output:
+            # like get_output_text_path(), but without checking the file exists, compare_index() does that in parallel
+            path = Path(pwd) / output
+            snapshot_outputs.setdefault(str(snapshot_id), []).append(path / 'content.txt' if extractor in TEXT_FOLDER_EXTRACTORS else path)
+
+    known_ids = {str(pk) for pk in Snapshot.objects.values_list('pk', flat=True).iterator(chunk_size=2000)}
+    return compare_index(
+        snapshot_outputs,
+        indexed_ids,
+        indexed_times,
+        known_ids,
+        workers=workers or SEARCH_BACKEND_CONFIG.SEARCH_INDEX_WORKERS,
+    )
+
+
+def iter_read_texts(snapshot_ids: List[str], workers: int) -> Iterable[Tuple[str, str, float]]:
+    """(snapshot_id, text, when it was read) for each snapshot with indexable content, the output files are read by several threads at once"""
+    from core.models import ArchiveResult
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # read a little ahead of the backend, but never hold more than that in memory
+        for chunk in chunked(snapshot_ids, workers * 4):
+            # query the db here (once per chunk), the threads only touch the filesystem
+            results: Dict[str, list] = {snapshot_id: [] for snapshot_id in chunk}
+            for result in ArchiveResult.objects.indexable().filter(snapshot_id__in=chunk):
+                results[str(result.snapshot_id)].append(result)
+            read_at = time.time()
+            for snapshot_id, text in zip(chunk, executor.map(get_indexable_text, results.values())):
+                if text:
+                    yield snapshot_id, text, read_at
+
+
+def repair_search_index(check: IndexCheck, workers: Optional[int]=None) -> int:
+    """
+    bring the search index up to date with the differences found by check_search_index(): reindex only the
+    missing and stale snapshots and remove the orphaned ones, printing progress and throughput along the way
+    """
+    from . import import_backend
+
+    backend = import_backend()
+    workers = workers or SEARCH_BACKEND_CONFIG.SEARCH_INDEX_WORKERS
+
+    if check.orphaned:
+        backend.flush(check.orphaned)
+        forget_indexed_hashes(check.orphaned)
+        remove_from_queue(check.orphaned)
+        bump_search_generation()
+        print(f'    √ Removed {len(check.orphaned)} orphaned snapshots from the search index')
+
+    to_index = [*check.missing, *check.stale]
+    if not to_index:
+        return 0
+
+    start, num_indexed, chars_read = time.monotonic(), 0, 0
+    batch_size = SEARCH_BACKEND_CONFIG.SEARCH_INDEX_BATCH_SIZE
+    for batch in chunked(iter_read_texts(to_index, workers), batch_size):
+        backend.index_many((snapshot_id, [text]) for snapshot_id, text, _read_at in batch)
+        save_indexed_hashes(
+            [(snapshot_id, content_hash([text])) for snapshot_id, text, _read_at in batch],
+            backend.name,
+            indexed_at=min(read_at for _snapshot_id, _text, read_at in batch),
+        )
+        bump_search_generation()
+
+        num_indexed += len(batch)
+        chars_read += sum(len(text) for _snapshot_id, text, _read_at in batch)
+        elapsed = max(time.monotonic() - start, 0.001)
+        print(f'    > {num_indexed}/{len(to_index)} snapshots reindexed ({num_indexed / elapsed:.1f} snapshots/sec, {chars_read / elapsed / 1_000_000:.1f}M chars/sec)')
+
+    remove_from_queue(to_index)
+    return num_indexed
@@ -0,0 +1,158 @@
+__package__ = 'archivebox.search'
+
+import time
+import sqlite3
+
+from typing import Any, Dict, Iterable, Optional
+
+from archivebox.config import CONSTANTS, SEARCH_BACKEND_CONFIG
+from archivebox.misc.util import chunked
+
+
+# sidecar db of the snapshots waiting to be (re-)indexed by the search_indexing background queue
+SEARCH_QUEUE_DB = CONSTANTS.CACHE_DIR / 'search_queue.sqlite3'
+
+# seconds a claimed batch is leased to the worker indexing it, before it's handed out again (e.g. if the worker died)
+CLAIM_TIMEOUT = 30 * 60
+
+
+def get_search_queue_db() -> sqlite3.Connection:
+    SEARCH_QUEUE_DB.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(SEARCH_QUEUE_DB, timeout=30)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pending_index (
+            snapshot_id TEXT PRIMARY KEY,
+            queued_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            retry_at REAL NOT NULL DEFAULT 0,
+            claimed_until REAL NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+    ''')
+    return db
+
+
+def queue_snapshots(snapshot_ids: Iterable[str], now: Optional[float]=None) -> bool:
+    """
+    add snapshots to the queue, a snapshot that's already waiting stays in the queue only once
+    (so all the outputs that changed since it was last indexed get indexed in one go), but is
+    marked as updated so a batch that's already indexing it will index it again afterwards.
+    returns True if nothing else was due to be indexed before, i.e. no batch is already going to index them
+    (snapshots waiting to be retried later don't count, nothing is scheduled to pick those up before then).
+    """
+    now = time.time() if now is None else now
+    db = get_search_queue_db()
+    try:
+        with db:
+            was_empty = db.execute(
+                'SELECT 1 FROM pending_index WHERE attempts < ? AND retry_at <= ? LIMIT 1',
+                [SEARCH_BACKEND_CONFIG.SEARCH_INDEX_RETRIES + 1, now],
+            ).fetchone() is None
+            db.executemany('''
+                INSERT INTO pending_index (snapshot_id, queued_at, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (snapshot_id) DO UPDATE SET updated_at = excluded.updated_at, attempts = 0, retry_at = 0
+            ''', [(str(snapshot_id), now, now) for snapshot_id in snapshot_ids])
+        return was_empty
+    finally:
+        db.close()
+
+
+def claim_batch(limit: int, now: Optional[float]=None) -> Dict[str, float]:
+    """
+    lease the next limit snapshots due to be indexed, oldest first, and return them as {snapshot_id: updated_at}.
+    other workers skip them until they're marked indexed/failed, or until the lease runs out after CLAIM_TIMEOUT.
+    """
+    now = time.time() if now is None else now
+    db = get_search_queue_db()
+    try:
+        with db:
+            return dict(db.execute(
+                '''
+                UPDATE pending_index SET claimed_until = ?
+                WHERE snapshot_id IN (
+                    SELECT snapshot_id FROM pending_index
+                    WHERE attempts < ? AND retry_at <= ? AND claimed_until <= ?
+                    ORDER BY queued_at LIMIT ?
+                )
+                RETURNING snapshot_id, updated_at
+                ''',
+                [now + CLAIM_TIMEOUT, SEARCH_BACKEND_CONFIG.SEARCH_INDEX_RETRIES + 1, now, now, limit],
+            ).fetchall())
+    finally:
+        db.close()
+
+
+def mark_indexed(claimed: Dict[str, float]) -> None:
+    """
+    remove a claimed batch from the queue, except the snapshots that were queued again while it was being indexed,
+    which are released to be claimed by the next batch
+    """
+    db = get_search_queue_db()
+    try:
+        with db:
+            for chunk in chunked(claimed.items(), 500):
+                db.executemany('DELETE FROM pending_index WHERE snapshot_id = ? AND updated_at = ?', chunk)
+                db.executemany('UPDATE pending_index SET claimed_until = 0 WHERE snapshot_id = ?', [(snapshot_id,) for snapshot_id, _ in chunk])
+    finally:
+        db.close()
+
+
+def remove_from_queue(snapshot_ids: Iterable[str]) -> None:
+    """stop waiting to index snapshots that were (re-)indexed or flushed some other way"""
+    db = get_search_queue_db()
+    try:
+        with db:
+            db.executemany('DELETE FROM pending_index WHERE snapshot_id = ?', [(str(snapshot_id),) for snapshot_id in snapshot_ids])
+    finally:
+        db.close()
+
+
+def mark_failed(claimed: Dict[str, float], error: str, now: Optional[float]=None) -> None:
+    """leave a claimed batch in the queue to be retried later, backing off exponentially after each failed attempt"""
+    now = time.time() if now is None else now
+    db = get_search_queue_db()
+    try:
+        with db:
+            db.executemany(
+                '''
+                UPDATE pending_index
+                SET attempts = attempts + 1, retry_at = ? + ? * (1 << attempts), last_error = ?
+                WHERE snapshot_id = ? AND updated_at = ?
+                ''',
+                [
+                    (now, SEARCH_BACKEND_CONFIG.SEARCH_INDEX_RETRY_DELAY, error[:1000], snapshot_id, updated_at)
+                    for snapshot_id, updated_at in claimed.items()
+                ],
+            )
+            db.executemany('UPDATE pending_index SET claimed_until = 0 WHERE snapshot_id = ?', [(snapshot_id,) for snapshot_id in claimed])
+    finally:
+        db.close()
+
+
+def get_indexing_lag(now: Optional[float]=None) -> Dict[str, Any]:
+    """
+    how far behind the search index is: how many snapshots are waiting to be indexed,
+    how many gave up after too many failed attempts, and how long the oldest one has been waiting
+    """
+    now = time.time() if now is None else now
+    db = get_search_queue_db()
+    try:
+        max_attempts = SEARCH_BACKEND_CONFIG.SEARCH_INDEX_RETRIES + 1
+        pending, oldest = db.execute(
+            'SELECT COUNT(*), MIN(queued_at) FROM pending_index WHERE attempts < ?', [max_attempts],
+        ).fetchone()
+        failed, = db.execute('SELECT COUNT(*) FROM pending_index WHERE attempts >= ?', [max_attempts]).fetchone()
+        last_error = db.execute(
+            'SELECT last_error FROM pending_index WHERE last_error IS NOT NULL ORDER BY retry_at DESC LIMIT 1',
+        ).fetchone()
+        return {
+            'pending': pending,
+            'failed': failed,
+            'oldest_queued_at': oldest,
+            'lag': max(now - oldest, 0.0) if oldest is not None else 0.0,
+            'last_error': last_error[0] if last_error else None,
+        }
+    finally:
+        db.close()
+
@@ -0,0 +1,223 @@
+__package__ = 'archivebox.search'
+
+import re
+import time
+import sqlite3
+
+from pathlib import Path
+from hashlib import sha256
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from archivebox.config import CONSTANTS, SEARCH_BACKEND_CONFIG
+from archivebox.misc.util import chunked
+
+
+# sidecar db that remembers a hash of the text last sent to the search backend for each snapshot
+SEARCH_HASHES_DB = CONSTANTS.CACHE_DIR / 'search_hashes.sqlite3'
+
+# outputs are read and converted to text this many characters at a time instead of all at once
+TEXT_CHUNK_SIZE = 64 * 1024
+
+# outputs that are html documents, the rest are already plain text
+HTML_EXTRACTORS = ('singlefile', 'dom', 'wget')
+
+# extractors that output a folder with the extracted text inside, the rest output a single file
+TEXT_FOLDER_EXTRACTORS = ('readability', 'mercury')
+
+DATA_URI_START_RE = re.compile(r'data:[\w.+-]+/[\w.+-]+(?:;[\w.+-]+=[\w.+-]+)*;base64,', re.IGNORECASE)
+BASE64_RUN_RE = re.compile(r'[A-Za-z0-9+/=]*')
+
+# longest 'data:<mimetype>;<params>;base64,' prefix that could be split across two chunks
+MAX_DATA_URI_PREFIX = 256
+
+
+class DataURIStripper:
+    """
+    Removes base64 data: URIs (inline images, fonts, etc.) from text fed in one chunk at a time,
+    without ever holding a whole URI in memory, even if it's split across many chunks.
+    """
+
+    def __init__(self):
+        self.in_payload = False
+        self.tail = ''
+
+    def feed(self, chunk: str) -> str:
+        text, self.tail = self.tail + chunk, ''
+        output, pos = [], 0
+        while True:
+            if self.in_payload:
+                pos = BASE64_RUN_RE.match(text, pos).end()
+                if pos == len(text):
+                    return ''.join(output)
+                self.in_payload = False
+                output.append(' ')
+
+            match = DATA_URI_START_RE.search(text, pos)
+            if not match:
+                # hold back the end of the chunk in case it's the start of a data URI that continues in the next one
+                cut = text.rfind('data:', max(pos, len(text) - MAX_DATA_URI_PREFIX))
+                if cut == -1:
+                    cut = max(pos, len(text) - len('data:'))
+                output.append(text[pos:cut])
+                self.tail = text[cut:]
+                return ''.join(output)
+
+            output.append(text[pos:match.start()])
+            pos = match.end()
+            self.in_payload = True
+
+    def close(self) -> str:
+        tail, self.tail = ('' if self.in_payload else self.tail), ''
+        return tail
+
+
+def strip_data_uris(text: str) -> str:
+    stripper = DataURIStripper()
+    return stripper.feed(text) + stripper.close()
+
+
+def iter_output_text(path: Path, is_html: bool) -> Iterator[str]:
+    """stream the text content of an output file one chunk at a time, with data: URIs removed and html converted to text"""
+    from ..extractors.htmltotext import HTMLTextExtractor
+
+    stripper = DataURIStripper()
+    parser = HTMLTextExtractor() if (is_html and SEARCH_BACKEND_CONFIG.SEARCH_PROCESS_HTML) else None
+
+    def to_text(chunk: str) -> str:
+        if parser is None:
+            return chunk
+        parser.feed(chunk)
+        return parser.take_output()
+
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            chunk = f.read(TEXT_CHUNK_SIZE)
+            if not chunk:
+                break
+            text = to_text(stripper.feed(chunk))
+            if text:
+                yield text
+
+    text = to_text(stripper.close())
+    if parser is not None:
+        parser.close()
+        text += parser.take_output()
+    if text:
+        yield text
+
+
+def read_capped(chunks: Iterable[str], max_chars: int) -> str:
+    """join streamed chunks of text, stopping as soon as max_chars have been read"""
+    output, length = [], 0
+    for chunk in chunks:
+        output.append(chunk[:max_chars - length])
+        length += len(output[-1])
+        if length >= max_chars:
+            break
+    return ''.join(output)
+
+
+def get_output_text_path(extractor: str, pwd: str, output: str) -> Optional[Path]:
+    if not output:
+        return None
+    path = Path(pwd) / output
+    if extractor in TEXT_FOLDER_EXTRACTORS:
+        path = path / 'content.txt'
+    return path if path.is_file() else None
+
+
+def get_indexable_text(results: Iterable, max_chars: Optional[int]=None) -> Optional[str]:
+    """
+    the normalized text of the best available output, given indexable ArchiveResults sorted in order of
+    indexing precedence, falls back to the next output if one is missing or has no text in it
+    """
+    max_chars = SEARCH_BACKEND_CONFIG.SEARCH_MAX_TEXT_LENGTH if max_chars is None else max_chars
+    for result in results:
+        path = get_output_text_path(result.extractor, result.pwd, result.output)
+        if not path:
+            continue
+        text = read_capped(iter_output_text(path, is_html=result.extractor in HTML_EXTRACTORS), max_chars)
+        if text.strip():
+            return text
+    return None
+
+
+def normalize_texts(texts: Iterable[str], max_chars: Optional[int]=None) -> List[str]:
+    """strip data: URIs from texts produced directly by an extractor, and cap their total length"""
+    max_chars = SEARCH_BACKEND_CONFIG.SEARCH_MAX_TEXT_LENGTH if max_chars is None else max_chars
+    normalized, length = [], 0
+    for text in texts:
+        text = strip_data_uris(text)[:max_chars - length]
+        if text.strip():
+            normalized.append(text)
+            length += len(text)
+        if length >= max_chars:
+            break
+    return normalized
+
+
+def content_hash(texts: Iterable[str]) -> str:
+    digest = sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8', errors='replace'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+### Hashes of the text last indexed for each snapshot
+
+def get_search_hashes_db() -> sqlite3.Connection:
+    SEARCH_HASHES_DB.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(SEARCH_HASHES_DB, timeout=30)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS search_hashes (
+            snapshot_id TEXT NOT NULL,
+            backend TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            indexed_at REAL,
+            PRIMARY KEY (snapshot_id, backend)
+        )
+    ''')
+    return db
+
+def get_indexed_hashes(snapshot_ids: Iterable[str], backend: str) -> Dict[str, str]:
+    db = get_search_hashes_db()
+    try:
+        hashes = {}
+        for chunk in chunked(snapshot_ids, 500):
+            hashes.update(db.execute(
+                f'SELECT snapshot_id, content_hash FROM search_hashes WHERE backend = ? AND snapshot_id IN ({", ".join("?" * len(chunk))})',
+                [backend, *chunk],
+            ))
+        return hashes
+    finally:
+        db.close()
+
+def get_indexed_times(backend: str) -> Dict[str, Optional[float]]:
+    """{snapshot_id: when it was last indexed} for every snapshot indexed by the backend (None if that wasn't recorded)"""
+    db = get_search_hashes_db()
+    try:
+        return dict(db.execute('SELECT snapshot_id, indexed_at FROM search_hashes WHERE backend = ?', [backend]))
+    finally:
+        db.close()
+
+def save_indexed_hashes(hashes: Iterable[Tuple[str, str]], backend: str, indexed_at: Optional[float]=None) -> None:
+    """remember the hash of the text indexed for each snapshot, and when (pass the time the text was read, to catch outputs modified since)"""
+    db = get_search_hashes_db()
+    try:
+        with db:
+            now = time.time() if indexed_at is None else indexed_at
+            db.executemany(
+                'INSERT OR REPLACE INTO search_hashes (snapshot_id, backend, content_hash, indexed_at) VALUES (?, ?, ?, ?)',
+                [(snapshot_id, backend, digest, now) for snapshot_id, digest in hashes],
+            )
+    finally:
+        db.close()
+
+def forget_indexed_hashes(snapshot_ids: Iterable[str]) -> None:
+    db = get_search_hashes_db()
+    try:
+        with db:
+            db.executemany('DELETE FROM search_hashes WHERE snapshot_id = ?', [(snapshot_id,) for snapshot_id in snapshot_ids])
+    finally:
+        db.close()
@@ -0,0 +1,116 @@
+"""
+Compare per-folder .exists() queries against in-memory timestamp/url sets for init and status folder checks.
+
+Usage:
+    python -m tests.benchmarks.bench_folder_status [--folders 500000]
+
+Creates a throwaway collection in a temp dir with --folders synthetic archive/ folders (90% indexed,
+5% orphaned with a valid index.json, 5% unrecognized empty folders), then times the orphan checks that
+archivebox init runs and the invalid folder checks that archivebox status runs, before and after.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+from pathlib import Path
+
+
+BASE_TS = 1_600_000_000
+
+
+def make_archive(data_dir: Path, num_folders: int):
+    from archivebox.index.schema import Link
+    from archivebox.index.sql import write_sql_main_index
+    from abid_utils.models import get_or_create_system_user_pk
+
+    indexed_links = []
+    for i in range(num_folders):
+        folder = data_dir / 'archive' / str(BASE_TS + i)
+        folder.mkdir(parents=True)
+        if i % 20 == 19:
+            continue                        # unrecognized: empty folder that isn't in the main index
+        link = Link(timestamp=str(BASE_TS + i), url=f'https://example.com/{i}', title=None, tags=None, sources=['bench'])
+        (folder / 'index.json').write_text(link.to_json())
+        if i % 20 != 18:
+            indexed_links.append(link)      # the rest are orphaned: valid index.json but not in the main index
+
+    write_sql_main_index(indexed_links, created_by_id=get_or_create_system_user_pk())
+
+
+def legacy_init_orphans(all_links, out_dir):
+    from archivebox.index.json import parse_json_links_details
+    return {
+        link.url: link
+        for link in parse_json_links_details(out_dir)
+        if not all_links.filter(url=link.url).exists()
+    }
+
+def init_orphans(all_links, out_dir):
+    from archivebox.index import indexed_values
+    from archivebox.index.json import parse_json_links_details
+    indexed_urls = indexed_values(all_links, 'url')
+    return {
+        link.url: link
+        for link in parse_json_links_details(out_dir)
+        if link.url not in indexed_urls
+    }
+
+def legacy_status_invalid(snapshots, out_dir):
+    """the per-folder .exists() lookups that get_orphaned_folders/get_unrecognized_folders/get_duplicate_folders used to do"""
+    folders = [entry for entry in (out_dir / 'archive').iterdir() if entry.is_dir()]
+    return [
+        [entry for entry in folders if not snapshots.filter(timestamp=entry.name).exists()]
+        for _check in ('orphaned', 'unrecognized', 'duplicate')
+    ]
+
+def status_invalid(snapshots, out_dir):
+    from archivebox.index import get_orphaned_folders, get_unrecognized_folders, get_duplicate_folders
+    return [get_orphaned_folders(snapshots, out_dir), get_unrecognized_folders(snapshots, out_dir), get_duplicate_folders(snapshots, out_dir)]
+
+def status_classified(snapshots, out_dir):
+    from archivebox.index.scan import classify_folders
+    return classify_folders(snapshots, out_dir=out_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--folders', type=int, default=500_000, help='number of synthetic archive/ folders to create')
+    args = parser.parse_args()
+
+    data_dir = Path(tempfile.mkdtemp(prefix='archivebox_bench_'))
+    subprocess.run([sys.executable, '-m', 'archivebox', 'init', '--quick'], cwd=data_dir, check=True, capture_output=True)
+    os.chdir(data_dir)
+
+    from archivebox.config.legacy import setup_django
+    setup_django(check_db=True)
+
+    from core.models import Snapshot
+
+    print(f'Creating {args.folders} archive folders in {data_dir}...')
+    start = time.monotonic()
+    make_archive(data_dir, args.folders)
+    print(f'    done in {time.monotonic() - start:.1f}s')
+    print()
+
+    snapshots = Snapshot.objects.all()
+    runs = (
+        ('init: orphan check (per-link .exists())', legacy_init_orphans),
+        ('init: orphan check (url set)', init_orphans),
+        ('status: folder lookups (per-folder .exists())', legacy_status_invalid),
+        ('status: orphaned+unrecognized+duplicate (timestamp set)', status_invalid),
+        ('status: classify_folders (cold cache)', status_classified),
+        ('status: classify_folders (warm cache)', status_classified),
+    )
+    for name, func in runs:
+        start = time.monotonic()
+        func(snapshots, data_dir)
+        elapsed = time.monotonic() - start
+        print(f'    {name:<58} {elapsed:8.2f}s   {args.folders / elapsed:10.1f} folders/sec')
+
+
+if __name__ == '__main__':
+    main()
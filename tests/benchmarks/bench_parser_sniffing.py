@@ -0,0 +1,80 @@
+"""
+Compare format detection by sniffing against the old approach of running every parser over the whole input.
+
+Usage:
+    python -m tests.benchmarks.bench_parser_sniffing [--entries 20000]
+
+Runs both over every file in tests/parser_corpus/, plus large generated Netscape, JSONL and
+plain text exports with --entries links each, and prints which parser each picked and how long it took.
+"""
+
+import time
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from archivebox.parsers import PARSERS, run_parser_functions
+
+
+CORPUS_DIR = Path(__file__).parent.parent / 'parser_corpus'
+
+API_CORPUS_FILES = ('pocket_api.txt', 'readwise_reader_api.txt')
+
+GENERATED_FORMATS = {
+    'netscape_huge.html': '<DT><A HREF="https://example.com/{i}" ADD_DATE="{ts}">Example page {i}</A>\n',
+    'jsonl_huge.jsonl': '{{"url": "https://example.com/{i}", "title": "Example page {i}", "tags": "bench"}}\n',
+    'txt_huge.txt': 'see https://example.com/{i} for page {i}\n',
+}
+
+
+class NoTimer:
+    def end(self):
+        pass
+
+
+def try_every_parser(to_parse, root_url=None):
+    """the old auto-detection: run every parser over the whole input and keep the one with the most links"""
+    most_links, best_parser_name = [], None
+    for parser_name, parser_func in PARSERS.values():
+        try:
+            parsed_links = list(parser_func(to_parse, root_url=root_url))
+        except Exception:
+            continue
+        if len(parsed_links) > len(most_links):
+            most_links, best_parser_name = parsed_links, parser_name
+    return most_links, best_parser_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--entries', type=int, default=20_000, help='number of links in each generated export')
+    args = parser.parse_args()
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix='archivebox_bench_'))
+    paths = [path for path in sorted(CORPUS_DIR.iterdir()) if path.name not in API_CORPUS_FILES]
+    for filename, line in GENERATED_FORMATS.items():
+        path = tmp_dir / filename
+        path.write_text(''.join(line.format(i=i, ts=1_600_000_000 + i) for i in range(args.entries)))
+        paths.append(path)
+
+    totals = {'try every parser': 0.0, 'sniffed': 0.0}
+    print(f'{"input":<28} {"try every parser":>30} {"sniffed":>30}')
+    for path in paths:
+        row = []
+        for name, parse_func in (('try every parser', try_every_parser), ('sniffed', lambda f: run_parser_functions(f, NoTimer()))):
+            with open(path, 'r', encoding='utf-8') as f:
+                start = time.monotonic()
+                links, parser_name = parse_func(f)
+                elapsed = time.monotonic() - start
+            totals[name] += elapsed
+            row.append(f'{parser_name} ({len(links)}) {elapsed * 1000:8.1f}ms')
+        print(f'{path.name:<28} {row[0]:>30} {row[1]:>30}')
+
+    print()
+    for name, elapsed in totals.items():
+        print(f'    {name:<20} {elapsed:8.2f}s total')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Compare indexing and query speed of the full-text search backends on the same synthetic collection.
+
+Usage:
+    python -m tests.benchmarks.bench_search_backends [--snapshots 20000] [--words 2000] [--backends invindex,sqlite,ripgrep,sonic]
+
+Creates a throwaway collection in a temp dir with --snapshots snapshots of --words words each (drawn from a
+Zipf-like vocabulary so there are a few very common words and a long tail of rare ones), writes each one's text
+into its archive/ folder for ripgrep, then times index_many() and a mix of term, multi-term, prefix and phrase
+queries against each backend. Backends that can't run here (no rg binary, no sonic server, sqlite < 3.43) are skipped.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+from pathlib import Path
+
+
+BASE_TS = 1_600_000_000
+VOCABULARY_SIZE = 50_000
+
+QUERIES = {
+    'common term':  'w1',
+    'rare term':    'w20000',
+    'two terms':    'w3 w500',
+    'prefix':       'w12*',
+    'phrase':       '"w1 w2"',
+}
+
+
+def make_documents(num_snapshots: int, num_words: int, seed: int=0):
+    rng = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(1, VOCABULARY_SIZE + 1)]
+    weights = [1 / i for i in range(1, VOCABULARY_SIZE + 1)]
+    for i in range(num_snapshots):
+        yield str(BASE_TS + i), ' '.join(rng.choices(vocabulary, weights=weights, k=num_words))
+
+
+def make_archive(data_dir: Path, documents):
+    from archivebox.index.schema import Link
+    from archivebox.index.sql import write_sql_main_index
+    from abid_utils.models import get_or_create_system_user_pk
+
+    links = []
+    for timestamp, text in documents.items():
+        folder = data_dir / 'archive' / timestamp
+        folder.mkdir(parents=True)
+        (folder / 'htmltotext.txt').write_text(text)
+        links.append(Link(timestamp=timestamp, url=f'https://example.com/{timestamp}', title=None, tags=None, sources=['bench']))
+
+    write_sql_main_index(links, created_by_id=get_or_create_system_user_pk())
+
+
+def is_available(backend) -> bool:
+    if backend.name == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 43, 0)
+    if backend.name == 'ripgrep':
+        from plugins_search.ripgrep.apps import RIPGREP_BINARY
+        return bool(RIPGREP_BINARY.load().version)
+    if backend.name == 'sonic':
+        try:
+            backend.count('w1')
+        except Exception:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--snapshots', type=int, default=20_000, help='number of synthetic snapshots to index')
+    parser.add_argument('--words', type=int, default=2_000, help='number of words in each snapshot')
+    parser.add_argument('--backends', type=str, default='invindex,sqlite,ripgrep,sonic', help='comma-separated backends to compare')
+    args = parser.parse_args()
+
+    data_dir = Path(tempfile.mkdtemp(prefix='archivebox_bench_'))
+    subprocess.run([sys.executable, '-m', 'archivebox', 'init', '--quick'], cwd=data_dir, check=True, capture_output=True)
+    os.chdir(data_dir)
+
+    from archivebox.config.legacy import setup_django
+    setup_django(check_db=True)
+
+    import abx.archivebox.use
+    from core.models import Snapshot
+
+    print(f'Creating {args.snapshots} snapshots of {args.words} words in {data_dir}...')
+    start = time.monotonic()
+    documents = dict(make_documents(args.snapshots, args.words))
+    make_archive(data_dir, documents)
+    snapshot_ids = dict(Snapshot.objects.values_list('timestamp', 'pk'))
+    print(f'    done in {time.monotonic() - start:.1f}s')
+    print()
+
+    backends = {backend.name: backend for backend in abx.archivebox.use.get_SEARCHBACKENDS().values()}
+    for name in args.backends.split(','):
+        backend = backends.get(name)
+        if backend is None or not is_available(backend):
+            print(f'{name}: not available here, skipping')
+            print()
+            continue
+
+        print(f'{name}:')
+        start = time.monotonic()
+        backend.index_many((str(snapshot_ids[timestamp]), [text]) for timestamp, text in documents.items())
+        elapsed = time.monotonic() - start
+        print(f'    {"index_many":<16} {elapsed:8.2f}s   {args.snapshots / elapsed:10.1f} snapshots/sec')
+
+        start = time.monotonic()
+        backend.optimize()
+        print(f'    {"optimize":<16} {time.monotonic() - start:8.2f}s')
+
+        for query_name, query in QUERIES.items():
+            start = time.monotonic()
+            total = backend.count(query)
+            hits = backend.search_ranked(query, limit=50)
+            elapsed = time.monotonic() - start
+            print(f'    {query_name:<16} {elapsed * 1000:8.1f}ms   {total:8} matches ({len(hits)} ranked) for {query}')
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Compare the throughput and server CPU cost of the ways serve_static_with_byterange_support can send archived files.
+
+Usage:
+    python -m tests.benchmarks.bench_serve_static [--size-mb 512] [--requests 5] [--range-mb 64]
+
+Creates a throwaway collection in a temp dir with one snapshot holding a --size-mb file, serves it through the real
+/archive/ view from a local WSGI server, and downloads it --requests times (plus the same number of --range-mb Range
+requests from the middle of it) with SERVE_STATIC_MODE set to:
+    stream          the python generator (8 KB reads)
+    sendfile        FileResponse, read in 1 MB blocks by a server without a sendfile() wsgi.file_wrapper (e.g. daphne)
+    sendfile+os     FileResponse, sent with os.sendfile() by a server that has one (like gunicorn)
+    x-accel         only the X-Accel-Redirect response, the bytes would be sent by nginx
+The client runs in a separate process, so the CPU time reported is only the server's.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from pathlib import Path
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler, make_server
+
+
+TIMESTAMP = '1600000000'
+
+CLIENT = '''
+import sys, http.client
+host, port, path, count, range_header = sys.argv[1], int(sys.argv[2]), sys.argv[3], int(sys.argv[4]), sys.argv[5]
+total = 0
+for _ in range(count):
+    conn = http.client.HTTPConnection(host, port)
+    conn.request('GET', path, headers={'Range': range_header} if range_header else {})
+    response = conn.getresponse()
+    while True:
+        chunk = response.read(1024 * 1024)
+        if not chunk:
+            break
+        total += len(chunk)
+    conn.close()
+print(total)
+'''
+
+
+class SendfileServerHandler(ServerHandler):
+    """wsgiref handler with a wsgi.file_wrapper that uses os.sendfile(), the same way gunicorn's does"""
+
+    use_sendfile = False
+
+    def sendfile(self):
+        filelike = getattr(self.result, 'filelike', None)
+        if not self.use_sendfile or not hasattr(filelike, 'fileno') or 'Content-Length' not in self.headers:
+            return False
+        self.send_headers()
+        fileno, nbytes = filelike.fileno(), int(self.headers['Content-Length'])
+        offset, sent = os.lseek(fileno, 0, os.SEEK_CUR), 0
+        while sent < nbytes:
+            sent += os.sendfile(self.stdout.fileno(), fileno, offset + sent, nbytes - sent)
+        return True
+
+
+class RequestHandler(WSGIRequestHandler):
+    def handle(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.parse_request():
+            return
+        handler = SendfileServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(), multithread=False)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+    def log_message(self, *args):
+        pass
+
+
+def make_snapshot(data_dir: Path, size_mb: int) -> str:
+    from archivebox.index.schema import Link
+    from archivebox.index.sql import write_sql_main_index
+    from abid_utils.models import get_or_create_system_user_pk
+
+    folder = data_dir / 'archive' / TIMESTAMP
+    folder.mkdir(parents=True)
+    block = os.urandom(1024 * 1024)
+    with open(folder / 'media.mp4', 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+    write_sql_main_index([Link(timestamp=TIMESTAMP, url='https://example.com/video', title=None, tags=None, sources=['bench'])], created_by_id=get_or_create_system_user_pk())
+    return f'/archive/{TIMESTAMP}/media.mp4'
+
+
+def run_client(port: int, path: str, count: int, range_header: str) -> int:
+    output = subprocess.run(
+        [sys.executable, '-c', CLIENT, '127.0.0.1', str(port), path, str(count), range_header],
+        check=True, capture_output=True, text=True,
+    )
+    return int(output.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--size-mb', type=int, default=512, help='size of the archived file to serve')
+    parser.add_argument('--requests', type=int, default=5, help='number of full downloads (and of range requests) per mode')
+    parser.add_argument('--range-mb', type=int, default=64, help='size of each Range request')
+    args = parser.parse_args()
+
+    data_dir = Path(tempfile.mkdtemp(prefix='archivebox_bench_'))
+    subprocess.run([sys.executable, '-m', 'archivebox', 'init', '--quick'], cwd=data_dir, check=True, capture_output=True)
+    os.chdir(data_dir)
+
+    from archivebox.config.legacy import setup_django
+    setup_django(check_db=True)
+
+    from django.core.handlers.wsgi import WSGIHandler
+    from archivebox.config import SERVER_CONFIG
+
+    print(f'Creating a {args.size_mb} MB file to serve in {data_dir}...')
+    path = make_snapshot(data_dir, args.size_mb)
+
+    server = make_server('127.0.0.1', 0, WSGIHandler(), server_class=WSGIServer, handler_class=RequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    range_start = args.size_mb * 1024 * 1024 // 2
+    range_header = f'bytes={range_start}-{range_start + args.range_mb * 1024 * 1024 - 1}'
+    modes = {
+        'stream': ('stream', False),
+        'sendfile': ('sendfile', False),
+        'sendfile+os': ('sendfile', True),
+        'x-accel': ('x-accel-redirect', False),
+    }
+    print()
+    print(f'    {"mode":<14} {"request":<8} {"MB/s":>10} {"server cpu":>12}')
+    for name, (mode, use_sendfile) in modes.items():
+        SERVER_CONFIG.SERVE_STATIC_MODE = mode
+        SendfileServerHandler.use_sendfile = use_sendfile
+        for request_name, header in (('full', ''), ('range', range_header)):
+            cpu_start, start = time.process_time(), time.monotonic()
+            total = run_client(port, path, args.requests, header)
+            elapsed, cpu = time.monotonic() - start, time.process_time() - cpu_start
+            rate = f'{total / elapsed / 1024 / 1024:10.1f}' if total else f'{"(proxied)":>10}'
+            print(f'    {name:<14} {request_name:<8} {rate} {cpu:10.2f}s')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
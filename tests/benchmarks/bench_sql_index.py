@@ -0,0 +1,85 @@
+"""
+Compare the per-link write_link_to_sql_index() path against the batched write_sql_main_index().
+
+Usage:
+    python -m tests.benchmarks.bench_sql_index [--links 20000]
+
+Creates a throwaway collection in a temp dir, writes --links fake links (each with
+two tags and one ArchiveResult) through both code paths, and prints rows/sec for each.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+
+
+def make_links(num_links: int, prefix: str):
+    from archivebox.index.schema import Link, ArchiveResult
+
+    start_ts = datetime.now(timezone.utc)
+    base_ts = 1_600_000_000
+    return [
+        Link(
+            timestamp=str(base_ts + i),     # deliberately colliding timestamps between the two runs
+            url=f'https://example.com/{prefix}/{i}',
+            title=f'Example page {i}',
+            tags=f'bench,bench{i % 50}',
+            sources=['bench'],
+            history={
+                'title': [ArchiveResult(
+                    cmd=['curl', f'https://example.com/{prefix}/{i}'],
+                    pwd='.',
+                    cmd_version='1.0',
+                    output=f'Example page {i}',
+                    status='succeeded',
+                    start_ts=start_ts + timedelta(seconds=i),
+                    end_ts=start_ts + timedelta(seconds=i + 1),
+                )],
+            },
+        )
+        for i in range(num_links)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--links', type=int, default=20_000, help='number of links to write with each code path')
+    args = parser.parse_args()
+
+    data_dir = Path(tempfile.mkdtemp(prefix='archivebox_bench_'))
+    subprocess.run([sys.executable, '-m', 'archivebox', 'init', '--quick'], cwd=data_dir, check=True, capture_output=True)
+    os.chdir(data_dir)
+
+    from archivebox.config.legacy import setup_django
+    setup_django(check_db=True)
+
+    from archivebox.index.sql import write_link_to_sql_index, write_sql_main_index
+    from abid_utils.models import get_or_create_system_user_pk
+    created_by_id = get_or_create_system_user_pk()
+
+    results = {}
+
+    links = make_links(args.links, 'per-link')
+    start = time.monotonic()
+    for link in links:
+        write_link_to_sql_index(link, created_by_id=created_by_id)
+    results['write_link_to_sql_index (per link)'] = time.monotonic() - start
+
+    links = make_links(args.links, 'bulk')
+    start = time.monotonic()
+    write_sql_main_index(links, created_by_id=created_by_id)
+    results['write_sql_main_index (bulk)'] = time.monotonic() - start
+
+    print(f'Wrote {args.links} links ({args.links} snapshots + {args.links} results + {args.links * 2} snapshot tags) with each path in {data_dir}:')
+    for name, elapsed in results.items():
+        print(f'    {name:<40} {elapsed:8.2f}s   {args.links / elapsed:10.1f} links/sec')
+
+
+if __name__ == '__main__':
+    main()
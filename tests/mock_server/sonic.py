@@ -0,0 +1,98 @@
+"""
+A small in-memory stand-in for a sonic server, speaking enough of the Sonic Channel protocol
+(START, PUSH, FLUSHO, QUERY, PING, QUIT) to test the sonic search backend without running sonic.
+"""
+
+import re
+import socketserver
+import threading
+
+from collections import defaultdict
+
+PUSH_RE = re.compile(r'^PUSH (\S+) (\S+) (\S+) "(.*)"$')
+QUERY_RE = re.compile(r'^QUERY (\S+) (\S+) "(.*)"((?: \w+\(\d+\))*)$')
+
+
+class MockSonicServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password='SecretPassword', buffer_size=20000):
+        super().__init__(('127.0.0.1', 0), MockSonicHandler)
+        self.password = password
+        self.buffer_size = buffer_size
+        self.objects = defaultdict(set)         # (collection, bucket, object) -> words
+        self.connections = 0
+        self.commands = defaultdict(int)
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class MockSonicHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('CONNECTED <sonic-server v1.4.0>')
+
+        query_marker = 0
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if len(raw) > server.buffer_size:
+                self.reply('ERR buffer_overflow')
+                continue
+            command = line.split(' ', 1)[0]
+            with server.lock:
+                server.commands[command] += 1
+
+            if command == 'START':
+                _start, mode, password = line.split(' ', 2)
+                if password != server.password:
+                    self.reply('ENDED authentication_failed')
+                    return
+                self.reply(f'STARTED {mode} protocol(1) buffer({server.buffer_size})')
+            elif command == 'PUSH':
+                collection, bucket, object, text = PUSH_RE.match(line).groups()
+                words = re.findall(r'\w+', text.replace('\\"', '"').lower())
+                with server.lock:
+                    server.objects[(collection, bucket, object)].update(words)
+                self.reply('OK')
+            elif command == 'FLUSHO':
+                _flusho, collection, bucket, object = line.split(' ')
+                with server.lock:
+                    words = server.objects.pop((collection, bucket, object), set())
+                self.reply(f'RESULT {len(words)}')
+            elif command == 'QUERY':
+                collection, bucket, terms, options = QUERY_RE.match(line).groups()
+                options = dict(re.findall(r'(\w+)\((\d+)\)', options))
+                limit, offset = int(options.get('LIMIT', 10)), int(options.get('OFFSET', 0))
+                words = set(re.findall(r'\w+', terms.lower()))
+                with server.lock:
+                    matches = sorted(
+                        key[2] for key, object_words in server.objects.items()
+                            if key[:2] == (collection, bucket) and words <= object_words
+                    )
+                query_marker += 1
+                self.reply(f'PENDING q{query_marker}')
+                self.reply(' '.join(['EVENT', 'QUERY', f'q{query_marker}', *matches[offset:offset + limit]]))
+            elif command == 'PING':
+                self.reply('PONG')
+            elif command == 'QUIT':
+                self.reply('ENDED quit')
+                return
+            else:
+                self.reply('ERR unknown_command')
@@ -1,6 +1,7 @@
 import subprocess
 import json
 import sqlite3
+import sys
 
 from .fixtures import *
 
@@ -274,6 +275,34 @@ def test_jsonl_single(tmp_path, process, disable_extractors_dict):
     assert "Tag1" in tags
     assert "Tag2" in tags
 
+def test_jsonl_stream(tmp_path, process, disable_extractors_dict):
+    with open('../../mock_server/templates/example.jsonl', 'r', encoding='utf-8') as f:
+        arg_process = subprocess.run(
+            ["archivebox", "add", "--index-only", "--stream", "--parser=jsonl"],
+            stdin=f,
+            capture_output=True,
+            env=disable_extractors_dict,
+        )
+
+    conn = sqlite3.connect("index.sqlite3")
+    c = conn.cursor()
+    urls = c.execute("SELECT url from core_snapshot").fetchall()
+    tags = c.execute("SELECT name from core_tag").fetchall()
+    conn.commit()
+    conn.close()
+
+    urls = list(map(lambda x: x[0], urls))
+    assert "http://127.0.0.1:8080/static/example.com.html" in urls
+    assert "http://127.0.0.1:8080/static/iana.org.html" in urls
+    assert "http://127.0.0.1:8080/static/shift_jis.html" in urls
+    assert "http://127.0.0.1:8080/static/title_og_with_html" in urls
+    # if the following URL appears, we must have fallen back to another parser
+    assert not "http://www.example.com/should-not-exist" in urls
+
+    tags = list(map(lambda x: x[0], tags))
+    assert "Tag1" in tags
+    assert "Tag6 with Space" in tags
+
 # make sure that JSON parser rejects a single line of JSONL which is valid
 # JSON but not our expected format
 def test_json_single(tmp_path, process, disable_extractors_dict):
@@ -286,3 +315,56 @@ def test_json_single(tmp_path, process, disable_extractors_dict):
         )
 
     assert 'expects list of objects' in arg_process.stderr.decode("utf-8")
+
+
+def test_add_with_multiple_archiving_workers(tmp_path, process, disable_extractors_dict):
+    disable_extractors_dict.update({"ARCHIVING_WORKERS": "4"})
+    stdin_process = subprocess.Popen(["archivebox", "add"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     env=disable_extractors_dict)
+    output, _ = stdin_process.communicate(input="\n".join([
+        "http://127.0.0.1:8080/static/example.com.html",
+        "http://127.0.0.1:8080/static/iana.org.html",
+        "http://127.0.0.1:8080/static/shift_jis.html",
+    ]).encode())
+
+    archived_dirs = [path for path in (tmp_path / "archive").iterdir() if (path / "index.json").exists()]
+    assert len(archived_dirs) == 3
+    assert "snapshots/min" in output.decode("utf-8")
+
+DEDUPE_SCRIPT = """
+import json
+import archivebox
+from archivebox.config.legacy import setup_django
+setup_django(check_db=True)
+
+from core.models import Snapshot
+from archivebox import index
+from archivebox.index.schema import Link
+
+# use the temporary table even for a handful of urls
+index.DEDUPE_TEMP_TABLE_THRESHOLD = 0
+links = [
+    Link(timestamp=str(1600000000 + i), url=url, title=title, tags=None, sources=[])
+    for i, (url, title) in enumerate(json.loads(input()))
+]
+print(json.dumps([[link.url, link.title] for link in index.dedupe_links(Snapshot.objects.all(), links)]))
+"""
+
+def test_dedupe_links_with_a_temporary_url_table(tmp_path, process, disable_extractors_dict):
+    subprocess.run(['archivebox', 'add', 'http://127.0.0.1:8080/static/example.com.html'],
+                   capture_output=True, env=disable_extractors_dict)
+    links = [
+        ['http://127.0.0.1:8080/static/example.com.html', 'already in the index'],
+        ['http://127.0.0.1:8080/static/iana.org.html', 'first copy'],
+        ['http://127.0.0.1:8080/static/shift_jis.html', 'new'],
+        ['http://127.0.0.1:8080/static/iana.org.html', 'second copy'],
+    ]
+
+    dedupe_process = subprocess.run([sys.executable, '-c', DEDUPE_SCRIPT], input=json.dumps(links).encode(),
+                                    capture_output=True, env=disable_extractors_dict)
+
+    deduped = json.loads(dedupe_process.stdout.decode('utf-8').strip().splitlines()[-1])
+    assert deduped == [
+        ['http://127.0.0.1:8080/static/iana.org.html', 'second copy'],
+        ['http://127.0.0.1:8080/static/shift_jis.html', 'new'],
+    ]
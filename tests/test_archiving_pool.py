@@ -0,0 +1,17 @@
+from types import SimpleNamespace
+
+from archivebox.queues import pool
+from archivebox.queues.pool import ArchivingPool
+
+
+def test_resource_limits_can_be_set_to_zero(monkeypatch):
+    monkeypatch.setattr(pool.psutil, 'cpu_percent', lambda interval=None: 5.0)
+    monkeypatch.setattr(pool.psutil, 'virtual_memory', lambda: SimpleNamespace(percent=5.0))
+
+    archiving_pool = ArchivingPool(max_cpu_percent=0, max_memory_percent=0)
+    assert (archiving_pool.max_cpu_percent, archiving_pool.max_memory_percent) == (0, 0)
+    assert not archiving_pool.has_resource_budget()
+
+    archiving_pool = ArchivingPool()
+    assert archiving_pool.max_cpu_percent == pool.ARCHIVING_CONFIG.ARCHIVING_MAX_CPU_PERCENT
+    assert archiving_pool.max_memory_percent == pool.ARCHIVING_CONFIG.ARCHIVING_MAX_MEMORY_PERCENT
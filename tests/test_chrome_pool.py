@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+from archivebox.plugins_extractor.chrome import chrome_pool
+
+
+class FakeBrowser:
+    started = []
+
+    def __init__(self):
+        self.healthy = True
+        self.num_pages = 0
+        self.loads = []
+        FakeBrowser.started.append(self)
+
+    def is_healthy(self):
+        return self.healthy
+
+    def needs_recycling(self):
+        return False
+
+    def capture(self, url, outputs, timeout):
+        self.loads.append(url)
+        return {output: f'{output} of {url} #{len(self.loads)}' for output in outputs}
+
+    def close(self):
+        self.healthy = False
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeBrowser.started = []
+    config = SimpleNamespace(CHROME_USER_DATA_DIR=None, CHROME_POOL_SIZE=1, SAVE_SCREENSHOT=True, SAVE_PDF=True, SAVE_DOM=True)
+    monkeypatch.setattr(chrome_pool, 'CHROME_CONFIG', config)
+    monkeypatch.setattr(chrome_pool, 'ChromeBrowser', FakeBrowser)
+    pool = chrome_pool.ChromePool()
+    yield pool
+    pool.close()
+
+def test_outputs_of_one_page_load_are_shared(pool):
+    url = 'https://example.com'
+    assert pool.get_output('screenshot', url, '/archive/1', timeout=5) == f'screenshot of {url} #1'
+    assert pool.get_output('pdf', url, '/archive/1', timeout=5) == f'pdf of {url} #1'
+    assert pool.get_output('dom', url, '/archive/1', timeout=5) == f'dom of {url} #1'
+    assert len(FakeBrowser.started) == 1 and FakeBrowser.started[0].loads == [url]
+    assert not pool.captures
+
+    pool.get_output('screenshot', url, '/archive/2', timeout=5)
+    assert len(FakeBrowser.started) == 1 and FakeBrowser.started[0].loads == [url, url]
+
+def test_crashed_browsers_are_replaced(pool):
+    pool.get_output('screenshot', 'https://example.com', '/archive/1', timeout=5)
+    FakeBrowser.started[0].healthy = False
+
+    pool.get_output('screenshot', 'https://example.com', '/archive/2', timeout=5)
+
+    assert len(FakeBrowser.started) == 2
+    assert pool.num_browsers == 1 and pool.idle == [FakeBrowser.started[1]]
+
+def test_discarded_captures_are_not_reused(pool):
+    url = 'https://example.com'
+    pool.get_output('screenshot', url, '/archive/1', timeout=5)
+    pool.get_output('screenshot', url, '/archive/2', timeout=5)
+
+    pool.discard_captures('/archive/1')
+
+    assert pool.get_output('dom', url, '/archive/1', timeout=5) == f'dom of {url} #3'
+    assert pool.get_output('dom', url, '/archive/2', timeout=5) == f'dom of {url} #2'
@@ -1,6 +1,9 @@
 from .fixtures import *
 import json as pyjson
+import threading
+import time
 from archivebox.extractors import ignore_methods, get_default_archive_methods, should_save_title
+from archivebox.extractors import get_archive_method_dependencies, run_archive_methods
 
 def test_wget_broken_pipe(tmp_path, process, disable_extractors_dict):
     disable_extractors_dict.update({"USE_WGET": "true"})
@@ -15,6 +18,49 @@ def test_ignore_methods():
     ignored = ignore_methods(['title'])
     assert "title" not in ignored
 
+def test_archive_method_dependencies():
+    methods = get_default_archive_methods()
+    dependencies = get_archive_method_dependencies(methods)
+
+    assert dependencies['title'] == dependencies['readability'] == dependencies['htmltotext'] == {'dom', 'singlefile', 'wget'}
+    assert dependencies['favicon'] == dependencies['headers'] == dependencies['wget'] == set()
+    # the chrome methods are chained so only one of them has the chrome profile open at a time
+    assert dependencies['singlefile'] == set()
+    assert dependencies['pdf'] == {'singlefile'}
+    assert dependencies['screenshot'] == {'singlefile', 'pdf'}
+    assert dependencies['dom'] == {'singlefile', 'pdf', 'screenshot'}
+
+    # dependencies on methods that aren't going to run are dropped
+    dependencies = get_archive_method_dependencies([m for m in methods if m[0] not in ('dom', 'singlefile')])
+    assert dependencies['title'] == {'wget'}
+    assert dependencies['screenshot'] == {'pdf'}
+
+def test_archive_methods_run_as_a_dag():
+    methods = get_default_archive_methods()
+    dependencies = get_archive_method_dependencies(methods)
+    started, finished = {}, {}
+    # favicon and headers don't depend on anything, they only get past this if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def save_method(method):
+        started[method[0]] = time.monotonic()
+        if method[0] in ('favicon', 'headers'):
+            barrier.wait()
+        time.sleep(0.01)
+        finished[method[0]] = time.monotonic()
+        return method[0]
+
+    results = list(run_archive_methods(methods, save_method, max_workers=4))
+
+    assert sorted(results) == sorted((m[0], m[0]) for m in methods)
+    for method_name, depends_on in dependencies.items():
+        assert all(finished[name] <= started[method_name] for name in depends_on)
+
+def test_archive_methods_run_in_order_with_one_worker():
+    methods = get_default_archive_methods()
+    results = list(run_archive_methods(methods, lambda method: method[0], max_workers=1))
+    assert results == [(m[0], m[0]) for m in methods]
+
 def test_save_allowdenylist_works(tmp_path, process, disable_extractors_dict):
     allow_list = {
         r'/static': ["headers", "singlefile"],
@@ -139,6 +139,30 @@ def test_unrecognized_folders(tmp_path, process, disable_extractors_dict):
     assert "Skipped adding 1 invalid link data directories" in init_process.stdout.decode("utf-8")
     assert init_process.returncode == 0
 
+def test_init_resumes_from_folder_status_cache(tmp_path, process, disable_extractors_dict):
+    os.chdir(tmp_path)
+    subprocess.run(['archivebox', 'add', 'http://127.0.0.1:8080/static/example.com.html'], capture_output=True,
+                     env=disable_extractors_dict)
+    init_process = subprocess.run(['archivebox', 'init'], capture_output=True, env=disable_extractors_dict)
+    assert "Scanned 1 archive data directories" in init_process.stdout.decode("utf-8")
+    assert (tmp_path / "cache" / "folder_status.sqlite3").exists()
+
+    conn = sqlite3.connect("index.sqlite3")
+    c = conn.cursor()
+    c.execute("DELETE from core_snapshot")
+    conn.commit()
+    conn.close()
+
+    # the data folder is unchanged so it comes from the cache, but still gets re-added to the main index
+    init_process = subprocess.run(['archivebox', 'init'], capture_output=True, env=disable_extractors_dict)
+    assert "Added 1 orphaned links from existing archive directories" in init_process.stdout.decode("utf-8")
+    assert init_process.returncode == 0
+
+    conn = sqlite3.connect("index.sqlite3")
+    c = conn.cursor()
+    assert c.execute("SELECT url FROM core_snapshot").fetchall() == [("http://127.0.0.1:8080/static/example.com.html",)]
+    conn.close()
+
 def test_tags_migration(tmp_path, disable_extractors_dict):
     
     base_sqlite_path = Path(__file__).parent / 'tags_migration'
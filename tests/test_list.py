@@ -65,3 +65,19 @@ def test_link_sort_by_url(process, disable_extractors_dict):
     list_process = subprocess.run(["archivebox", "list", "--sort=url"], capture_output=True)
     link_list = list_process.stdout.decode("utf-8").split("\n")
     assert "http://127.0.0.1:8080/static/example.com.html" in link_list[0]
+
+def test_list_status_uses_folder_status_cache(tmp_path, process, disable_extractors_dict):
+    subprocess.run(["archivebox", "add", "http://127.0.0.1:8080/static/example.com.html", "--depth=0"],
+                                  capture_output=True, env=disable_extractors_dict)
+    (tmp_path / "archive" / "some_random_folder").mkdir()
+
+    list_process = subprocess.run(["archivebox", "list", "--status=unrecognized"], capture_output=True)
+    assert "some_random_folder" in list_process.stdout.decode("utf-8")
+    assert (tmp_path / "cache" / "folder_status.sqlite3").exists()
+
+    # the second run only rescans folders that changed since the first
+    (tmp_path / "archive" / "some_random_folder").rmdir()
+    list_process = subprocess.run(["archivebox", "list", "--status=unrecognized"], capture_output=True)
+    assert "some_random_folder" not in list_process.stdout.decode("utf-8")
+    list_process = subprocess.run(["archivebox", "list", "--status=valid"], capture_output=True)
+    assert "http://127.0.0.1:8080/static/example.com.html" in list_process.stdout.decode("utf-8")
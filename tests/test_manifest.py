@@ -0,0 +1,147 @@
+import json
+import hashlib
+import sqlite3
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+
+from archivebox.core.manifest import get_result_outputs, get_result_paths, get_results_key, get_output_manifest, MANIFEST_VERSION
+from archivebox.index import schema
+from archivebox.index.schema import Link
+
+from .fixtures import *
+
+
+NOW = datetime.now(timezone.utc)
+
+def make_result(extractor, embed_path, status='succeeded'):
+    return SimpleNamespace(extractor=extractor, status=status, end_ts=NOW, modified_at=NOW, embed_path=lambda: embed_path)
+
+def test_outputs_worth_showing_are_found(tmp_path):
+    (tmp_path / 'media').mkdir()
+    (tmp_path / 'media' / 'video.mp4').write_bytes(b'x' * 50_000)
+    (tmp_path / 'singlefile.html').write_bytes(b'x' * 3_000)
+    (tmp_path / 'screenshot.png').write_bytes(b'x' * 20_000)
+    (tmp_path / 'small.png').write_bytes(b'x' * 100)
+    (tmp_path / 'readability').mkdir()
+    snapshot = SimpleNamespace(link_dir=str(tmp_path))
+    results = [
+        make_result('singlefile', 'singlefile.html'),
+        make_result('readability', 'readability/content.html'),
+        make_result('title', 'title'),
+        make_result('pdf', 'output.pdf', status='failed'),
+    ]
+
+    outputs = get_result_outputs(snapshot, results)
+
+    assert outputs['singlefile'] == {'name': 'singlefile', 'path': 'singlefile.html', 'ts': outputs['singlefile']['ts'], 'size': 3_000}
+    assert outputs['screenshot.png']['path'] == 'screenshot.png'
+    assert outputs['video.mp4']['path'] == 'media/video.mp4'
+    assert 'readability' not in outputs
+    assert 'small.png' not in outputs
+
+def test_only_the_paths_an_extractor_wrote_to_are_rescanned(tmp_path):
+    (tmp_path / 'example.com').mkdir()
+    (tmp_path / 'example.com' / 'index.html').write_text('<html>')
+    (tmp_path / 'warc').mkdir()
+    (tmp_path / 'output.pdf').write_bytes(b'%PDF')
+    snapshot = SimpleNamespace(link_dir=str(tmp_path))
+    result = lambda output: SimpleNamespace(output=output, pwd=str(tmp_path))
+
+    assert get_result_paths(snapshot, 'wget', result('example.com/index.html')) == ['example.com', 'warc']
+    assert get_result_paths(snapshot, 'pdf', result('output.pdf')) == ['output.pdf']
+    assert get_result_paths(snapshot, 'title', result('Example Domain')) == []
+    assert get_result_paths(snapshot, 'archive_org', result('https://web.archive.org/web/example.com')) == []
+    assert get_result_paths(snapshot, 'pdf', result(Exception('timed out'))) == []
+
+def make_snapshot(output_manifest, results):
+    # with the annotations from with_results_key, so reading the manifest doesn't need the db
+    return SimpleNamespace(
+        output_manifest=output_manifest,
+        num_results=len(results),
+        results_modified_at=max((result.modified_at for result in results), default=None),
+        results_end_ts=max((result.end_ts for result in results), default=None),
+    )
+
+def test_current_manifest_is_returned_as_is():
+    results = [make_result('wget', 'example.com/index.html'), make_result('pdf', 'output.pdf')]
+    manifest = {'version': MANIFEST_VERSION, 'results_key': get_results_key(results), 'size': 123}
+
+    assert get_output_manifest(make_snapshot(manifest, results)) is manifest
+
+def test_missing_outdated_or_stale_manifests_are_ignored():
+    results = [make_result('wget', 'example.com/index.html')]
+    results_key = get_results_key(results)
+
+    assert get_output_manifest(make_snapshot(None, results)) is None
+    assert get_output_manifest(make_snapshot({'version': MANIFEST_VERSION - 1, 'results_key': results_key}, results)) is None
+
+    # another extractor ran (or was rerun) after the manifest was stored
+    rerun = make_result('pdf', 'output.pdf')
+    rerun.modified_at = rerun.end_ts = NOW + timedelta(minutes=1)
+    manifest = {'version': MANIFEST_VERSION, 'results_key': results_key}
+    assert get_output_manifest(make_snapshot(manifest, [*results, rerun])) is None
+
+def test_links_without_a_manifest_check_the_filesystem(tmp_path, monkeypatch):
+    monkeypatch.setattr(schema, 'ARCHIVE_DIR', tmp_path)
+    link = Link(timestamp='1600000000', url='https://example.com/page', title=None, tags=None, sources=[])
+    assert not link.is_archived
+    (tmp_path / '1600000000').mkdir()
+    (tmp_path / '1600000000' / 'singlefile.html').write_bytes(b'x' * 100)
+    assert link.is_archived
+
+    manifest = {'is_archived': False, 'size': 0, 'canonical': {}}
+    assert not link.overwrite(output_manifest=manifest).is_archived
+    assert 'output_manifest' not in link.overwrite(output_manifest=manifest).to_json()
+
+def test_manifest_records_the_results_it_was_built_from(tmp_path, process, disable_extractors_dict):
+    subprocess.run(['archivebox', 'add', 'http://127.0.0.1:8080/static/example.com.html'],
+                   capture_output=True, env=disable_extractors_dict)
+    conn = sqlite3.connect("index.sqlite3")
+    c = conn.cursor()
+    results_key = json.loads(c.execute("SELECT output_manifest from core_snapshot").fetchone()[0])['results_key']
+    num_results, latest_end_ts = c.execute("SELECT count(*), max(end_ts) from core_archiveresult").fetchone()
+    conn.close()
+
+    assert results_key[0] == num_results > 0
+    assert datetime.fromisoformat(results_key[2]).replace(tzinfo=None) == datetime.fromisoformat(latest_end_ts).replace(tzinfo=None)
+
+def test_archived_files_are_recorded(tmp_path, process, disable_extractors_dict):
+    disable_extractors_dict.update({"SAVE_HEADERS": "true"})
+    subprocess.run(['archivebox', 'add', 'http://127.0.0.1:8080/static/example.com.html'],
+                   capture_output=True, env=disable_extractors_dict)
+    archived_item_path = list(tmp_path.glob('archive/**/*'))[0]
+
+    conn = sqlite3.connect("index.sqlite3")
+    c = conn.cursor()
+    files = {path: (size, mimetype, hash) for path, size, mimetype, hash in c.execute("SELECT path, size, mimetype, hash from core_snapshotfile")}
+    manifest = json.loads(c.execute("SELECT output_manifest from core_snapshot").fetchone()[0])
+    conn.commit()
+    conn.close()
+
+    headers = (archived_item_path / 'headers.json').read_bytes()
+    assert files['headers.json'] == (len(headers), 'application/json', hashlib.sha256(headers).hexdigest())
+    assert 'index.json' in files and 'index.html' in files
+    assert manifest['headers']['Content-Type']
+    assert manifest['num_files'] == len(files)
+
+def test_update_index_only_backfills_the_recorded_files(tmp_path, process, disable_extractors_dict):
+    subprocess.run(['archivebox', 'add', 'http://127.0.0.1:8080/static/example.com.html'],
+                   capture_output=True, env=disable_extractors_dict)
+    conn = sqlite3.connect("index.sqlite3")
+    c = conn.cursor()
+    c.execute("DELETE FROM core_snapshotfile")
+    c.execute("UPDATE core_snapshot SET output_manifest = NULL")
+    conn.commit()
+    conn.close()
+
+    subprocess.run(['archivebox', 'update', '--index-only'], capture_output=True, env=disable_extractors_dict)
+
+    conn = sqlite3.connect("index.sqlite3")
+    c = conn.cursor()
+    paths = [path for path, in c.execute("SELECT path from core_snapshotfile")]
+    manifest = c.execute("SELECT output_manifest from core_snapshot").fetchone()[0]
+    conn.commit()
+    conn.close()
+
+    assert 'index.json' in paths
+    assert json.loads(manifest)['num_files'] == len(paths)
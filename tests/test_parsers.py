@@ -0,0 +1,64 @@
+from io import StringIO
+from pathlib import Path
+
+from archivebox.parsers import PARSERS, sniff_parser
+from archivebox.parsers.sniff import SNIFF_PREFIX_CHARS, sniff_parser_candidates
+
+CORPUS_DIR = Path(__file__).parent / 'parser_corpus'
+
+# one example of every supported import format, and the parser it should be detected as
+EXPECTED_PARSERS = {
+    'netscape.html': 'netscape_html',
+    'netscape_from_path.txt': 'netscape_html',
+    'pocket.html': 'pocket_html',
+    'generic.html': 'html',
+    'generic.rss': 'rss',
+    'generic.atom': 'rss',
+    'pinboard.rss': 'pinboard_rss',
+    'medium.rss': 'medium_rss',
+    'shaarli.atom': 'shaarli_rss',
+    'wallabag.atom': 'wallabag_atom',
+    'generic.json': 'json',
+    'generic.jsonl': 'jsonl',
+    'urls.txt': 'txt',
+    'notes.txt': 'txt',
+    'pocket_api.txt': 'pocket_api',
+    'readwise_reader_api.txt': 'readwise_reader_api',
+}
+
+API_PARSERS = ('pocket_api', 'readwise_reader_api')
+
+
+def test_corpus_covers_every_auto_detectable_parser():
+    assert set(PARSERS) - {'url_list'} == set(EXPECTED_PARSERS.values())
+    assert {path.name for path in CORPUS_DIR.iterdir()} == set(EXPECTED_PARSERS)
+
+def test_sniffer_detects_every_format_in_corpus():
+    for filename, parser_key in EXPECTED_PARSERS.items():
+        prefix = (CORPUS_DIR / filename).read_text()[:SNIFF_PREFIX_CHARS]
+        assert sniff_parser_candidates(prefix)[0] == parser_key, filename
+
+def test_sniffed_parser_reads_every_format_in_corpus():
+    for filename, parser_key in EXPECTED_PARSERS.items():
+        if parser_key in API_PARSERS:
+            continue
+        _parser_name, parser_func = PARSERS[parser_key]
+        with open(CORPUS_DIR / filename, 'r', encoding='utf-8') as f:
+            links = list(parser_func(f))
+        assert links, filename
+        assert all('://' in link.url for link in links), filename
+
+def test_sniffer_only_reads_a_bounded_prefix():
+    class CountingIO(StringIO):
+        chars_read = 0
+        def read(self, size=-1):
+            chunk = super().read(size)
+            self.chars_read += len(chunk)
+            return chunk
+
+    line = '<DT><A HREF="https://example.com/{}" ADD_DATE="1497562974">Example</A>\n'
+    huge_export = CountingIO(''.join(line.format(i) for i in range(100_000)))
+    huge_export.name = 'bookmarks.html'
+
+    assert sniff_parser(huge_export) == 'netscape_html'
+    assert huge_export.chars_read <= SNIFF_PREFIX_CHARS
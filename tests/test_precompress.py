@@ -0,0 +1,93 @@
+import os
+import gzip
+import shutil
+
+from archivebox.misc import precompress
+from archivebox.misc.precompress import (
+    PRECOMPRESSED_DIR_NAME,
+    compress_file,
+    get_sibling,
+    precompress_snapshot,
+    get_precompressed_size,
+    get_precompressed_variant,
+    parse_accept_encoding,
+)
+
+
+HTML = ('<html>' + '<p>hello world</p>' * 5000 + '</html>').encode()
+
+
+def make_snapshot(snapshot_dir):
+    (snapshot_dir / 'example.com').mkdir(parents=True)
+    (snapshot_dir / 'singlefile.html').write_bytes(HTML)
+    (snapshot_dir / 'example.com' / 'style.css').write_bytes(b'body{color:red}' * 200)
+    (snapshot_dir / 'example.com' / 'data.json.gz').write_bytes(gzip.compress(b'{}' * 1000))
+    (snapshot_dir / 'small.txt').write_text('tiny')
+    (snapshot_dir / 'media.mp4').write_bytes(os.urandom(5000))
+    return snapshot_dir
+
+def test_only_compressible_outputs_get_copies(tmp_path):
+    snapshot_dir = make_snapshot(tmp_path / 'archive' / '1600000000')
+    archived_gz = (snapshot_dir / 'example.com' / 'data.json.gz').read_bytes()
+
+    stats = precompress_snapshot(snapshot_dir)
+
+    assert stats.files == 2
+    assert stats.original_bytes == len(HTML) + 3000
+    assert stats.compressed_bytes == get_precompressed_size(snapshot_dir) > 0
+    copies = snapshot_dir / PRECOMPRESSED_DIR_NAME
+    assert gzip.decompress((copies / 'singlefile.html.gz').read_bytes()) == HTML
+    assert (copies / 'example.com' / 'style.css.gz').exists()
+    assert not (copies / 'small.txt.gz').exists()
+    assert not (copies / 'media.mp4.gz').exists()
+    assert not (copies / 'example.com' / 'data.json.gz.gz').exists()
+    assert (snapshot_dir / 'example.com' / 'data.json.gz').read_bytes() == archived_gz
+
+    assert precompress_snapshot(snapshot_dir).written == 0
+
+def test_copies_are_only_served_while_up_to_date(tmp_path):
+    snapshot_dir = make_snapshot(tmp_path / 'archive' / '1600000000')
+    precompress_snapshot(snapshot_dir)
+    original = snapshot_dir / 'singlefile.html'
+
+    sibling, _stat, encoding = get_precompressed_variant(snapshot_dir, 'singlefile.html', original.stat(), 'gzip, deflate')
+    assert encoding == 'gzip' and sibling == snapshot_dir / PRECOMPRESSED_DIR_NAME / 'singlefile.html.gz'
+    assert get_precompressed_variant(snapshot_dir, 'singlefile.html', original.stat(), 'gzip;q=0, deflate') is None
+    assert get_precompressed_variant(snapshot_dir, 'singlefile.html', original.stat(), None) is None
+
+    original.write_bytes(HTML + b'<!-- changed -->')
+    assert get_precompressed_variant(snapshot_dir, 'singlefile.html', original.stat(), 'gzip') is None
+    precompress_snapshot(snapshot_dir)
+    assert get_precompressed_variant(snapshot_dir, 'singlefile.html', original.stat(), 'gzip') is not None
+
+def test_copies_of_removed_outputs_are_removed(tmp_path):
+    snapshot_dir = make_snapshot(tmp_path / 'archive' / '1600000000')
+    precompress_snapshot(snapshot_dir)
+
+    (snapshot_dir / 'example.com' / 'style.css').unlink()
+    stats = precompress_snapshot(snapshot_dir)
+
+    assert stats.removed >= 1
+    assert stats.files == 1
+    assert not (snapshot_dir / PRECOMPRESSED_DIR_NAME / 'example.com').exists()
+
+def test_copies_of_outputs_rewritten_while_compressing_are_discarded(tmp_path, monkeypatch):
+    snapshot_dir = make_snapshot(tmp_path / 'archive' / '1600000000')
+    original = snapshot_dir / 'singlefile.html'
+    statobj = original.stat()
+    copyfileobj = shutil.copyfileobj
+
+    def copy_then_rewrite(src, dst, length=0):
+        copyfileobj(src, dst, length)
+        original.write_bytes(HTML + b'<!-- rewritten -->')
+        os.utime(original, ns=(statobj.st_atime_ns, statobj.st_mtime_ns + 1_000_000_000))
+    monkeypatch.setattr(precompress.shutil, 'copyfileobj', copy_then_rewrite)
+
+    sibling = get_sibling(snapshot_dir, 'singlefile.html', 'gzip')
+    assert compress_file(original, sibling, 'gzip', statobj) is False
+    assert not sibling.exists()
+    assert list(sibling.parent.iterdir()) == []
+
+def test_accept_encoding_qvalues():
+    assert parse_accept_encoding('gzip, br;q=0.5, *;q=0, identity; q=x') == {'gzip': 1.0, 'br': 0.5, '*': 0.0, 'identity': 0.0}
+    assert parse_accept_encoding(None) == {}
@@ -0,0 +1,91 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from archivebox.search import cache
+from archivebox.search.cache import SearchCache
+from archivebox.plugins_search.ripgrep import manifest
+from archivebox.plugins_search.ripgrep.manifest import shard_paths
+
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    """a manifest of 3 snapshots with 2 output files each, stored in tmp_path"""
+    monkeypatch.setattr(manifest, 'RIPGREP_CONFIG', SimpleNamespace(RIPGREP_MANIFEST=tmp_path / 'ripgrep_manifest.sqlite3', RIPGREP_SHARDS=2))
+    monkeypatch.setattr(cache, 'SEARCH_GENERATION_FILE', tmp_path / 'search_generation')
+    monkeypatch.setattr(manifest, 'SEARCH_CACHE', SearchCache(max_size=8, ttl=60))
+    results = []
+    for snapshot_id in ('snp_a', 'snp_b', 'snp_c'):
+        for name in ('singlefile.html', 'htmltotext.txt'):
+            path = tmp_path / snapshot_id / name
+            path.parent.mkdir(exist_ok=True)
+            path.write_text(f'{snapshot_id} {name}')
+            results.append((snapshot_id, str(path.parent), name))
+
+    def get_indexable_results(snapshot_ids=None):
+        return [result for result in results if snapshot_ids is None or result[0] in snapshot_ids]
+    monkeypatch.setattr(manifest, 'get_indexable_results', get_indexable_results)
+    return tmp_path
+
+def test_shards_cover_every_path_once_and_stay_under_the_arg_limit(monkeypatch):
+    paths = [f'archive/{i}/output.html' for i in range(10)]
+    assert list(shard_paths(paths[:4], 2)) == [[paths[0], paths[2]], [paths[1], paths[3]]]
+
+    monkeypatch.setattr(manifest, 'MAX_ARGS_LENGTH', 30)
+    shards = list(shard_paths(paths, 3))
+
+    assert sorted(path for shard in shards for path in shard) == paths
+    assert all(len(shard) == 1 for shard in shards)
+
+def test_every_change_bumps_the_search_generation(outputs):
+    paths = manifest.load_manifest()
+    assert len(paths) == 6 and set(paths.values()) == {'snp_a', 'snp_b', 'snp_c'}
+    generation = cache.get_search_generation()
+    assert generation is not None
+
+    manifest.remove_from_manifest(['snp_a'])
+    assert cache.get_search_generation() > generation
+    assert manifest.get_manifest_snapshot_ids() == {'snp_b', 'snp_c'}
+
+    generation = cache.get_search_generation()
+    manifest.update_manifest(['snp_a'])
+    assert cache.get_search_generation() > generation
+    assert manifest.get_manifest_snapshot_ids() == {'snp_a', 'snp_b', 'snp_c'}
+
+def test_pages_line_up_whatever_order_the_shards_finish_in(outputs, monkeypatch):
+    runs = []
+    def iter_matching_paths(text, paths):
+        runs.append(text)
+        yield from random.sample(paths, len(paths))
+    monkeypatch.setattr(manifest, 'iter_matching_paths', iter_matching_paths)
+
+    first = manifest.search_snapshot_ids('example')
+    assert first == ['snp_a', 'snp_b', 'snp_c']
+    assert manifest.search_snapshot_ids('example') == first
+    assert runs == ['example']
+
+    manifest.remove_from_manifest(['snp_b'])
+    assert manifest.search_snapshot_ids('example') == ['snp_a', 'snp_c']
+    assert runs == ['example', 'example']
+
+def test_pages_are_streamed_until_the_full_result_is_cached(outputs, monkeypatch):
+    read, closed = [], []
+    def iter_matching_paths(text, paths):
+        try:
+            for path in sorted(paths, reverse=True):
+                read.append(path)
+                yield path
+        finally:
+            closed.append(text)
+    monkeypatch.setattr(manifest, 'iter_matching_paths', iter_matching_paths)
+
+    # the first match's 2 files come out one after the other, then rg is stopped as soon as the page is full
+    assert manifest.search_page('example', limit=1, offset=1) == ['snp_b']
+    assert len(read) == 3 and closed == ['example']
+
+    # once count() or search() has cached every match, pages are slices of them in a stable order
+    assert manifest.search_snapshot_ids('example') == ['snp_a', 'snp_b', 'snp_c']
+    read.clear()
+    assert manifest.search_page('example', limit=2) == ['snp_a', 'snp_b']
+    assert read == []
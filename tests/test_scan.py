@@ -0,0 +1,21 @@
+import os
+
+from archivebox.index import scan
+
+
+def test_outputs_written_into_subfolders_are_rescanned(tmp_path, monkeypatch):
+    monkeypatch.setattr(scan, 'FOLDER_STATUS_DB', tmp_path / 'folder_status.sqlite3')
+    folder = tmp_path / 'archive' / '1600000000'
+    (folder / 'readability').mkdir(parents=True)
+
+    assert scan.scan_archive_folders(out_dir=tmp_path, workers=1)['1600000000'].outputs == ['readability']
+
+    # only the mtime of readability/ changes, not the mtime of the data folder or its index.json
+    dir_mtime = folder.stat().st_mtime
+    (folder / 'readability' / 'content.html').write_text('<html></html>')
+    os.utime(folder / 'readability', (dir_mtime + 10, dir_mtime + 10))
+    os.utime(folder, (dir_mtime, dir_mtime))
+
+    scanned = scan.scan_archive_folders(out_dir=tmp_path, workers=1)['1600000000']
+    assert scanned.outputs == ['readability', 'readability/content.html']
+    assert scanned.has_outputs('https://example.com')
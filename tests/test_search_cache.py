@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+from archivebox.search import cache
+from archivebox.search.cache import SearchCache
+
+from .fixtures import *
+
+
+def make_counter():
+    calls = []
+    def search(query):
+        calls.append(query)
+        return [f'{query}-result']
+    return search, calls
+
+def test_lru_eviction_and_hit_rate(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'SEARCH_GENERATION_FILE', tmp_path / 'search_generation')
+    search_cache, (search, calls) = SearchCache(max_size=2, ttl=60), make_counter()
+
+    for query in ('a', 'b', 'a', 'c', 'a', 'b'):
+        assert search_cache.get_or_call(('sqlite', 'search', query), lambda: search(query)) == [f'{query}-result']
+
+    # 'b' was evicted when 'c' was added, because 'a' had been used more recently
+    assert calls == ['a', 'b', 'c', 'b']
+    stats = search_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (2, 4, 2)
+    assert stats['hit_rate'] == 2 / 6
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'SEARCH_GENERATION_FILE', tmp_path / 'search_generation')
+    search_cache, (search, calls) = SearchCache(max_size=10, ttl=0), make_counter()
+
+    search_cache.get_or_call('key', lambda: search('a'))
+    search_cache.get_or_call('key', lambda: search('a'))
+    assert calls == ['a', 'a']
+
+def test_writes_to_the_index_invalidate_every_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'SEARCH_GENERATION_FILE', tmp_path / 'search_generation')
+    search_cache, (search, calls) = SearchCache(max_size=10, ttl=60), make_counter()
+
+    search_cache.get_or_call('key', lambda: search('a'))
+    search_cache.get_or_call('key', lambda: search('a'))
+    cache.bump_search_generation()
+    search_cache.get_or_call('key', lambda: search('a'))
+    cache.bump_search_generation()
+    cache.bump_search_generation()
+    search_cache.get_or_call('key', lambda: search('a'))
+
+    assert calls == ['a', 'a', 'a']
+    assert search_cache.stats()['invalidations'] == 2
+
+def test_partial_results_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'SEARCH_GENERATION_FILE', tmp_path / 'search_generation')
+    search_cache, (search, calls) = SearchCache(max_size=10, ttl=60), make_counter()
+
+    def partial_search(query):
+        cache.dont_cache_result()
+        return search(query)
+
+    search_cache.get_or_call('key', lambda: partial_search('a'))
+    search_cache.get_or_call('key', lambda: search('a'))
+    search_cache.get_or_call('key', lambda: search('a'))
+    assert calls == ['a', 'a']
+
+def test_background_indexing_invalidates_the_cache(tmp_path, process, disable_extractors_dict):
+    disable_extractors_dict.update({"SAVE_HTMLTOTEXT": "true", "SEARCH_BACKEND_ENGINE": "sqlite"})
+    subprocess.run(['archivebox', 'add', 'http://127.0.0.1:8080/static/example.com.html'],
+                   capture_output=True, env=disable_extractors_dict)
+
+    # the snapshot was indexed from the search_indexing queue at the end of the add, which bumps the generation
+    assert (tmp_path / 'cache' / 'search_generation').exists()
+
+def test_get_only_returns_what_is_already_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'SEARCH_GENERATION_FILE', tmp_path / 'search_generation')
+    search_cache, (search, calls) = SearchCache(max_size=10, ttl=60), make_counter()
+
+    assert search_cache.get(('ripgrep', 'snapshot_ids', 'a')) is None
+    search_cache.get_or_call(('ripgrep', 'snapshot_ids', 'a'), lambda: search('a'))
+    assert search_cache.get(('ripgrep', 'snapshot_ids', 'a')) == ['a-result']
+    assert calls == ['a']
+
+    cache.bump_search_generation()
+    assert search_cache.get(('ripgrep', 'snapshot_ids', 'a')) is None
+
+def test_admin_search_shows_the_cache_stats(tmp_path, monkeypatch):
+    from archivebox.core import mixins
+
+    class BaseAdmin:
+        def changelist_view(self, request, extra_context=None):
+            return extra_context
+
+    class SnapshotAdmin(mixins.SearchResultsAdminMixin, BaseAdmin):
+        pass
+
+    monkeypatch.setattr(cache, 'SEARCH_GENERATION_FILE', tmp_path / 'search_generation')
+    monkeypatch.setattr(mixins.SEARCH_BACKEND_CONFIG, 'USE_SEARCHING_BACKEND', True)
+    search_cache, (search, calls) = SearchCache(max_size=10, ttl=60), make_counter()
+    monkeypatch.setattr(mixins, 'SEARCH_CACHE', search_cache)
+    for query in ('a', 'a'):
+        search_cache.get_or_call(('sqlite', 'search', query), lambda: search(query))
+
+    context = SnapshotAdmin().changelist_view(SimpleNamespace(GET={'q': 'a'}), {'VERSION': '0.8.5'})
+    assert context['VERSION'] == '0.8.5'
+    assert (context['search_cache_stats']['hit_percent'], context['search_cache_stats']['size']) == (50, 1)
+    # not while browsing without a search
+    assert SnapshotAdmin().changelist_view(SimpleNamespace(GET={}), {}) == {}
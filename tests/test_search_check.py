@@ -0,0 +1,31 @@
+import os
+
+from archivebox.search.check import compare_index
+
+
+def write_output(path, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('some text')
+    os.utime(path, (mtime, mtime))
+    return path
+
+def test_only_the_differences_are_found(tmp_path):
+    outputs = {
+        'fresh': [write_output(tmp_path / 'fresh' / 'output.html', mtime=100)],
+        'stale': [write_output(tmp_path / 'stale' / 'output.html', mtime=100), write_output(tmp_path / 'stale' / 'content.txt', mtime=300)],
+        'missing': [write_output(tmp_path / 'missing' / 'output.html', mtime=100)],
+        'no_outputs': [],
+        'outputs_deleted': [tmp_path / 'outputs_deleted' / 'output.html'],
+        'old_record': [write_output(tmp_path / 'old_record' / 'output.html', mtime=100)],
+    }
+    indexed_times = {'fresh': 200, 'stale': 200, 'outputs_deleted': 200, 'old_record': None, 'deleted': 200}
+    indexed_ids = set(indexed_times)
+    known_ids = set(outputs)
+
+    check = compare_index(outputs, indexed_ids, indexed_times, known_ids, workers=2)
+
+    assert check.checked == 6
+    assert check.missing == ['missing']
+    assert check.stale == ['stale']
+    assert check.orphaned == ['outputs_deleted', 'deleted']
+    assert check.unverified == 1
@@ -0,0 +1,34 @@
+import time
+
+from archivebox.plugins_search.composite.fanout import FanOut, merge_ranked
+
+
+def test_merge_ranked_favors_hits_backends_agree_on():
+    merged = merge_ranked([['a', 'b', 'c'], ['c', 'd']])
+    assert merged == ['c', 'a', 'b', 'd']
+    assert merge_ranked([['a'], []]) == ['a']
+
+def test_slow_and_broken_backends_are_left_out():
+    def broken():
+        raise ValueError('backend down')
+
+    fan_out = FanOut(max_workers=4)
+    start = time.monotonic()
+    result = fan_out.call(
+        {'fast': lambda: ['a'], 'slow': lambda: time.sleep(2) or ['b'], 'broken': broken},
+        timeouts={'fast': 1, 'slow': 0.2, 'broken': 1},
+    )
+    assert time.monotonic() - start < 1
+    assert result.results == {'fast': ['a']}
+    assert result.timed_out == ['slow']
+    assert str(result.errors['broken']) == 'backend down'
+    assert result.partial
+
+def test_each_backend_gets_its_own_timeout():
+    fan_out = FanOut(max_workers=4)
+    result = fan_out.call(
+        {'quick': lambda: time.sleep(0.3) or ['a'], 'patient': lambda: time.sleep(0.3) or ['b']},
+        timeouts={'quick': 0.1, 'patient': 2},
+    )
+    assert result.results == {'patient': ['b']}
+    assert result.timed_out == ['quick']
@@ -0,0 +1,69 @@
+from archivebox.config import SEARCH_BACKEND_CONFIG
+from archivebox.search import indexing
+
+
+def use_tmp_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexing, 'SEARCH_QUEUE_DB', tmp_path / 'search_queue.sqlite3')
+
+def test_outputs_for_the_same_snapshot_are_coalesced(tmp_path, monkeypatch):
+    use_tmp_queue(tmp_path, monkeypatch)
+
+    assert indexing.queue_snapshots(['snap1'], now=100) is True
+    assert indexing.queue_snapshots(['snap1'], now=101) is False
+    assert indexing.queue_snapshots(['snap2', 'snap1'], now=102) is False
+
+    assert indexing.claim_batch(1, now=103) == {'snap1': 102}
+    assert indexing.claim_batch(10, now=103) == {'snap2': 102}
+
+    lag = indexing.get_indexing_lag(now=110)
+    assert (lag['pending'], lag['failed'], lag['lag']) == (2, 0, 10)
+
+def test_snapshots_queued_again_while_indexing_stay_queued(tmp_path, monkeypatch):
+    use_tmp_queue(tmp_path, monkeypatch)
+
+    indexing.queue_snapshots(['snap1', 'snap2'], now=100)
+    claimed = indexing.claim_batch(10, now=100)
+    indexing.queue_snapshots(['snap2'], now=105)
+    indexing.mark_indexed(claimed)
+
+    assert indexing.claim_batch(10, now=106) == {'snap2': 105}
+
+def test_claimed_batches_are_leased_to_one_worker(tmp_path, monkeypatch):
+    use_tmp_queue(tmp_path, monkeypatch)
+
+    indexing.queue_snapshots(['snap1', 'snap2'], now=100)
+    assert indexing.claim_batch(10, now=100) == {'snap1': 100, 'snap2': 100}
+    assert indexing.claim_batch(10, now=101) == {}
+
+    # the worker holding the lease died, the batch is handed out again once it runs out
+    assert indexing.claim_batch(10, now=100 + indexing.CLAIM_TIMEOUT) == {'snap1': 100, 'snap2': 100}
+
+def test_snapshots_waiting_for_a_retry_dont_stop_new_ones_being_scheduled(tmp_path, monkeypatch):
+    use_tmp_queue(tmp_path, monkeypatch)
+    monkeypatch.setattr(SEARCH_BACKEND_CONFIG, 'SEARCH_INDEX_RETRY_DELAY', 10)
+
+    indexing.queue_snapshots(['snap1'], now=0)
+    indexing.mark_failed(indexing.claim_batch(10, now=0), 'ConnectionError: backend down', now=0)
+
+    assert indexing.queue_snapshots(['snap2'], now=1) is True
+    assert indexing.queue_snapshots(['snap3'], now=2) is False
+
+def test_failed_batches_are_retried_with_backoff(tmp_path, monkeypatch):
+    use_tmp_queue(tmp_path, monkeypatch)
+    monkeypatch.setattr(SEARCH_BACKEND_CONFIG, 'SEARCH_INDEX_RETRIES', 1)
+    monkeypatch.setattr(SEARCH_BACKEND_CONFIG, 'SEARCH_INDEX_RETRY_DELAY', 10)
+
+    indexing.queue_snapshots(['snap1'], now=0)
+    indexing.mark_failed(indexing.claim_batch(10, now=0), 'ConnectionError: backend down', now=0)
+    assert indexing.claim_batch(10, now=9) == {}
+    claimed = indexing.claim_batch(10, now=10)
+    assert claimed == {'snap1': 0}
+
+    # out of retries, it's reported as failed until it's queued again
+    indexing.mark_failed(claimed, 'ConnectionError: backend down', now=10)
+    assert indexing.claim_batch(10, now=1000) == {}
+    lag = indexing.get_indexing_lag(now=1000)
+    assert (lag['pending'], lag['failed'], lag['last_error']) == (0, 1, 'ConnectionError: backend down')
+
+    assert indexing.queue_snapshots(['snap1'], now=1000) is True
+    assert indexing.claim_batch(10, now=1000) == {'snap1': 1000}
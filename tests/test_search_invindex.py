@@ -0,0 +1,57 @@
+from archivebox.plugins_search.invindex.index import InvertedIndex, parse_query
+
+
+def make_index(tmp_path, **kwargs):
+    index = InvertedIndex(tmp_path / 'search_index', **kwargs)
+    index.index_many([
+        ('snap1', 'The quick brown fox jumps over the lazy dog'),
+        ('snap2', 'A quick brown café serves the best coffee'),
+        ('snap3', 'Lazy afternoons with coffee and a dog'),
+    ])
+    return index
+
+def test_parse_query_clauses():
+    assert parse_query('fox "Brown Dog" quic* foo-bar') == [
+        ('term', ['fox']),
+        ('phrase', ['brown', 'dog']),
+        ('prefix', ['quic']),
+        ('phrase', ['foo', 'bar']),
+    ]
+
+def test_term_prefix_and_phrase_queries(tmp_path):
+    index = make_index(tmp_path)
+    assert set(index.search('coffee')) == {'snap2', 'snap3'}
+    assert set(index.search('coffee dog')) == {'snap3'}
+    assert set(index.search('cafe')) == {'snap2'}
+    assert set(index.search('jum*')) == {'snap1'}
+    assert set(index.search('"quick brown"')) == {'snap1', 'snap2'}
+    assert index.search('"brown quick"') == []
+    assert index.count('lazy') == 2
+
+def test_ranking_and_paging(tmp_path):
+    index = make_index(tmp_path)
+    index.index_many([('snap4', 'coffee coffee coffee')])
+    assert index.search('coffee')[0] == 'snap4'
+    assert index.search('coffee', limit=2, offset=1) == index.search('coffee')[1:3]
+
+def test_reindex_flush_and_merge(tmp_path):
+    index = make_index(tmp_path, max_segments=2, merge_factor=2)
+    index.index_many([('snap1', 'completely different words')])
+    index.flush(['snap3'])
+    assert index.search('fox') == []
+    assert index.search('different') == ['snap1']
+    assert set(index.search('coffee')) == {'snap2'}
+
+    for i in range(5):
+        index.index_many([(f'extra{i}', f'extra document number{i}')])
+    assert len(index.segments()) <= 2
+    assert index.count('extra') == 5
+
+    index.optimize()
+    assert len(index.segments()) == 1
+    assert index.segments()[0].num_live_docs == 7
+
+    # a fresh instance (e.g. another process) reads the same segments from disk
+    reopened = InvertedIndex(tmp_path / 'search_index')
+    assert set(reopened.search('coffee')) == {'snap2'}
+    assert reopened.search('number3') == ['extra3']
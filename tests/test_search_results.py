@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import pytest
+
+from abx.archivebox.base_searchbackend import SearchHit
+
+from archivebox import search
+from archivebox.search import SearchResults, highlight_snippet
+from archivebox.search.cache import SearchCache
+
+
+MATCHES = [f'snp_{i}' for i in range(10)]
+
+
+class FakeBackend:
+    name = 'fake'
+
+    def __init__(self):
+        self.calls = []
+
+    def search_ranked(self, text, limit, offset=0):
+        self.calls.append((offset, limit))
+        return [SearchHit(snapshot_id, snippet=f'<mark>{text}</mark> in {snapshot_id}') for snapshot_id in MATCHES[offset:offset + limit]]
+
+    def count(self, text):
+        return len(MATCHES)
+
+
+class FakeSnapshots:
+    """the parts of a Snapshot QuerySet that SearchResults uses"""
+
+    def __init__(self, pks, filtered=False):
+        self.pks = pks
+        self.query = SimpleNamespace(has_filters=lambda: filtered)
+
+    def filter(self, pk__in):
+        return FakeSnapshots([pk for pk in self.pks if pk in pk__in])
+
+    def values_list(self, field, flat=False):
+        return list(self.pks)
+
+    def __iter__(self):
+        return iter(SimpleNamespace(pk=pk) for pk in self.pks)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(search, 'import_backend', lambda: backend)
+    monkeypatch.setattr(search, 'SEARCH_CACHE', SearchCache(max_size=0, ttl=0))
+    monkeypatch.setattr(search.SEARCH_BACKEND_CONFIG, 'USE_SEARCHING_BACKEND', True)
+    monkeypatch.setattr(search.SEARCH_BACKEND_CONFIG, 'SEARCH_RESULTS_LIMIT', 4)
+    return backend
+
+def test_pages_are_fetched_in_ranked_order(backend):
+    results = SearchResults('example', snapshots=FakeSnapshots(MATCHES))
+
+    assert len(results) == 10
+    page = results[3:6]
+    assert [snap.pk for snap in page] == ['snp_3', 'snp_4', 'snp_5']
+    assert page[0].search_snippet == '<mark>example</mark> in snp_3'
+    assert [snap.pk for snap in results[8:20]] == ['snp_8', 'snp_9']
+    # only the windows of SEARCH_RESULTS_LIMIT matches that the pages fall in were fetched
+    assert backend.calls == [(0, 4), (4, 4), (8, 4)]
+
+def test_count_and_pages_only_include_snapshots_that_pass_the_filters(backend):
+    allowed = ['snp_1', 'snp_4', 'snp_5', 'snp_9']
+    results = SearchResults('example', snapshots=FakeSnapshots(allowed, filtered=True))
+
+    assert results.count() == 4
+    assert [snap.pk for snap in results[0:2]] == ['snp_1', 'snp_4']
+    assert [snap.pk for snap in results[2:4]] == ['snp_5', 'snp_9']
+    assert [snap.pk for snap in results] == allowed
+
+def test_matches_deleted_since_indexing_are_skipped(backend):
+    results = SearchResults('example', snapshots=FakeSnapshots([pk for pk in MATCHES if pk != 'snp_1']))
+
+    assert len(results) == 10
+    assert [snap.pk for snap in results[0:3]] == ['snp_0', 'snp_2']
+
+def test_snippets_highlight_every_query_term():
+    text = '<p>' + 'filler ' * 50 + 'An Example <b>domain</b> for examples & docs</p>'
+    snippet = highlight_snippet(text, 'example domain')
+
+    assert snippet.startswith('…') and snippet.endswith('…')
+    assert '<mark>Example</mark> <mark>domain</mark> for <mark>example</mark>s &amp; docs' in snippet
+    assert '<b>' not in snippet
+    assert highlight_snippet(text, 'missing') is None
+    assert highlight_snippet(text, 'a') is None
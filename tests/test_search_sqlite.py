@@ -0,0 +1,50 @@
+import sqlite3
+
+from archivebox.plugins_search.sqlite import apps as sqlite_fts
+from archivebox.plugins_search.sqlite.apps import SQLITEFTS_CONFIG, SQLITEFTS_SEARCH_BACKEND
+
+from .fixtures import *
+
+
+def test_index_many_writes_one_transaction_per_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLITEFTS_CONFIG, 'SQLITEFTS_SEPARATE_DATABASE', True)
+    monkeypatch.setattr(SQLITEFTS_CONFIG, 'SQLITEFTS_DB', str(tmp_path / 'search.sqlite3'))
+    monkeypatch.setattr(SQLITEFTS_CONFIG, 'SQLITEFTS_BATCH_SIZE', 2)
+    batches = []
+    index_rows = sqlite_fts._index_rows
+    monkeypatch.setattr(sqlite_fts, '_index_rows', lambda rows: batches.append(list(rows)) or index_rows(rows))
+
+    SQLITEFTS_SEARCH_BACKEND.index_many(
+        (f'snp_{i}', ['common words', f'unique{i}']) for i in range(5)
+    )
+
+    assert batches == [['snp_0', 'snp_1'], ['snp_2', 'snp_3'], ['snp_4']]
+    assert sorted(SQLITEFTS_SEARCH_BACKEND.search('common')) == [f'snp_{i}' for i in range(5)]
+    assert SQLITEFTS_SEARCH_BACKEND.search('unique3') == ['snp_3']
+
+    # indexing a snapshot again replaces its text instead of adding another row
+    SQLITEFTS_SEARCH_BACKEND.index_many([('snp_3', ['different words'])])
+    assert SQLITEFTS_SEARCH_BACKEND.search('unique3') == []
+    assert SQLITEFTS_SEARCH_BACKEND.list_ids() == {f'snp_{i}' for i in range(5)}
+
+def test_rebuild_index_removes_stale_entries(tmp_path, process, disable_extractors_dict):
+    disable_extractors_dict.update({"SAVE_HTMLTOTEXT": "true", "SEARCH_BACKEND_ENGINE": "sqlite"})
+    subprocess.run(['archivebox', 'add', 'http://127.0.0.1:8080/static/example.com.html'],
+                   capture_output=True, env=disable_extractors_dict)
+
+    conn = sqlite3.connect("search.sqlite3")
+    assert conn.execute("SELECT count(*) FROM snapshot_id_fts").fetchone()[0] == 1
+    conn.close()
+
+    # the snapshot no longer has any indexable output, so rebuilding should drop it from the search index
+    conn = sqlite3.connect("index.sqlite3")
+    conn.execute("UPDATE core_archiveresult SET status = 'failed' WHERE extractor = 'htmltotext'")
+    conn.commit()
+    conn.close()
+
+    subprocess.run(['archivebox', 'update', '--index-only', '--rebuild-index'],
+                   capture_output=True, env=disable_extractors_dict)
+
+    conn = sqlite3.connect("search.sqlite3")
+    assert conn.execute("SELECT count(*) FROM snapshot_id_fts").fetchone()[0] == 0
+    conn.close()
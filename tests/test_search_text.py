@@ -0,0 +1,44 @@
+import random
+
+from archivebox.search.text import DataURIStripper, strip_data_uris, iter_output_text, read_capped, content_hash
+
+HUGE_IMAGE = 'data:image/png;base64,' + 'iVBORw0KGgo' * 100_000
+
+
+def test_strip_data_uris_keeps_surrounding_text():
+    text = f'before <img src="{HUGE_IMAGE}"> after data:text/plain,kept'
+    assert strip_data_uris(text) == 'before <img src=" "> after data:text/plain,kept'
+
+def test_data_uris_split_across_chunks_are_stripped():
+    text = f'start {HUGE_IMAGE} middle {HUGE_IMAGE[:5000]}\nend'
+    expected = strip_data_uris(text)
+    rng = random.Random(0)
+    for _ in range(20):
+        stripper, output, pos = DataURIStripper(), [], 0
+        while pos < len(text):
+            size = rng.randint(1, 4000)
+            output.append(stripper.feed(text[pos:pos + size]))
+            pos += size
+        output.append(stripper.close())
+        assert ''.join(output) == expected
+    assert expected == 'start   middle  \nend'
+
+def test_html_output_is_streamed_as_text(tmp_path):
+    html = tmp_path / 'singlefile.html'
+    html.write_text(
+        '<html><head><style>body { color: red }</style></head><body>'
+        + f'<img src="{HUGE_IMAGE}" alt="a picture">'
+        + '<p>Hello world</p>' * 10_000
+        + '</body></html>'
+    )
+    chunks = list(iter_output_text(html, is_html=True))
+    text = ''.join(chunks)
+    assert len(chunks) > 1
+    assert 'color: red' not in text and 'iVBOR' not in text
+    assert '(a picture)' in text and 'Hello world' in text
+
+    assert len(read_capped(iter_output_text(html, is_html=True), 100)) == 100
+
+def test_content_hash_only_changes_with_the_text():
+    assert content_hash(['a', 'b']) == content_hash(['a', 'b'])
+    assert content_hash(['a', 'b']) != content_hash(['ab'])
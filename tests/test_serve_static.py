@@ -0,0 +1,122 @@
+import io
+import os
+import email
+from types import SimpleNamespace
+
+from django.test import RequestFactory
+
+from archivebox.core import serve_static
+from archivebox.core.serve_static import (
+    serve_static_with_byterange_support,
+    parse_range_header,
+    coalesce_ranges,
+    get_etag,
+    etag_matches,
+    if_range_matches,
+    MultipartRangedFileReader,
+)
+
+
+def test_ranges_are_clamped_merged_and_keep_their_order():
+    ranges = parse_range_header('bytes=500-599, 0-9, 5-19, 20-29, -10, 2000-3000', 1000)
+    assert coalesce_ranges(ranges, 1000) == [(500, 600), (0, 30), (990, 1000)]
+
+def test_unsatisfiable_ranges_are_dropped():
+    assert coalesce_ranges(parse_range_header('bytes=1000-1999', 1000), 1000) == []
+    assert coalesce_ranges(parse_range_header('bytes=900-1999', 1000), 1000) == [(900, 1000)]
+    assert coalesce_ranges(parse_range_header('bytes=1000-', 100), 100) == []
+    assert coalesce_ranges(parse_range_header('bytes=0-1,1000-', 100), 100) == [(0, 2)]
+    assert parse_range_header('bytes=5-2', 100) is None
+
+def serve(monkeypatch, document_root, path, mode='sendfile', **headers):
+    monkeypatch.setattr(serve_static, 'SERVER_CONFIG', SimpleNamespace(SERVE_STATIC_MODE=mode, SERVE_STATIC_ACCEL_PREFIX='/_archivebox_data/'))
+    request = RequestFactory().get('/', **{'HTTP_' + name.upper(): value for name, value in headers.items()})
+    response = serve_static_with_byterange_support(request, path, document_root=str(document_root))
+    body = b''.join(response.streaming_content) if response.streaming else response.content
+    return response, body
+
+def test_open_ended_ranges_past_the_end(tmp_path, monkeypatch):
+    data = bytes(range(100))
+    (tmp_path / 'media.mp4').write_bytes(data)
+
+    response, _ = serve(monkeypatch, tmp_path, 'media.mp4', range='bytes=1000-')
+    assert response.status_code == 416 and response['Content-Range'] == 'bytes */100'
+
+    response, body = serve(monkeypatch, tmp_path, 'media.mp4', range='bytes=0-1,1000-')
+    assert response.status_code == 206 and response['Content-Range'] == 'bytes 0-1/100'
+    assert body == data[:2]
+
+def test_ranges_are_sent_with_their_own_length(tmp_path, monkeypatch):
+    data = os.urandom(100_000)
+    (tmp_path / 'media.mp4').write_bytes(data)
+
+    for mode in ('sendfile', 'stream'):
+        response, body = serve(monkeypatch, tmp_path, 'media.mp4', mode=mode, range='bytes=1000-1999')
+        assert response.status_code == 206
+        assert response['Content-Length'] == '1000' and response['Content-Range'] == 'bytes 1000-1999/100000'
+        assert body == data[1000:2000]
+
+    response, body = serve(monkeypatch, tmp_path, 'media.mp4')
+    assert response.status_code == 200 and response['Content-Length'] == '100000' and body == data
+
+def test_proxy_is_only_handed_files_inside_the_data_dir(tmp_path, monkeypatch):
+    data_dir, outside = tmp_path / 'data', tmp_path / 'outside'
+    (data_dir / 'archive' / '1600000000').mkdir(parents=True)
+    (data_dir / 'archive' / '1600000000' / 'page one.html').write_text('<html>inside</html>')
+    outside.mkdir()
+    (outside / 'secret.html').write_text('<html>outside</html>')
+    (data_dir / 'archive' / '1600000000' / 'link.html').symlink_to(outside / 'secret.html')
+    monkeypatch.setattr(serve_static, 'DATA_DIR', data_dir)
+    snapshot_dir = data_dir / 'archive' / '1600000000'
+
+    response, body = serve(monkeypatch, snapshot_dir, 'page one.html', mode='x-accel-redirect')
+    assert response['X-Accel-Redirect'] == '/_archivebox_data/archive/1600000000/page%20one.html' and body == b''
+    response, body = serve(monkeypatch, snapshot_dir, 'page one.html', mode='x-sendfile')
+    assert response['X-Sendfile'] == str(snapshot_dir / 'page one.html') and body == b''
+
+    # in both modes, files that resolve to somewhere outside of DATA_DIR are sent by Django instead
+    for mode in ('x-accel-redirect', 'x-sendfile'):
+        response, body = serve(monkeypatch, snapshot_dir, 'link.html', mode=mode)
+        assert 'X-Accel-Redirect' not in response and 'X-Sendfile' not in response
+        assert body == b'<html>outside</html>'
+
+def test_etags_are_weak_while_the_file_may_still_be_changing(tmp_path):
+    path = tmp_path / 'output.html'
+    path.write_text('some html')
+    assert get_etag(os.stat(path)).startswith('W/"')
+
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+    etag = get_etag(os.stat(path))
+    assert etag.startswith('"')
+
+    path.write_text('other html')
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+    assert get_etag(os.stat(path)) != etag
+
+def test_etag_comparison():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('*', '"b"')
+    assert etag_matches('W/"b"', '"b"', weak=True)
+    assert not etag_matches('W/"b"', '"b"')
+    assert not etag_matches('W/"b"', 'W/"b"')
+    assert not etag_matches('"c"', '"b"', weak=True)
+
+def test_if_range():
+    assert if_range_matches(None, '"b"', 1_000_000_000)
+    assert if_range_matches('"b"', '"b"', 1_000_000_000)
+    assert not if_range_matches('"a"', '"b"', 1_000_000_000)
+    assert if_range_matches('Sun, 09 Sep 2001 01:46:40 GMT', '"b"', 1_000_000_000.5)
+    assert not if_range_matches('Sun, 09 Sep 2001 01:46:41 GMT', '"b"', 1_000_000_000)
+
+def test_multipart_body():
+    data = bytes(range(256)) * 4
+    reader = MultipartRangedFileReader(io.BytesIO(data), [(1000, 1024), (0, 10)], 'video/mp4', len(data))
+    body = b''.join(reader)
+    assert len(body) == reader.content_length
+
+    message = email.message_from_bytes(b'Content-Type: ' + reader.content_type.encode() + b'\r\n\r\n' + body)
+    parts = [(part['Content-Type'], part['Content-Range'], part.get_payload(decode=True)) for part in message.get_payload()]
+    assert parts == [
+        ('video/mp4', 'bytes 1000-1023/1024', data[1000:]),
+        ('video/mp4', 'bytes 0-9/1024', data[:10]),
+    ]
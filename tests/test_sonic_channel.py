@@ -0,0 +1,74 @@
+import threading
+
+from archivebox.plugins_search.sonic.channel import SonicChannelPool, SonicError, split_text
+
+from .mock_server.sonic import MockSonicServer
+
+
+def make_pool(server, mode, size=2):
+    return SonicChannelPool('127.0.0.1', server.port, server.password, mode=mode, size=size)
+
+def test_split_text_breaks_at_whitespace():
+    chunks = list(split_text('alpha beta gamma delta', 11))
+    assert chunks == ['alpha beta', 'gamma delta']
+    assert all(len(chunk) <= 11 for chunk in chunks)
+
+def test_pipelined_push_query_and_flush():
+    with MockSonicServer() as server:
+        ingest, search = make_pool(server, 'ingest'), make_pool(server, 'search')
+
+        chunks = [f'word{i} common "quoted"\nline' for i in range(500)]
+        pushed = ingest.call(lambda channel: channel.push_many('archivebox', 'archivebox', 'snap1', chunks, depth=16))
+        ingest.call(lambda channel: channel.push_many('archivebox', 'archivebox', 'snap2', ['common other']))
+        assert pushed == 500
+        assert server.commands['PUSH'] == 501
+
+        assert search.call(lambda channel: channel.query('archivebox', 'archivebox', 'common')) == ['snap1', 'snap2']
+        assert search.call(lambda channel: channel.query('archivebox', 'archivebox', 'word499 quoted')) == ['snap1']
+        assert search.call(lambda channel: channel.query('archivebox', 'archivebox', 'common', limit=1, offset=1)) == ['snap2']
+
+        ingest.call(lambda channel: channel.flush_objects('archivebox', 'archivebox', ['snap1', 'missing']))
+        assert search.call(lambda channel: channel.query('archivebox', 'archivebox', 'common')) == ['snap2']
+
+        # every call above reused the same one channel per mode instead of reconnecting
+        assert server.connections == 2
+
+def test_pool_is_bounded_and_shared_between_threads():
+    with MockSonicServer() as server:
+        ingest = make_pool(server, 'ingest', size=3)
+
+        def push(i):
+            ingest.call(lambda channel: channel.push_many('archivebox', 'archivebox', f'snap{i}', [f'text{i}'] * 20))
+
+        threads = [threading.Thread(target=push, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert server.commands['PUSH'] == 400
+        assert server.connections <= 3
+
+def test_errors_are_raised_without_losing_the_channel():
+    with MockSonicServer(buffer_size=100) as server:
+        ingest = make_pool(server, 'ingest', size=1)
+        try:
+            ingest.call(lambda channel: channel.push_many('archivebox', 'archivebox', 'snap1', ['ok', 'x' * 200, 'ok again']))
+            raise AssertionError('expected a SonicError')
+        except SonicError as err:
+            assert 'buffer_overflow' in str(err)
+
+        ingest.call(lambda channel: channel.ping())
+        assert server.connections == 1
+
+def test_reconnects_when_a_pooled_channel_has_gone_stale():
+    with MockSonicServer() as server:
+        search = make_pool(server, 'search', size=1)
+        search.call(lambda channel: channel.ping())
+
+        # simulate sonic closing the idle channel after its tcp_timeout
+        with search.channel() as channel:
+            channel.sock.shutdown(2)
+
+        assert search.call(lambda channel: channel.query('archivebox', 'archivebox', 'anything')) == []
+        assert server.connections == 2